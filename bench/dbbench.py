@@ -0,0 +1,378 @@
+#!/usr/bin/env python2.7
+"""
+Microbenchmarks of the x/84 database layer and message base.
+
+Synthetic databases are created in a temporary ``datapath``, then each
+benchmark is measured in either or both modes:
+
+- ``direct``: :class:`x84.bbs.dbproxy.DBProxy` opens the database in the
+  calling process, as used by the engine, web and msgpoll threads.
+- ``session``: commands are sent over IPC pipes from a session process
+  and executed by :class:`x84.db.DBHandler` threads of a stand-in for the
+  engine, as used by all session scripts.
+
+Benchmarks are:
+
+- ``proxy_get``, ``proxy_set``, ``proxy_keys``, ``proxy_items`` and
+  ``proxy_iteritems``: ``DBProxy`` methods on a database of ``--keys``
+  entries.
+- ``msg_save`` and ``list_msgs``: :meth:`x84.bbs.msgbase.Msg.save` and
+  :func:`x84.bbs.msgbase.list_msgs` by tag, at each of ``--msgs`` sizes
+  of message base.
+- ``user_get`` and ``user_set``: :meth:`x84.bbs.userbase.User.get` and
+  ``User.__setitem__`` of user attributes.
+- ``find_user``: :func:`x84.bbs.userbase.find_user` at each of ``--users``
+  sizes of user base.
+
+Example::
+
+    python bench/dbbench.py --mode=both --users=10000,100000 \\
+        --output=dbbench.json
+
+Operations per second and latency percentiles of each are reported, and
+written as json by ``--output``.
+"""
+from __future__ import print_function
+
+# std imports
+import multiprocessing
+import argparse
+import datetime
+import tempfile
+import platform
+import logging
+import random
+import shutil
+import json
+import time
+import sys
+
+# local, bench/ is the first item of sys.path when run as a script.
+from telnet_load import percentiles
+
+#: all benchmarks, in order of execution.
+BENCHMARKS = ('proxy_get', 'proxy_set', 'proxy_keys', 'proxy_items',
+              'proxy_iteritems', 'msg_save', 'list_msgs',
+              'user_get', 'user_set', 'find_user')
+
+#: schema of database used by ``proxy_*`` benchmarks.
+BENCH_SCHEMA = 'dbbench'
+
+#: tags given to synthetic messages, the first is used by ``list_msgs``.
+TAGS = (u'public', u'general', u'x84net', u'chat', u'art')
+
+
+def init_config(datapath):
+    """ Initialize x/84 configuration singleton for ``datapath``. """
+    import x84.bbs.ini
+    cfg = x84.bbs.ini.init_bbs_ini()
+    cfg.set('system', 'datapath', datapath)
+    # measure the database, not the slow-operation log.
+    cfg.set('session', 'db_slow_threshold', '0')
+    cfg.set('session', 'tap_db', 'no')
+    x84.bbs.ini.CFG = cfg
+
+
+def populate(schema, items, table='unnamed'):
+    """ Bulk-write ``items`` to database ``schema`` in one transaction. """
+    import sqlitedict
+    from x84.db import get_db_filepath, check_db
+    filepath = get_db_filepath(schema)
+    check_db(filepath)
+    dictdb = sqlitedict.SqliteDict(filename=filepath, tablename=table,
+                                   autocommit=False)
+    try:
+        dictdb.clear()
+        dictdb.update(dict(items))
+        dictdb.commit()
+    finally:
+        dictdb.close()
+
+
+def populate_msgs(num):
+    """ Create message base of ``num`` messages, tagged by :data:`TAGS`. """
+    from x84.bbs.msgbase import Msg, MSGDB, TAGDB
+    msgs, tags = list(), dict((tag, set()) for tag in TAGS)
+    for idx in range(num):
+        msg = Msg(recipient=None, subject=u'subject {0}'.format(idx),
+                  body=u'body of message\r\n' * 20)
+        msg.idx = idx
+        msg.author = u'user{0}'.format(idx % 100)
+        msg.tags = set(TAGS[:1] + TAGS[1 + idx % (len(TAGS) - 1):][:1])
+        # pylint: disable=W0212
+        #         Access to a protected member _stime
+        msg._stime = datetime.datetime.now()
+        for tag in msg.tags:
+            tags[tag].add(idx)
+        msgs.append(('%d' % (idx,), msg))
+    populate(MSGDB, msgs)
+    populate(TAGDB, tags.items())
+
+
+def populate_users(num):
+    """ Create user base of ``num`` users. """
+    from x84.bbs.userbase import User, USERDB
+    handles = [u'user{0}'.format(idx) for idx in range(num)]
+    populate(USERDB, ((handle, User(handle)) for handle in handles))
+    populate(USERDB, ((handle, dict(calls=idx))
+                      for idx, handle in enumerate(handles)), table='attrs')
+    return handles
+
+
+def measure(name, func, ops, size=None):
+    """
+    Call ``func`` ``ops`` times, returning dictionary of results.
+
+    :param str name: benchmark name.
+    :param callable func: given the iteration number of each call.
+    :param int ops: number of calls.
+    :param int size: size of database, when relevant.
+    """
+    latencies = []
+    stime = time.time()
+    for num in range(ops):
+        ctime = time.time()
+        func(num)
+        latencies.append(time.time() - ctime)
+    elapsed = time.time() - stime
+    return {'name': name, 'size': size, 'ops': ops,
+            'ops_per_sec': ops / elapsed if elapsed else None,
+            'latency': percentiles(latencies)}
+
+
+def run_benchmarks(options, names):
+    """ Run benchmarks by ``names``, returning list of results. """
+    # pylint: disable=R0914
+    #         Too many local variables
+    from x84.bbs.dbproxy import DBProxy
+    from x84.bbs.msgbase import Msg, list_msgs
+    from x84.bbs.userbase import User, find_user
+
+    results = []
+    rand = random.Random(options.seed)
+    keys = ['key{0}'.format(idx) for idx in range(options.keys)]
+    value = {'value': u'x' * options.value_size}
+
+    def proxy_get(_):
+        """ DBProxy.__getitem__ of random key. """
+        return DBProxy(BENCH_SCHEMA)[rand.choice(keys)]
+
+    def proxy_set(_):
+        """ DBProxy.__setitem__ of random key. """
+        DBProxy(BENCH_SCHEMA)[rand.choice(keys)] = value
+
+    def proxy_keys(_):
+        """ DBProxy.keys. """
+        return DBProxy(BENCH_SCHEMA).keys()
+
+    def proxy_items(_):
+        """ DBProxy.items. """
+        return DBProxy(BENCH_SCHEMA).items()
+
+    def proxy_iteritems(_):
+        """ DBProxy.iteritems, exhausted. """
+        return list(DBProxy(BENCH_SCHEMA).iteritems())
+
+    def msg_save(num):
+        """ Msg.save of a new public message. """
+        msg = Msg(recipient=None, subject=u'benchmark {0}'.format(num),
+                  body=u'body of message\r\n' * 20)
+        msg.tags = set(TAGS[:2])
+        msg.save(send_net=False)
+
+    def list_msgs_by_tag(_):
+        """ list_msgs of first tag. """
+        return list_msgs(tags=TAGS[:1])
+
+    if set(names) & set(BENCHMARKS[:5]):
+        populate(BENCH_SCHEMA, ((key, value) for key in keys))
+    for name, func in (('proxy_get', proxy_get),
+                       ('proxy_set', proxy_set),
+                       ('proxy_keys', proxy_keys),
+                       ('proxy_items', proxy_items),
+                       ('proxy_iteritems', proxy_iteritems)):
+        if name in names:
+            ops = options.ops if name in ('proxy_get', 'proxy_set') else (
+                max(1, options.ops // 10))
+            results.append(measure(name, func, ops, size=options.keys))
+
+    for size in options.msgs:
+        if not set(names) & set(('msg_save', 'list_msgs')):
+            break
+        populate_msgs(size)
+        if 'list_msgs' in names:
+            results.append(measure('list_msgs', list_msgs_by_tag,
+                                   max(1, options.ops // 10), size=size))
+        if 'msg_save' in names:
+            results.append(measure('msg_save', msg_save,
+                                   max(1, options.ops // 10), size=size))
+
+    if set(names) & set(('user_get', 'user_set')):
+        handles = populate_users(1000)
+        user = User(handles[-1])
+        if 'user_get' in names:
+            results.append(measure('user_get', lambda _: user.get('calls'),
+                                   options.ops, size=len(handles)))
+        if 'user_set' in names:
+            results.append(measure(
+                'user_set', lambda num: user.__setitem__('calls', num),
+                options.ops, size=len(handles)))
+
+    for size in options.users:
+        if 'find_user' not in names:
+            break
+        handles = populate_users(size)
+        targets = [handles[-1].upper(), u'nobody']
+        results.append(measure(
+            'find_user', lambda num: find_user(targets[num % 2]),
+            max(2, options.ops // 100), size=size))
+
+    return results
+
+
+def session_process(child_pipes, options, names):
+    """
+    A ``multiprocessing.Process`` target, benchmarks as a session.
+
+    A :class:`x84.bbs.session.Session` is created without a terminal, such
+    that ``DBProxy`` instances send database commands over ``child_pipes``
+    to :func:`serve_session`.  The results are returned by event
+    ``bench-result``.
+    """
+    from x84.bbs import session
+    from x84.bbs.script_def import Script
+    from x84.bbs.userbase import User
+    from x84 import metrics
+
+    metrics.reset()
+    # pylint: disable=W0212
+    #         Access to a protected member
+    stub = session.Session.__new__(session.Session)
+    stub.log = logging.getLogger(session.__name__)
+    stub.sid = 'dbbench'
+    stub.writer, stub.reader = child_pipes
+    stub._buffer = dict()
+    stub._script_stack = [Script(name='dbbench', args=(), kwargs={})]
+    stub._last_report_time = time.time()
+    stub._user = User(u'dbbench')
+    session.SESSION = stub
+
+    stub.send_event('bench-result', run_benchmarks(options, names))
+
+
+def serve_session(options, names):
+    """
+    Run benchmarks in a session process, serving its database commands.
+
+    Database events are dispatched by :class:`x84.db.DBHandler` threads as
+    done by :func:`x84.engine.session_recv`.
+    """
+    from x84.db import DBHandler
+
+    child_read, master_write = multiprocessing.Pipe(duplex=False)
+    master_read, child_write = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(
+        target=session_process,
+        args=((child_write, child_read), options, names))
+    proc.start()
+    results = None
+    while results is None and (proc.is_alive() or master_read.poll()):
+        if not master_read.poll(0.5):
+            continue
+        event, data = master_read.recv()
+        if event.startswith('db'):
+            DBHandler(master_write, event, data, script='dbbench').start()
+        elif event == 'bench-result':
+            results = data
+    proc.join()
+    if results is None:
+        raise RuntimeError('session process exited with code {0}'
+                           .format(proc.exitcode))
+    return results
+
+
+def summarize(results):
+    """ Print human-readable table of ``results``. """
+    print('{0:<8}{1:<16}{2:>8}{3:>8}{4:>12}{5:>11}{6:>11}{7:>11}'.format(
+        'mode', 'benchmark', 'size', 'ops', 'ops/sec',
+        'p50 ms', 'p90 ms', 'p99 ms'))
+    for result in results:
+        lat = result['latency']
+        print('{0:<8}{1:<16}{2:>8}{3:>8}{4:>12.1f}{5:>11.3f}{6:>11.3f}'
+              '{7:>11.3f}'.format(result['mode'], result['name'],
+                                  result['size'] or '', result['ops'],
+                                  result['ops_per_sec'] or 0,
+                                  lat['p50'] * 1000, lat['p90'] * 1000,
+                                  lat['p99'] * 1000))
+
+
+def int_list(value):
+    """ Parse comma-delimited list of integers. """
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def parse_args(args=None):
+    """ Parse command line arguments. """
+    parser = argparse.ArgumentParser(
+        description='Microbenchmarks of the x/84 database layer.')
+    parser.add_argument('--mode', choices=('direct', 'session', 'both'),
+                        default='both')
+    parser.add_argument('--bench', type=lambda val: val.split(','),
+                        default=list(BENCHMARKS),
+                        help='comma-delimited benchmarks to run ({0}).'
+                        .format(', '.join(BENCHMARKS)))
+    parser.add_argument('--ops', type=int, default=1000,
+                        help='operations of each get/set benchmark; '
+                             'others perform fewer.')
+    parser.add_argument('--keys', type=int, default=1000,
+                        help='entries of database for proxy_* benchmarks.')
+    parser.add_argument('--value-size', type=int, default=256)
+    parser.add_argument('--msgs', type=int_list, default=[100, 1000, 5000],
+                        help='message base sizes for msg_save, list_msgs.')
+    parser.add_argument('--users', type=int_list, default=[10000, 100000],
+                        help='user base sizes for find_user.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--datapath',
+                        help='folder for databases, default is a temporary '
+                             'folder removed on exit.')
+    parser.add_argument('--output', help='write json results to filepath.')
+    options = parser.parse_args(args)
+    unknown = set(options.bench) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmark: {0}'.format(', '.join(unknown)))
+    return options
+
+
+def main():
+    """ Command-line entry point. """
+    options = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    datapath = options.datapath or tempfile.mkdtemp(prefix='x84-dbbench-')
+    init_config(datapath)
+    modes = ('direct', 'session') if options.mode == 'both' else (
+        options.mode,)
+    results = []
+    try:
+        for mode in modes:
+            if mode == 'direct':
+                mode_results = run_benchmarks(options, options.bench)
+            else:
+                mode_results = serve_session(options, options.bench)
+            for result in mode_results:
+                result['mode'] = mode
+            results.extend(mode_results)
+    finally:
+        if not options.datapath:
+            shutil.rmtree(datapath)
+    summarize(results)
+    if options.output:
+        with open(options.output, 'w') as out_fp:
+            json.dump({'params': vars(options),
+                       'started': time.time(),
+                       'python': platform.python_version(),
+                       'results': results}, out_fp, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+#!/usr/bin/env python2.7
+"""
+Message network polling of x/84 against stand-in hubs.
+
+Each hub is a process serving :class:`x84.webmodules.msgserve.MessageApi`
+on localhost, with its own ``datapath``, a keys database of the leaf's
+board, and ``--hub-msgs`` messages of another board for the leaf to pull.
+A hub rejects messages having subject :data:`REJECT_SUBJECT`, as by
+``400 Bad Request`` of a malformed message.
+
+The leaf is this process, a member of ``--hubs`` networks of the stand-in
+hubs, and of a network of a hub that cannot be reached.  It queues
+``--msgs`` messages and ``--rejects`` messages to be rejected for each
+network, then calls :func:`x84.msgpoll.poll` ``--polls`` times.
+
+Example::
+
+    python bench/msgnet_hub.py --hubs=2 --msgs=500 --polls=3
+
+The time of each poll, and the state of each network after the last are
+reported.  Exit status is 0 when messages were published to and pulled
+from each hub, rejected messages discarded after ``push_max_rejects``
+polls without delaying the network, and the unreachable network delayed;
+otherwise 1.
+"""
+from __future__ import print_function
+
+# std imports
+import multiprocessing
+import wsgiref.simple_server
+import SocketServer
+import argparse
+import tempfile
+import logging
+import shutil
+import socket
+import time
+import sys
+import os
+
+#: subject of messages rejected by stand-in hubs.
+REJECT_SUBJECT = u'reject me'
+
+#: board id and token of the leaf, as given by each hub.
+BOARD_ID, TOKEN = 'leaf', 'bench-token'
+
+
+class ThreadingWSGIServer(SocketServer.ThreadingMixIn,
+                          wsgiref.simple_server.WSGIServer):
+
+    """ WSGI server answering each request by a thread. """
+
+    daemon_threads = True
+
+
+class QuietHandler(wsgiref.simple_server.WSGIRequestHandler):
+
+    """ Request handler not logging each request to stderr. """
+
+    def log_message(self, *args):
+        pass
+
+
+def init_config(datapath):
+    """ Initialize x/84 configuration singleton for ``datapath``. """
+    import x84.bbs.ini
+    cfg = x84.bbs.ini.init_bbs_ini()
+    cfg.set('system', 'datapath', datapath)
+    cfg.set('session', 'tap_db', 'no')
+    x84.bbs.ini.CFG = cfg
+    return cfg
+
+
+def make_msg(subject, tags, body=u'bench message body.'):
+    """ Return new :class:`x84.bbs.msgbase.Msg` of public ``tags``. """
+    from x84.bbs.msgbase import Msg
+    msg = Msg(recipient=None, subject=subject, body=body)
+    msg.author = u'bench'
+    msg.tags = set([u'public']) | set(tags)
+    return msg
+
+
+def serve_hub(name, datapath, num_msgs, port_queue):
+    """
+    Serve message network ``name`` as a hub, process target.
+
+    The port of the server is put to ``port_queue`` once listening.
+    """
+    import web
+    cfg = init_config(datapath)
+    cfg.set('msg', 'server_tags', name)
+    cfg.set('msg', 'network_tags', '')
+
+    from x84.bbs import DBProxy
+    from x84.webmodules import msgserve
+    DBProxy('{0}keys'.format(name), use_session=False)[BOARD_ID] = TOKEN
+    # message index 0 is never served, the cursor of a leaf that has not
+    # yet pulled is -1, taken as 0 by MessageApi.GET; so it is not of the
+    # network.
+    make_msg(u'hub {0} local message'.format(name), []).save()
+    for num in range(num_msgs):
+        msg = make_msg(u'hub {0} message {1}'.format(name, num), [name])
+        msg.save()
+
+    parse_message = msgserve.parse_message
+
+    def rejecting_parse_message(pullmsg, network):
+        """ Parse message, rejecting those of :data:`REJECT_SUBJECT`. """
+        if pullmsg.get('subject') == REJECT_SUBJECT:
+            raise ValueError('rejected by stand-in hub')
+        return parse_message(pullmsg, network)
+    msgserve.parse_message = rejecting_parse_message
+
+    module = msgserve.web_module()
+    app = web.application(module['urls'], module['funcs'], autoreload=False)
+    server = wsgiref.simple_server.make_server(
+        '127.0.0.1', 0, app.wsgifunc(),
+        server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def unused_port():
+    """ Return a port of localhost refusing connections. """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def init_leaf(cfg, hubs, options):
+    """
+    Configure leaf networks of ``hubs``, a list of ``(name, port)``.
+
+    Messages of ``options`` are queued for each network.
+    """
+    cfg.set('msg', 'network_tags', ','.join(name for name, _ in hubs))
+    cfg.set('msg', 'server_tags', '')
+    cfg.set('msg', 'push_max_rejects', str(options.polls))
+    for name, port in hubs:
+        section = 'msgnet_{0}'.format(name)
+        cfg.add_section(section)
+        cfg.set(section, 'url_base', 'http://127.0.0.1:{0}/'.format(port))
+        cfg.set(section, 'token', TOKEN)
+        cfg.set(section, 'board_id', BOARD_ID)
+
+    for name, _ in hubs:
+        for num in range(options.msgs):
+            make_msg(u'leaf message {0}'.format(num),
+                     [name]).save()
+        for _ in range(options.rejects):
+            make_msg(REJECT_SUBJECT, [name]).save()
+
+
+def network_state(name):
+    """ Return ``(queued, pulled, failures, delayed)`` of network ``name``. """
+    from x84.bbs import DBProxy, list_msgs
+    from x84.bbs.msgbase import MSGDB
+    from x84.msgpoll import POLL_DB
+    queued = len(DBProxy('{0}queues'.format(name), use_session=False))
+    db_msg = DBProxy(MSGDB, use_session=False)
+    pulled = len([idx for idx in list_msgs(tags=(name,))
+                  if db_msg[str(idx)].subject.startswith(u'hub ')])
+    state = DBProxy(POLL_DB, use_session=False).get(
+        name, {'failures': 0, 'retry_after': 0})
+    return (queued, pulled, state['failures'],
+            state['retry_after'] > time.time())
+
+
+def parse_args(args=None):
+    """ Parse command line arguments. """
+    parser = argparse.ArgumentParser(
+        description='Message network polling against stand-in hubs.')
+    parser.add_argument('--hubs', type=int, default=2,
+                        help='number of stand-in hubs.')
+    parser.add_argument('--msgs', type=int, default=100,
+                        help='messages queued by the leaf for each hub.')
+    parser.add_argument('--hub-msgs', type=int, default=100,
+                        help='messages of each hub pulled by the leaf.')
+    parser.add_argument('--rejects', type=int, default=2,
+                        help='messages queued for each hub it rejects.')
+    parser.add_argument('--polls', type=int, default=3,
+                        help='number of polls, also push_max_rejects.')
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args(args)
+
+
+def main():
+    """ Command-line entry point. """
+    options = parse_args()
+    logging.basicConfig(level=logging.INFO if options.verbose
+                        else logging.CRITICAL)
+    tmpdir = tempfile.mkdtemp()
+    processes, hubs = list(), list()
+    try:
+        port_queue = multiprocessing.Queue()
+        for num in range(options.hubs):
+            name = 'hub{0}'.format(num)
+            datapath = os.path.join(tmpdir, name)
+            os.makedirs(datapath)
+            proc = multiprocessing.Process(
+                target=serve_hub, name=name,
+                args=(name, datapath, options.hub_msgs, port_queue))
+            proc.daemon = True
+            proc.start()
+            processes.append(proc)
+            # hubs are started in turn, so that ports are in order.
+            hubs.append((name, port_queue.get(timeout=60)))
+        unreachable = 'hub{0}'.format(options.hubs)
+        hubs.append((unreachable, unused_port()))
+
+        datapath = os.path.join(tmpdir, 'leaf')
+        os.makedirs(datapath)
+        cfg = init_config(datapath)
+        init_leaf(cfg, hubs, options)
+
+        from x84 import msgpoll
+        for num in range(options.polls):
+            stime = time.time()
+            msgpoll.poll()
+            print('poll {0}: {1:.3f}s'.format(num, time.time() - stime))
+
+        failed = False
+        print('{0:<8} {1:>6} {2:>6} {3:>8} {4:>7}'.format(
+            'network', 'queued', 'pulled', 'failures', 'delayed'))
+        for name, _ in hubs:
+            queued, pulled, failures, delayed = network_state(name)
+            print('{0:<8} {1:>6} {2:>6} {3:>8} {4:>7}'.format(
+                name, queued, pulled, failures, 'yes' if delayed else 'no'))
+            if name == unreachable:
+                expected = (options.msgs + options.rejects, 0, 1, True)
+            else:
+                expected = (0, options.hub_msgs, 0, False)
+            failed = failed or (queued, pulled, failures, delayed) != expected
+        return 1 if failed else 0
+    finally:
+        for proc in processes:
+            proc.terminate()
+            proc.join()
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    # run from the top-level folder of the repository, or with x84
+    # installed.
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+    sys.exit(main())
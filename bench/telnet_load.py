@@ -0,0 +1,502 @@
+#!/usr/bin/env python2.7
+"""
+Synthetic telnet load generator and end-to-end benchmark for x/84.
+
+Opens many concurrent connections to a running x/84 instance, completes
+telnet option negotiation (TTYPE, NAWS, BINARY, SGA), then drives a scripted
+keystroke scenario for each caller.  Measured are:
+
+- ``connect``: seconds to establish the tcp connection.
+- ``first_byte``: seconds from connect until the first byte is received.
+- ``echo``: seconds from sending a single keystroke until any reply
+  is received, for keystrokes sent by ``type`` steps.
+- ``step``: seconds for each ``expect`` and ``idle`` step to complete.
+
+along with throughput, error counts and, when ``--pid`` names the engine
+process, cpu time consumed by the engine and its session processes.
+
+A scenario is a list of steps, each a list of ``[action, argument]``:
+
+- ``["expect", "pattern"]``: wait until regular expression is matched by
+  output received since the previous ``expect``.
+- ``["idle", seconds]``: wait until no output is received for ``seconds``.
+- ``["send", "text"]``: send text at once.
+- ``["type", "text"]``: send text one keystroke at a time, awaiting echo.
+- ``["sleep", seconds]``: pause, as a human might.
+
+Built-in scenarios are ``connect``, ``login``, ``menu`` and ``read``, or the
+filepath of a json file containing a scenario may be given.  Values
+``{user}`` and ``{password}`` of text arguments are substituted.
+
+Example::
+
+    python bench/telnet_load.py --port=6023 --clients=50 \\
+        --scenario=login --user=bench --password=secret \\
+        --pid=`pgrep -of x84.engine` --output=results.json
+
+Results are written as json, so that results of a previous release may be
+compared using ``--compare=previous.json``.
+"""
+from __future__ import print_function
+
+# std imports
+import threading
+import argparse
+import platform
+import socket
+import struct
+import select
+import json
+import time
+import sys
+import os
+import re
+
+# telnet protocol bytes, as used by x84/telnet.py
+IAC, DONT, DO, WONT, WILL = 255, 254, 253, 252, 251
+SB, SE = 250, 240
+BINARY, ECHO, SGA, TTYPE, NAWS = 0, 1, 3, 24, 31
+TTYPE_IS, TTYPE_SEND = 0, 1
+
+#: options this client agrees to enable locally, when requested by DO.
+LOCAL_OPTIONS = (BINARY, SGA, TTYPE, NAWS)
+
+#: options this client agrees for the server to enable, by WILL.
+REMOTE_OPTIONS = (BINARY, ECHO, SGA)
+
+#: built-in scenarios, see module docstring.
+SCENARIOS = {
+    'connect': [
+        ['idle', 1.0],
+    ],
+    'login': [
+        ['expect', r'(?i)login:'],
+        ['type', '{user}\r'],
+        ['expect', r'(?i)password:'],
+        ['send', '{password}\r'],
+        ['idle', 2.0],
+    ],
+    'menu': [
+        ['expect', r'(?i)login:'],
+        ['type', '{user}\r'],
+        ['expect', r'(?i)password:'],
+        ['send', '{password}\r'],
+        ['idle', 2.0],
+        ['type', 'who\r'],
+        ['idle', 1.0],
+        ['send', 'q'],
+        ['idle', 1.0],
+        ['type', 'lc\r'],
+        ['idle', 1.0],
+        ['send', 'q'],
+        ['idle', 1.0],
+        ['type', 'news\r'],
+        ['idle', 1.0],
+        ['send', 'q'],
+        ['idle', 1.0],
+    ],
+    'read': [
+        ['expect', r'(?i)login:'],
+        ['type', '{user}\r'],
+        ['expect', r'(?i)password:'],
+        ['send', '{password}\r'],
+        ['idle', 2.0],
+        ['type', 'msg\r'],
+        ['idle', 1.0],
+        ['send', '\r'],
+        ['idle', 1.5],
+        ['send', 'j'],
+        ['idle', 1.0],
+        ['send', 'j'],
+        ['idle', 1.0],
+        ['send', 'q'],
+        ['idle', 1.0],
+    ],
+}
+
+
+class ScenarioError(Exception):
+
+    """ A scenario step failed, such as by timeout or disconnect. """
+
+
+def percentiles(values):
+    """ Return dictionary summary of list of float ``values``. """
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+
+    def nth(pct):
+        """ Return value at percentile ``pct``. """
+        return values[min(len(values) - 1, int(len(values) * pct))]
+
+    return {'count': len(values),
+            'mean': sum(values) / len(values),
+            'min': values[0],
+            'p50': nth(0.50),
+            'p90': nth(0.90),
+            'p99': nth(0.99),
+            'max': values[-1]}
+
+
+def read_cpu_seconds(pid):
+    """
+    Return user+system cpu seconds of ``pid`` and of its children.
+
+    Sessions are forked from the engine, so cpu time of each direct
+    descendant still running is counted as ``sessions``.  Returns None
+    where /proc is unavailable.
+    """
+    ticks = float(os.sysconf('SC_CLK_TCK'))
+
+    def stat(path):
+        """ Return (ppid, cpu seconds) of /proc stat file ``path``. """
+        with open(path) as stat_fp:
+            # the process name (field 2) may contain spaces; skip past it.
+            fields = stat_fp.read().rsplit(')', 1)[1].split()
+        return int(fields[1]), (int(fields[11]) + int(fields[12])) / ticks
+
+    try:
+        engine = stat('/proc/{0}/stat'.format(pid))[1]
+    except (IOError, OSError):
+        return None
+    sessions = 0.0
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            ppid, seconds = stat('/proc/{0}/stat'.format(name))
+        except (IOError, OSError):
+            continue
+        if ppid == pid:
+            sessions += seconds
+    return {'engine': engine, 'sessions': sessions}
+
+
+class Caller(threading.Thread):
+
+    """ A single synthetic caller, performing a scenario once. """
+
+    def __init__(self, num, options, scenario):
+        threading.Thread.__init__(self, name='caller-{0}'.format(num))
+        self.daemon = True
+        self.options = options
+        self.scenario = scenario
+        self.sock = None
+        self.iac_state = None
+        self.sb_buf = bytearray()
+        self.text = bytearray()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.last_recv = None
+        self.timings = {'connect': [], 'first_byte': [],
+                        'echo': [], 'step': []}
+        self.error = None
+
+    def run(self):
+        try:
+            self.connect()
+            for action, argument in self.scenario:
+                getattr(self, 'do_{0}'.format(action))(argument)
+        except (ScenarioError, socket.error) as err:
+            self.error = '{0}: {1}'.format(err.__class__.__name__, err)
+        finally:
+            if self.sock is not None:
+                self.sock.close()
+
+    def connect(self):
+        """ Connect, and await the first byte of output. """
+        stime = time.time()
+        self.sock = socket.create_connection(
+            (self.options.host, self.options.port),
+            timeout=self.options.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.timings['connect'].append(time.time() - stime)
+        if self.options.protocol == 'rlogin':
+            # rfc1282: client-user, server-user, terminal/speed
+            self.sendall('\x00{0}\x00{0}\x00{1}/38400\x00'.format(
+                self.options.user, self.options.term).encode('ascii'))
+        self.receive(timeout=self.options.timeout)
+        if self.last_recv is None:
+            raise ScenarioError('no output received after connect')
+        self.timings['first_byte'].append(self.last_recv - stime)
+
+    def sendall(self, data):
+        """ Send bytes ``data``. """
+        self.sock.sendall(bytes(data))
+        self.bytes_sent += len(data)
+
+    def receive(self, timeout):
+        """
+        Receive and process any data arriving within ``timeout``.
+
+        :returns: True if any data was received.
+        """
+        ready, _, _ = select.select([self.sock], [], [], timeout)
+        if not ready:
+            return False
+        data = self.sock.recv(65536)
+        if not data:
+            raise ScenarioError('disconnected by server')
+        self.last_recv = time.time()
+        self.bytes_received += len(data)
+        if self.options.protocol == 'telnet':
+            self.parse_telnet(bytearray(data))
+        else:
+            self.text.extend(data.replace(b'\x00', b''))
+        return True
+
+    def parse_telnet(self, data):
+        """ Reply to negotiation, collecting remaining output as text. """
+        for byte in data:
+            if self.iac_state is None:
+                if byte == IAC:
+                    self.iac_state = IAC
+                else:
+                    self.text.append(byte)
+            elif self.iac_state == IAC:
+                if byte in (DO, DONT, WILL, WONT):
+                    self.iac_state = byte
+                elif byte == SB:
+                    self.iac_state = SB
+                    self.sb_buf = bytearray()
+                elif byte == IAC:
+                    self.text.append(byte)
+                    self.iac_state = None
+                else:
+                    self.iac_state = None
+            elif self.iac_state == SB:
+                if byte == IAC:
+                    self.iac_state = 'sb-iac'
+                else:
+                    self.sb_buf.append(byte)
+            elif self.iac_state == 'sb-iac':
+                if byte == SE:
+                    self.handle_sb(self.sb_buf)
+                    self.iac_state = None
+                else:
+                    self.sb_buf.append(byte)
+                    self.iac_state = SB
+            else:
+                self.handle_negotiation(self.iac_state, byte)
+                self.iac_state = None
+
+    def handle_negotiation(self, command, option):
+        """ Reply to IAC ``command`` for ``option``. """
+        if command == DO:
+            reply = WILL if option in LOCAL_OPTIONS else WONT
+            self.sendall(bytearray([IAC, reply, option]))
+            if option == NAWS:
+                self.sendall(bytearray([IAC, SB, NAWS]) + bytearray(
+                    struct.pack('!HH', self.options.width,
+                                self.options.height)
+                ).replace(b'\xff', b'\xff\xff') + bytearray([IAC, SE]))
+        elif command == WILL:
+            reply = DO if option in REMOTE_OPTIONS else DONT
+            self.sendall(bytearray([IAC, reply, option]))
+
+    def handle_sb(self, buf):
+        """ Reply to sub-negotiation ``buf``. """
+        if buf[:2] == bytearray([TTYPE, TTYPE_SEND]):
+            self.sendall(bytearray([IAC, SB, TTYPE, TTYPE_IS]) +
+                         bytearray(self.options.term.encode('ascii')) +
+                         bytearray([IAC, SE]))
+
+    def format_arg(self, argument):
+        """ Return scenario text ``argument`` with values substituted. """
+        return argument.format(user=self.options.user,
+                               password=self.options.password)
+
+    def do_expect(self, pattern):
+        """ Wait until ``pattern`` matches text received. """
+        stime = time.time()
+        regex = re.compile(self.format_arg(pattern).encode('utf8'))
+        while not regex.search(bytes(self.text)):
+            remaining = self.options.timeout - (time.time() - stime)
+            if remaining <= 0:
+                raise ScenarioError('timeout waiting for {0!r}'
+                                    .format(pattern))
+            self.receive(timeout=remaining)
+        self.text = bytearray()
+        self.timings['step'].append(time.time() - stime)
+
+    def do_idle(self, seconds):
+        """ Wait until no output is received for ``seconds``. """
+        stime = time.time()
+        while self.receive(timeout=float(seconds)):
+            if time.time() - stime > self.options.timeout:
+                raise ScenarioError('timeout waiting for idle output')
+        self.timings['step'].append(time.time() - stime - float(seconds))
+
+    def do_send(self, text):
+        """ Send ``text`` at once. """
+        self.sendall(self.format_arg(text).encode('utf8'))
+
+    def do_type(self, text):
+        """ Send ``text`` one keystroke at a time, measuring echo. """
+        for keystroke in self.format_arg(text):
+            stime = time.time()
+            self.sendall(keystroke.encode('utf8'))
+            if not self.receive(timeout=self.options.echo_timeout):
+                # not every keystroke is echoed, such as a return key
+                # which must first be processed by the session script.
+                continue
+            self.timings['echo'].append(self.last_recv - stime)
+            if self.options.think:
+                time.sleep(self.options.think)
+
+    @staticmethod
+    def do_sleep(seconds):
+        """ Pause for ``seconds``. """
+        time.sleep(float(seconds))
+
+
+def load_scenario(name):
+    """ Return scenario by built-in ``name``, or filepath of json file. """
+    if name in SCENARIOS:
+        return SCENARIOS[name]
+    with open(name) as scenario_fp:
+        scenario = json.load(scenario_fp)
+    for action, _ in scenario:
+        if not hasattr(Caller, 'do_{0}'.format(action)):
+            raise ValueError('{0}: unknown action {1!r}'.format(name, action))
+    return scenario
+
+
+def run(options):
+    """ Run benchmark by ``options``, returning dictionary of results. """
+    scenario = load_scenario(options.scenario)
+    callers = [Caller(num, options, scenario)
+               for num in range(options.clients)]
+    cpu_start = options.pid and read_cpu_seconds(options.pid)
+    stime = time.time()
+    for caller in callers:
+        caller.start()
+        if options.ramp:
+            time.sleep(options.ramp / float(options.clients))
+    for caller in callers:
+        caller.join()
+    elapsed = time.time() - stime
+    cpu_end = options.pid and read_cpu_seconds(options.pid)
+
+    timings = dict()
+    for caller in callers:
+        for key, values in caller.timings.items():
+            timings.setdefault(key, []).extend(values)
+    bytes_received = sum(caller.bytes_received for caller in callers)
+    errors = [caller.error for caller in callers if caller.error]
+
+    results = {
+        'params': dict(vars(options), password=None),
+        'started': stime,
+        'elapsed': elapsed,
+        'python': platform.python_version(),
+        'completed': len(callers) - len(errors),
+        'errors': len(errors),
+        'error_messages': sorted(set(errors)),
+        'latency': dict((key, percentiles(values))
+                        for key, values in timings.items()),
+        'throughput': {
+            'bytes_sent': sum(caller.bytes_sent for caller in callers),
+            'bytes_received': bytes_received,
+            'bytes_received_per_sec': bytes_received / elapsed,
+            'keystrokes_per_sec': len(timings['echo']) / elapsed,
+            'callers_per_sec': (len(callers) - len(errors)) / elapsed,
+        },
+    }
+    if cpu_start and cpu_end:
+        results['cpu'] = dict(
+            (key, {'seconds': cpu_end[key] - cpu_start[key],
+                   'utilization': (cpu_end[key] - cpu_start[key]) / elapsed})
+            for key in cpu_start)
+    try:
+        import pkg_resources
+        results['x84_version'] = pkg_resources.get_distribution('x84').version
+    except Exception:
+        results['x84_version'] = None
+    return results
+
+
+def compare(results, previous):
+    """ Print comparison of latency ``results`` to ``previous``. """
+    print('{0:<12}{1:>6}{2:>12}{3:>12}{4:>9}'.format(
+        'latency', 'pct', 'previous', 'current', 'change'))
+    for key in sorted(results['latency']):
+        for pct in ('p50', 'p90', 'p99'):
+            cur = results['latency'][key].get(pct)
+            prev = previous.get('latency', {}).get(key, {}).get(pct)
+            if cur is None or not prev:
+                continue
+            print('{0:<12}{1:>6}{2:>12.4f}{3:>12.4f}{4:>+8.1f}%'.format(
+                key, pct, prev, cur, (cur - prev) / prev * 100))
+
+
+def summarize(results):
+    """ Print human-readable summary of ``results``. """
+    print('{0} callers completed, {1} errors in {2:.2f}s.'.format(
+        results['completed'], results['errors'], results['elapsed']))
+    for message in results['error_messages']:
+        print('  error: {0}'.format(message))
+    for key, stats in sorted(results['latency'].items()):
+        if stats['count']:
+            print('{0:<12} n={1:<6} p50={2:.4f}s p90={3:.4f}s '
+                  'p99={4:.4f}s max={5:.4f}s'.format(
+                      key, stats['count'], stats['p50'], stats['p90'],
+                      stats['p99'], stats['max']))
+    print('throughput: {0:.0f} bytes/s received, {1:.1f} keystrokes/s'
+          .format(results['throughput']['bytes_received_per_sec'],
+                  results['throughput']['keystrokes_per_sec']))
+    for key, cpu in sorted(results.get('cpu', {}).items()):
+        print('cpu {0}: {1:.2f}s ({2:.1%})'.format(
+            key, cpu['seconds'], cpu['utilization']))
+
+
+def parse_args(args=None):
+    """ Parse command line arguments. """
+    parser = argparse.ArgumentParser(
+        description='Synthetic telnet load generator for x/84.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6023)
+    parser.add_argument('--protocol', choices=('telnet', 'rlogin'),
+                        default='telnet')
+    parser.add_argument('--clients', type=int, default=10,
+                        help='number of concurrent callers.')
+    parser.add_argument('--ramp', type=float, default=1.0,
+                        help='seconds over which callers are started.')
+    parser.add_argument('--scenario', default='connect',
+                        help='built-in scenario ({0}) or json filepath.'
+                        .format(', '.join(sorted(SCENARIOS))))
+    parser.add_argument('--user', default='bench')
+    parser.add_argument('--password', default='bench')
+    parser.add_argument('--term', default='xterm-256color')
+    parser.add_argument('--width', type=int, default=80)
+    parser.add_argument('--height', type=int, default=25)
+    parser.add_argument('--think', type=float, default=0.0,
+                        help='seconds between keystrokes.')
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help='seconds before a step is failed.')
+    parser.add_argument('--echo-timeout', type=float, default=1.0,
+                        help='seconds to await echo of a keystroke.')
+    parser.add_argument('--pid', type=int,
+                        help='engine process id, for cpu measurement.')
+    parser.add_argument('--output', help='write json results to filepath.')
+    parser.add_argument('--compare', help='json results of a previous run.')
+    return parser.parse_args(args)
+
+
+def main():
+    """ Command-line entry point. """
+    options = parse_args()
+    results = run(options)
+    summarize(results)
+    if options.output:
+        with open(options.output, 'w') as out_fp:
+            json.dump(results, out_fp, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as prev_fp:
+            compare(results, json.load(prev_fp))
+    return 1 if results['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
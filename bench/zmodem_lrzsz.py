@@ -0,0 +1,240 @@
+#!/usr/bin/env python2.7
+"""
+Interoperability test of x/84's zmodem against lrzsz.
+
+Files of random data are transferred in each direction between
+:class:`x84.bbs.modem.ZModem` and the ``sz`` and ``rz`` programs of lrzsz,
+run on a pseudo-terminal in raw mode, as by a caller's terminal program,
+and compared with those sent.  Transfers are:
+
+- ``send``: :meth:`~x84.bbs.modem.ZModem.send` to ``rz``.
+- ``recv``: ``sz`` to :meth:`~x84.bbs.modem.ZModem.recv`, offering CRC-32.
+- ``recv16``: ``sz`` to :meth:`~x84.bbs.modem.ZModem.recv`, not offering
+  CRC-32, so that data subpackets are sent with CRC-16.
+
+Example::
+
+    python bench/zmodem_lrzsz.py --sizes=0,1,1024,1000000 --transfer=recv16
+
+Programs are found as ``lsz`` and ``lrz``, or ``sz`` and ``rz``.  Exit
+status is 0 when all files were transferred intact, 1 when any were not,
+and 2 when lrzsz is not installed.
+"""
+from __future__ import print_function
+
+# std imports
+import distutils.spawn
+import subprocess
+import threading
+import argparse
+import tempfile
+import logging
+import hashlib
+import shutil
+import Queue
+import errno
+import time
+import tty
+import pty
+import sys
+import os
+
+#: all transfers, in order of execution.
+TRANSFERS = ('send', 'recv', 'recv16')
+
+
+class PtySession(object):
+
+    """
+    Program run on a pseudo-terminal, as a session of
+    :class:`x84.bbs.modem.ModemChannel`.
+
+    Output of the program is received as the ``input`` event.
+    """
+
+    def __init__(self, args, cwd):
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.proc = subprocess.Popen(
+            args, cwd=cwd, stdin=slave, stdout=slave,
+            stderr=open(os.devnull, 'w'), close_fds=True)
+        os.close(slave)
+        self.queue = Queue.Queue()
+        self.reader = threading.Thread(target=self._read)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def _read(self):
+        """ Receive output of program until it exits. """
+        while True:
+            try:
+                data = os.read(self.master, 65536)
+            except OSError as err:
+                # EIO is raised by linux when the slave is closed.
+                if err.errno != errno.EIO:
+                    raise
+                break
+            if not data:
+                break
+            self.queue.put(data)
+
+    def read_event(self, event, timeout=None):
+        """ Return program output, awaiting up to ``timeout`` seconds. """
+        assert event == 'input', event
+        try:
+            if timeout == -1:
+                return self.queue.get_nowait()
+            return self.queue.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+
+    def poll_event(self, event):
+        """ Return program output, without blocking. """
+        return self.read_event(event, timeout=-1)
+
+    def write_bytes(self, data):
+        """ Send ``data`` to program. """
+        while data:
+            try:
+                data = data[os.write(self.master, data):]
+            except OSError as err:
+                if err.errno != errno.EIO:
+                    raise
+                break
+
+    def close(self, timeout):
+        """ Await exit of program, killing it after ``timeout`` seconds. """
+        stime = time.time()
+        while self.proc.poll() is None and time.time() - stime < timeout:
+            time.sleep(0.1)
+        if self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        os.close(self.master)
+        return self.proc.returncode
+
+
+def find_program(name):
+    """ Return path to lrzsz program ``name``, as ``lsz`` or ``sz``. """
+    return (distutils.spawn.find_executable('l' + name) or
+            distutils.spawn.find_executable(name))
+
+
+def make_files(dirpath, sizes):
+    """ Create files of random data of ``sizes``, returning their names. """
+    names = []
+    for num, size in enumerate(sizes):
+        name = 'file{0}-{1}.bin'.format(num, size)
+        with open(os.path.join(dirpath, name), 'wb') as fout:
+            fout.write(os.urandom(size))
+        names.append(name)
+    return names
+
+
+def digest(filepath):
+    """ Return sha1 digest of file at ``filepath``, or None if missing. """
+    if not os.path.exists(filepath):
+        return None
+    with open(filepath, 'rb') as fin:
+        return hashlib.sha1(fin.read()).hexdigest()
+
+
+def run_transfer(transfer, names, src, dst, options):
+    """
+    Run ``transfer`` of files ``names`` from directory ``src`` to ``dst``.
+
+    :returns: tuple of ``(success, elapsed)``, where ``success`` is the
+              result reported by :class:`~x84.bbs.modem.ZModem`.
+    """
+    from x84.bbs.modem import (ZModem, ModemChannel, ZRINIT,
+                               CANFDX, CANOVIO)
+
+    class ZModem16(ZModem):
+
+        """ Receiver not offering CRC-32. """
+
+        def send_rinit(self):
+            self.send_hex_header(ZRINIT, chr(0) * 3 + chr(CANFDX | CANOVIO))
+
+    if transfer == 'send':
+        args = [find_program('rz'), '-b', '-y', '-q']
+        session = PtySession(args, cwd=dst)
+    else:
+        args = [find_program('sz'), '-b', '-q'] + names
+        session = PtySession(args, cwd=src)
+
+    modem = (ZModem16 if transfer == 'recv16' else ZModem)(
+        ModemChannel(session), timeout=options.timeout)
+    stime = time.time()
+    if transfer == 'send':
+        files = [open(os.path.join(src, name), 'rb') for name in names]
+        try:
+            success = modem.send(files)
+        finally:
+            for fileobj in files:
+                fileobj.close()
+    else:
+        success = modem.recv(
+            lambda name, size, mtime: open(os.path.join(dst, name), 'wb'))
+    elapsed = time.time() - stime
+    returncode = session.close(options.timeout)
+    if returncode:
+        print('{0}: {1} exited {2}'.format(transfer, args[0], returncode))
+    return success and not returncode, elapsed
+
+
+def parse_args(args=None):
+    """ Parse command line arguments. """
+    parser = argparse.ArgumentParser(
+        description='Interoperability test of x/84 zmodem against lrzsz.')
+    parser.add_argument('--transfer', type=lambda val: val.split(','),
+                        default=list(TRANSFERS),
+                        help='comma-delimited transfers to run ({0}).'
+                        .format(', '.join(TRANSFERS)))
+    parser.add_argument('--sizes', default=[0, 1, 1023, 8193, 1048576],
+                        type=lambda val: [int(size)
+                                          for size in val.split(',')],
+                        help='comma-delimited sizes of files in bytes.')
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help='seconds to elapse for response before failing.')
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args(args)
+
+
+def main():
+    """ Command-line entry point. """
+    options = parse_args()
+    logging.basicConfig(level=logging.DEBUG if options.verbose
+                        else logging.WARN)
+    if not (find_program('sz') and find_program('rz')):
+        print('lrzsz is not installed.')
+        return 2
+
+    failed = 0
+    for transfer in options.transfer:
+        assert transfer in TRANSFERS, (transfer, TRANSFERS)
+        src, dst = tempfile.mkdtemp(), tempfile.mkdtemp()
+        try:
+            names = make_files(src, options.sizes)
+            success, elapsed = run_transfer(
+                transfer, names, src, dst, options)
+            mismatched = [name for name in names
+                          if digest(os.path.join(src, name)) !=
+                          digest(os.path.join(dst, name))]
+            print('{0:<7} {1} in {2:.2f}s, {3} bytes{4}'.format(
+                transfer, 'ok' if success and not mismatched else 'FAILED',
+                elapsed, sum(options.sizes),
+                ''.join('\n  mismatched: {0}'.format(name)
+                        for name in mismatched)))
+            failed += not success or bool(mismatched)
+        finally:
+            shutil.rmtree(src)
+            shutil.rmtree(dst)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    # run from the top-level folder of the repository, or with x84
+    # installed.
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+    sys.exit(main())
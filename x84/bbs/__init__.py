@@ -6,10 +6,11 @@ __import__('x84.encodings')
 
 # local/exported at top-level 'from bbs import ...'
 from x84.bbs.ansiwin import AnsiWindow
-from x84.bbs.dbproxy import DBProxy
+from x84.bbs.dbproxy import DBProxy, call_procedure
 from x84.bbs.door import Door, DOSDoor, Dropfile
 from x84.bbs.editor import LineEditor, ScrollingEditor
 from x84.bbs.exception import Disconnected, Goto
+from x84.bbs.fetchproxy import FetchProxy
 from x84.bbs.ini import get_ini
 from x84.bbs.lightbar import Lightbar
 from x84.bbs.modem import send_modem, recv_modem
@@ -37,5 +38,6 @@ __all__ = ('list_users', 'get_user', 'find_user', 'User', 'Group', 'list_msgs',
            'goto', 'disconnect', 'getsession', 'getterminal', 'getch', 'gosub',
            'ropen', 'showart', 'Dropfile', 'encode_pipe',
            'decode_pipe', 'syncterm_setfont', 'get_ini', 'send_modem',
-           'recv_modem', 'Script', 'list_privmsgs',
+           'recv_modem', 'Script', 'list_privmsgs', 'FetchProxy',
+           'call_procedure',
            )
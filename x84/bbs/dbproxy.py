@@ -1,18 +1,51 @@
 """ Database proxy helper for x/84. """
 # std imports
+import threading
 import logging
+import types
+import time
 
 # local
+from x84 import metrics
 from x84.bbs.ini import get_ini
 from x84.db import (
     get_db_filepath,
+    get_slow_threshold,
     get_database,
     get_db_func,
     get_db_lock,
     log_db_cmd,
+    record_db_cmd,
 )
 
 
+def call_procedure(name, *args):
+    """
+    Return result of stored procedure ``name`` called with ``args``.
+
+    Stored procedures are run by the engine beside its databases, see
+    :func:`x84.db.register_procedure`, so that only their result is
+    transferred to the session.  Without a session, such as for engine
+    services, the procedure is run directly.
+
+    :raises x84.db.ProcedureError: procedure is unknown, not permitted,
+                                   failed or timed out.
+    """
+    from x84.bbs.session import getsession
+    from x84.db import ProcedureError, run_procedure
+    session = getsession()
+    if session is None:
+        return run_procedure(name, None, args)
+    stime = time.time()
+    session.send_event('dbproc', (name, session.user.handle, args))
+    result = session.read_event('dbproc')
+    metrics.observe('dbproxy_latency', time.time() - stime,
+                    'dbproc/{0}'.format(name))
+    if isinstance(result, ProcedureError):
+        raise result
+    return result
+
+
 class DBProxy(object):
 
     """
@@ -39,7 +72,7 @@ class DBProxy(object):
         self.log = logging.getLogger(__name__)
         self.schema = schema
         self.table = table
-        self._tap_db = get_ini('session', 'tab_db', getter='getboolean')
+        self._tap_db = get_ini('session', 'tap_db', getter='getboolean')
 
         from x84.bbs.session import getsession
         self._session = use_session and getsession()
@@ -47,6 +80,7 @@ class DBProxy(object):
     def proxy_iter_session(self, method, *args):
         """ Proxy for iterable-return method calls over session IPC pipe. """
         event = 'db={0}'.format(self.schema)
+        stime = time.time()
         self._session.flush_event(event)
         self._session.send_event(event, (self.table, method, args))
         data = self._session.read_event(event)
@@ -57,18 +91,42 @@ class DBProxy(object):
             yield data
             data = self._session.read_event(event)
         self._session.flush_event(event)
+        self._record_round_trip(method, time.time() - stime)
 
     def proxy_method_direct(self, method, *args):
         """ Proxy for direct dictionary method calls. """
+        stime = time.time()
         dictdb = get_database(filepath=get_db_filepath(self.schema),
                               table=self.table)
+        timings = {'lock': time.time() - stime}
         try:
             func = get_db_func(dictdb, method)
             if self._tap_db:
                 log_db_cmd(self.log, self.schema, method, args)
-            return func(*args)
+            stime = time.time()
+            try:
+                result = func(*args)
+                if isinstance(result, types.GeneratorType):
+                    # read in full, as the database is closed on return.
+                    result = iter(list(result))
+                return result
+            finally:
+                timings['exec'] = time.time() - stime
         finally:
             dictdb.close()
+            record_db_cmd(self.schema, method, args, timings,
+                          caller=threading.current_thread().name)
+
+    def _record_round_trip(self, method, elapsed):
+        """
+        Record session round-trip time of a database command.
+
+        The engine records the time of each phase of the command, this
+        measures the total as seen by the session, including both
+        directions of IPC transfer.
+        """
+        metrics.observe('dbproxy_latency', elapsed,
+                        '{0}/{1}'.format(self.schema, method))
 
     def proxy_iter(self, method, *args):
         """ Proxy for iterable dictionary method calls. """
@@ -87,8 +145,12 @@ class DBProxy(object):
     def proxy_method_session(self, method, *args):
         """ Proxy for dictionary method calls over IPC pipe. """
         event = 'db-{0}'.format(self.schema)
+        stime = time.time()
         self._session.send_event(event, (self.table, method, args))
-        return self._session.read_event(event)
+        try:
+            return self._session.read_event(event)
+        finally:
+            self._record_round_trip(method, time.time() - stime)
 
     def acquire(self):
         """ Acquire system-wide lock on database. """
@@ -96,7 +158,18 @@ class DBProxy(object):
         if self._tap_db:
             self.log.debug('lock acquire schema=%s, table=%s',
                            self.schema, self.table)
+        stime = time.time()
         lock.acquire()
+        elapsed = time.time() - stime
+        metrics.observe('dbproxy_lock_wait', elapsed, self.schema)
+        threshold = get_slow_threshold()
+        if threshold and elapsed > threshold:
+            caller = threading.current_thread().name
+            if self._session and self._session.current_script:
+                caller = self._session.current_script.name
+            logging.getLogger('x84.db.slow').warn(
+                '{0}/{1} lock acquired after {2:0.3f}s caller={3}'
+                .format(self.schema, self.table, elapsed, caller))
 
     def release(self):
         """ Release system-wide lock on database. """
@@ -348,9 +348,18 @@ class Door(object):
 
     """ Spawns a subprocess and pipes input and output over bbs session. """
 
-    time_ipoll = 0.05
-    time_opoll = 0.05
+    #: seconds to wait for further pty output before it is sent.
+    time_coalesce = 0.002
+
+    #: seconds to wait for pty output or session events, at most.
+    time_idle = 1.0
+
+    #: bytes read from pty by each read.
     blocksize = 7680
+
+    #: maximum bytes of pty output sent as a single chunk.
+    coalesce_size = 65536
+
     master_fd = None
 
     def __init__(self, cmd='/bin/uname', args=(), env=None, cp437=False,
@@ -511,49 +520,92 @@ class Door(object):
                              0, 0)
         fcntl.ioctl(self.master_fd, termios.TIOCSWINSZ, _bytes)
 
+    def _read_output(self):
+        """
+        Read and return pty output, coalesced into a single chunk.
+
+        After output is first read, reading continues for as long as more
+        output becomes available within :attr:`time_coalesce` seconds, up
+        to :attr:`coalesce_size` bytes, so that a screen drawn by many
+        small writes of the door is sent as a whole.
+
+        :returns: bytes read, empty when the pty is closed by the child.
+        :rtype: bytes
+        """
+        chunks = [os.read(self.master_fd, self.blocksize)]
+        total = len(chunks[0])
+        while chunks[-1] and total < self.coalesce_size:
+            if not select.select((self.master_fd,), (), (),
+                                 self.time_coalesce)[0]:
+                break
+            try:
+                chunks.append(os.read(self.master_fd, self.blocksize))
+            except OSError as err:
+                # errno 5, the child has exited; send what we have, the
+                # next read of the main loop detects the closed pty.
+                if err.errno != 5:
+                    raise
+                break
+            total += len(chunks[-1])
+        return b''.join(chunks)
+
+    def _write_output(self, data):
+        """ Write pty output ``data`` to session. """
+        if self.raw:
+            self._session.write_bytes(data)
+        else:
+            echo(self.output_filter(data))
+
+    def _handle_event(self, event, data):
+        """ Handle session ``event`` of ``data``, such as keyboard input. """
+        if event == 'refresh' and data[0] == 'resize':
+            self.resize()
+
+        elif event == 'input':
+            if not self.raw:
+                data = self.input_filter(data)
+            if 0 != len(data):
+                n_written = os.write(self.master_fd, data)
+                if n_written != len(data):
+                    # we wrote none or some of our keyboard input, but
+                    # not all. re-buffer remaining bytes back into
+                    # session for next poll
+                    self._session.buffer_input(data[n_written:])
+                    self.log.warn('re-buffer_input(%r)!', data[n_written:])
+
     def _loop(self):
-        """ Main event loop, polling i/o of pty and session. """
+        """
+        Main event loop, multiplexing i/o of pty and session.
+
+        A single ``select()`` waits on both the pty and the session's IPC
+        pipe, so that keyboard input and door output are each handled as
+        soon as they are available.
+        """
+        events = ('input',)
+        if not self.raw:
+            events += ('refresh',)
+
         while True:
-            # block up to self.time_opoll for screen output
             if self.master_fd == -1:
                 # pty file descriptor closed by child,
                 # early termination!
                 break
 
-            rlist = (self.master_fd,)
-            ret_tuple = select.select(rlist, (), (), self.time_opoll)
-            if self.master_fd in ret_tuple[0]:
-                data = os.read(self.master_fd, self.blocksize)
+            # handle any session event already buffered or received,
+            # without blocking.
+            event, data = self._session.read_events(events, timeout=-1)
+            if event is not None:
+                self._handle_event(event, data)
+                continue
+
+            # block up to self.time_idle for screen output or session ipc
+            rlist = (self.master_fd, self._session.reader)
+            ready = select.select(rlist, (), (), self.time_idle)[0]
+            if self.master_fd in ready:
+                data = self._read_output()
                 if 0 == len(data):
                     break
-                if self.raw:
-                    self._session.write(data.decode('iso8859-1'), 'iso8859-1')
-                else:
-                    echo(self.output_filter(data))
-
-            # block up to self.time_ipoll for keyboard input
-
-            events = ('input',)
-
-            if not self.raw:
-                events += ('refresh',)
-
-            event, data = self._session.read_events(events, self.time_ipoll)
-
-            if event == 'refresh' and data[0] == 'resize':
-                self.resize()
-
-            elif event == 'input':
-                if not self.raw:
-                    data = self.input_filter(data)
-                if 0 != len(data):
-                    n_written = os.write(self.master_fd, data)
-                    if n_written != len(data):
-                        # we wrote none or some of our keyboard input, but
-                        # not all. re-buffer remaining bytes back into
-                        # session for next poll
-                        self._session.buffer_input(data[n_written:])
-                        self.log.warn('re-buffer_input(%r)!', data[n_written:])
+                self._write_output(data)
 
 
 class DOSDoor(Door):
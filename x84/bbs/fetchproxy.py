@@ -0,0 +1,78 @@
+""" HTTP fetch proxy helper for x/84. """
+# local
+from x84.fetch import FetchError, get_cache
+
+
+class FetchProxy(object):
+
+    """
+    Fetch URLs by HTTP GET through the engine's shared response cache.
+
+    A request is issued as a command to the main engine when ``use_session``
+    is True, which fetches the URL in a thread, or returns its cached
+    response, and returns the :class:`x84.fetch.FetchResponse` via IPC
+    pipe transfer.  Sessions requesting the same URL share a single request
+    and its response, see :mod:`x84.fetch`.
+    """
+
+    def __init__(self, ttl=None, timeout=None, use_session=True):
+        """
+        Class initializer.
+
+        :param int ttl: seconds a cached response is fresh, the value of
+                        ``[fetch]`` option ``ttl`` when None.
+        :param int timeout: seconds to wait for a response, the value of
+                            ``[fetch]`` option ``timeout`` when None.
+        :param bool use_session: Whether requests are sent over an IPC
+                                 pipe (client is a
+                                 :class:`x84.bbs.session.Session` instance),
+                                 or fetched directly by a cache of this
+                                 process (such as used by the main thread
+                                 engine components.)
+        """
+        self.ttl = ttl
+        self.timeout = timeout
+
+        from x84.bbs.session import getsession
+        self._session = use_session and getsession()
+
+    def _kwargs(self, url, params, headers):
+        return {'url': url, 'params': params, 'headers': headers,
+                'ttl': self.ttl, 'timeout': self.timeout}
+
+    def get(self, url, params=None, headers=None):
+        """
+        Return response of HTTP GET request of ``url``.
+
+        :param str url: URL to fetch.
+        :param params: query parameters, as dictionary or sequence of pairs.
+        :param dict headers: request headers.
+        :rtype: x84.fetch.FetchResponse
+        :raises x84.fetch.FetchError: request failed.
+        """
+        kwargs = self._kwargs(url, params, headers)
+        if not self._session:
+            return get_cache().fetch(**kwargs)
+        self._session.send_event('fetch', ('fetch', kwargs))
+        result = self._session.read_event('fetch')
+        if isinstance(result, FetchError):
+            raise result
+        return result
+
+    def request(self, event, url, params=None, headers=None):
+        """
+        Request ``url`` without waiting for its response.
+
+        The response, or a :class:`x84.fetch.FetchError`, is later received
+        by the session as data of ``event``, such as by
+        :meth:`x84.bbs.session.Session.read_events` of a script's main loop.
+        Only available to sessions.
+
+        :param str event: event name of reply.
+        :param str url: URL to fetch.
+        :param params: query parameters, as dictionary or sequence of pairs.
+        :param dict headers: request headers.
+        """
+        assert self._session, 'request() requires a session'
+        self._session.send_event('fetch', (event, self._kwargs(
+            url, params, headers)))
@@ -0,0 +1,343 @@
+"""
+File area index for x/84.
+
+The description (FILE_ID.DIZ) of archives and ASCII collections, with the
+size and modification time of every file of the file area, is stored in
+database ``fileindex``, keyed by the directory path relative to the file
+area root.  Each directory is a dictionary of entries by filename, so that
+a directory listing is retrieved by a single database command.
+
+Filenames, descriptions and sysop-edited descriptions are also indexed for
+:func:`search` as an inverted index of table ``terms``: a dictionary of
+weights by file path, keyed by each search term.  A query is answered by a
+single database command for each of its terms.
+
+An entry is current while the size and modification time of its file are
+unchanged.  The index is kept current by the engine's background indexer,
+:mod:`x84.fileindex`, and by :func:`describe` for any file browsed before
+the indexer has reached it.
+"""
+# std imports
+from distutils.spawn import find_executable
+import subprocess
+import functools
+import tempfile
+import logging
+import zipfile
+import shutil
+import math
+import os
+import re
+
+# local
+from x84.bbs.dbproxy import DBProxy
+from x84.bbs.ini import get_ini
+
+#: database of file area index
+INDEX_DB = 'fileindex'
+
+#: database of sysop-edited file descriptions, keyed by path relative to root
+DIZ_DB = 'filediz'
+
+#: weight of a search term found in the filename, relative to description
+FILENAME_WEIGHT = 4
+
+#: words not indexed for search
+STOPWORDS = frozenset((
+    u'a', u'an', u'and', u'are', u'as', u'at', u'be', u'by', u'for',
+    u'from', u'in', u'is', u'it', u'of', u'on', u'or', u'the', u'this',
+    u'to', u'with',))
+
+_TERMS = re.compile(r'[^\W\d_]+|\d+', re.UNICODE)
+
+_EXTRACTORS = None
+
+
+def get_root():
+    """ Return root folder of the file area. """
+    return get_ini(section='sftp', key='root') or '/usr/share/misc'
+
+
+def get_colly_extensions():
+    """ Return file extensions of ASCII collections. """
+    return get_ini(section='fbrowse', key='colly_extensions',
+                   split=True) or ['.txt', '.asc', '.ans']
+
+
+def diz_from_dms(binary, filename):
+    """
+    Amiga diskmasher format. Depends on the external binary 'xdms'.
+    """
+    args = ('d', filename)
+    proc = subprocess.Popen((binary,) + args, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    output, _ = proc.communicate()
+    if proc.returncode == 0:
+        return output.decode('cp437_art')
+    else:
+        return u'No description'
+
+
+def diz_from_lha(binary, filename):
+    """
+    Amiga LHA format. Depends on the external binary 'lha'.
+    """
+    description = u'No description'
+    path = tempfile.mkdtemp(prefix='x84_')
+    args = ('xw={0}'.format(path), filename)
+    proc = subprocess.Popen((binary,) + args, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    proc.wait()
+    dizfilename = os.path.join(path, 'file_id.diz')
+    if proc.returncode == 0 and os.path.isfile(dizfilename):
+        with open(dizfilename, 'rb') as dizfile:
+            description = dizfile.read().decode('cp437_art')
+    try:
+        shutil.rmtree(path)
+    except OSError:
+        pass
+    return description
+
+
+def diz_from_zip(filename, method=zipfile.ZIP_STORED):
+    """
+    Pull FILE_ID.DIZ from `filename` using particular zipfile `method`.
+    """
+    try:
+        myzip = zipfile.ZipFile(filename, compression=method, allowZip64=True)
+        for cname in (cname for cname in myzip.namelist()
+                      if cname.lower() == 'file_id.diz'):
+            return myzip.read(cname).decode('cp437_art')
+        return u'No description'
+    except zipfile.BadZipfile:
+        return u'Bad zip file, cannot parse'
+    except NotImplementedError:
+        return u'Unsupported compression, cannot parse'
+    except zipfile.LargeZipFile:
+        # since we do allowZip64=True above, this shouldn't happen any longer
+        return u'Large zip file, cannot parse'
+
+
+def diz_from_colly(filepath):
+    """
+    Get FILE_ID.DIZ from within an ASCII collection.
+
+    Lines are returned undecoded, as the encoding of collections is
+    chosen by the file browser for the session's terminal.
+    """
+    colly = open(filepath, 'r').read()
+    colly_diz_begin = '@BEGIN_FILE_ID.DIZ'
+    colly_diz_end = '@END_FILE_ID.DIZ'
+    pos = colly.find(colly_diz_begin)
+    if pos > 0:
+        colly = colly[pos + len(colly_diz_begin):]
+        pos = colly.find(colly_diz_end)
+        if pos > 0:
+            return colly[:pos].splitlines()
+    return None
+
+
+def get_extractors():
+    """
+    Return dictionary of DIZ extraction functions by file extension.
+
+    Each function receives a file path and returns its description.  LHA
+    and DMS archives are supported only when their external binaries,
+    ``lha`` and ``xdms``, are found in ``$PATH``.
+    """
+    global _EXTRACTORS  # pylint: disable=W0603
+    if _EXTRACTORS is None:
+        extractors = {'.zip': diz_from_zip}
+        for ext, binary, func in (('.lha', 'lha', diz_from_lha),
+                                  ('.dms', 'xdms', diz_from_dms)):
+            path = find_executable(binary)
+            if path:
+                extractors[ext] = functools.partial(func, path)
+        _EXTRACTORS = extractors
+    return _EXTRACTORS
+
+
+def extract_diz(filepath):
+    """
+    Return description of file at ``filepath`` as a list of lines.
+
+    :returns: lines of FILE_ID.DIZ, or None when the file type is not
+              supported or has none.
+    :rtype: list
+    """
+    _, ext = os.path.splitext(filepath.lower())
+    extractors = get_extractors()
+    if ext in extractors:
+        return extractors[ext](filepath).splitlines()
+    elif ext in get_colly_extensions():
+        return diz_from_colly(filepath)
+    return None
+
+
+def index_file(filepath):
+    """
+    Return index entry of file at ``filepath``.
+
+    This is the target of the indexer's worker processes.
+
+    :returns: tuple of ``(filepath, entry)``, where entry is a dictionary
+              of keys ``size``, ``mtime`` and ``diz``, or None when the file
+              could not be read.  ``diz`` is None when the description
+              could not be extracted.
+    :rtype: tuple
+    """
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return filepath, None
+    try:
+        diz = extract_diz(filepath)
+    except Exception as err:  # pylint: disable=W0703
+        # a corrupt or unusual file may raise anything of its extractor,
+        # the file is indexed without description.
+        logging.getLogger(__name__).warn(
+            'cannot extract description of {0}: {1}'.format(filepath, err))
+        diz = None
+    return filepath, {'size': stat.st_size,
+                      'mtime': int(stat.st_mtime),
+                      'diz': diz}
+
+
+def is_current(entry, stat):
+    """ Whether index ``entry`` describes file of ``os.stat()`` ``stat``. """
+    return (entry is not None and
+            entry['size'] == stat.st_size and
+            entry['mtime'] == int(stat.st_mtime))
+
+
+def get_directory_key(directory, root=None):
+    """ Return index key of ``directory``, relative to file area root. """
+    root = root or get_root()
+    return os.path.relpath(directory, root)
+
+
+def get_directory(directory, use_session=True):
+    """
+    Return index of ``directory``.
+
+    :rtype: dict
+    :returns: entries of :func:`index_file` by filename.
+    """
+    indexdb = DBProxy(INDEX_DB, use_session=use_session)
+    return indexdb.get(get_directory_key(directory), dict())
+
+
+def describe(directory, filename, entries):
+    """
+    Return current index entry of ``filename`` in ``directory``.
+
+    The file is indexed and stored when its entry of ``entries``, as
+    returned by :func:`get_directory`, is missing or out of date, and
+    ``entries`` is updated in-place.  ``filename`` may also be an absolute
+    path of a file of another directory, whose entry is then retrieved
+    from the database.
+
+    :returns: entry as returned by :func:`index_file`, or None when the
+              file could not be read.
+    :rtype: dict
+    """
+    filepath = os.path.join(directory, filename)
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    entry = entries.get(filename)
+    if is_current(entry, stat):
+        return entry
+    directory, basename = os.path.split(filepath)
+    if filename != basename:
+        entry = get_directory(directory).get(basename)
+        if is_current(entry, stat):
+            entries[filename] = entry
+            return entry
+    _, entry = index_file(filepath)
+    if entry is not None:
+        entries[filename] = entry
+        indexdb = DBProxy(INDEX_DB)
+        key = get_directory_key(directory)
+        with indexdb:
+            stored = indexdb.get(key, dict())
+            stored[basename] = entry
+            indexdb[key] = stored
+    return entry
+
+
+def tokenize(text):
+    """
+    Return search terms of ``text``.
+
+    Text is split into words and numbers, so that ``doom2_v1.zip`` is
+    found by any of terms ``doom``, ``2``, ``v``, ``1`` or ``zip``; single
+    letters and :data:`STOPWORDS` are discarded.
+
+    :rtype: list
+    """
+    if not isinstance(text, unicode):
+        text = text.decode('cp437', 'replace')
+    return [term for term in _TERMS.findall(text.lower())
+            if (len(term) > 1 or term.isdigit()) and term not in STOPWORDS]
+
+
+def get_document_terms(filename, description):
+    """
+    Return search term weights of a file.
+
+    :param str filename: name of file.
+    :param list description: lines of its description, or None.
+    :rtype: dict
+    """
+    weights = dict()
+    for term in tokenize(filename.decode('utf8', 'replace')):
+        weights[term] = weights.get(term, 0) + FILENAME_WEIGHT
+    for line in description or ():
+        for term in tokenize(line):
+            weights[term] = weights.get(term, 0) + 1
+    return weights
+
+
+def search(query, limit=100):
+    """
+    Search file area for files matching all terms of ``query``.
+
+    Terms found in the filename are ranked above those of descriptions,
+    and rare terms above common ones.  The search index is maintained by
+    the engine's background indexer, :mod:`x84.fileindex`.
+
+    :param unicode query: search terms.
+    :param int limit: maximum number of results.
+    :returns: list of ``(path, score)`` of best matching files, where
+              ``path`` is relative to the file area root.
+    :rtype: list
+    """
+    terms = set(tokenize(query))
+    if not terms:
+        return []
+    termsdb = DBProxy(INDEX_DB, table='terms')
+    postings = list()
+    for term in terms:
+        posting = termsdb.get(term, dict())
+        if not posting:
+            return []
+        postings.append(posting)
+
+    # intersect from the rarest term, which has the fewest candidates
+    postings.sort(key=len)
+    matches = set(postings[0])
+    for posting in postings[1:]:
+        matches.intersection_update(posting)
+        if not matches:
+            return []
+
+    num_docs = len(DBProxy(INDEX_DB, table='documents')) or 1
+    idfs = [math.log(1 + num_docs / float(len(posting)))
+            for posting in postings]
+    scores = [(path, sum(posting[path] * idf
+                         for posting, idf in zip(postings, idfs)))
+              for path in matches]
+    scores.sort(key=lambda item: (-item[1], item[0]))
+    return scores[:limit]
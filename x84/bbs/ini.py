@@ -178,6 +178,36 @@ def init_bbs_ini():
     except OSError:
         pass
     cfg_bbs.set('sftp', 'uploads_filemode', '644')
+    # directory listings and file attributes are cached for up to
+    # cache_ttl seconds; sequential reads are buffered by readahead bytes.
+    cfg_bbs.set('sftp', 'cache_size', '4096')
+    cfg_bbs.set('sftp', 'cache_ttl', '10')
+    cfg_bbs.set('sftp', 'readahead', '262144')
+
+    # background indexer of file area descriptions
+    cfg_bbs.add_section('fileindex')
+    cfg_bbs.set('fileindex', 'enabled', 'yes')
+    cfg_bbs.set('fileindex', 'interval', '600')
+    cfg_bbs.set('fileindex', 'processes', '2')
+
+    # archival of expired messages, disabled by default
+    cfg_bbs.add_section('msgarchive')
+    cfg_bbs.set('msgarchive', 'enabled', 'no')
+    cfg_bbs.set('msgarchive', 'cron', '43 4 * * *')
+    cfg_bbs.set('msgarchive', 'tags', '*')
+    cfg_bbs.set('msgarchive', 'max_age', '730')
+    cfg_bbs.set('msgarchive', 'max_count', '0')
+    # databases larger than compact_max_size megabytes are not compacted
+    # online, writers would wait too long.
+    cfg_bbs.set('msgarchive', 'compact_max_size', '32')
+
+    # http responses fetched by scripts are shared by all sessions for ttl
+    # seconds, and returned for stale_ttl further seconds while re-fetched.
+    cfg_bbs.add_section('fetch')
+    cfg_bbs.set('fetch', 'cache_size', '256')
+    cfg_bbs.set('fetch', 'ttl', '300')
+    cfg_bbs.set('fetch', 'stale_ttl', '3600')
+    cfg_bbs.set('fetch', 'timeout', '10')
 
     # rlogin only works on port 513
     cfg_bbs.add_section('rlogin')
@@ -196,6 +226,8 @@ def init_bbs_ini():
     cfg_bbs.set('web', 'chain', os.path.expanduser(
         os.path.join('~', '.x84', 'ca.cer')))
     cfg_bbs.set('web', 'modules', 'msgserve')
+    # requests are served by a pool of threads of the web server process.
+    cfg_bbs.set('web', 'threads', '10')
 
     # default path if cmd argument is not absolute,
     cfg_bbs.add_section('door')
@@ -218,6 +250,9 @@ def init_bbs_ini():
     cfg_bbs.set('session', 'tap_output', 'no')
     cfg_bbs.set('session', 'tap_events', 'no')
     cfg_bbs.set('session', 'tap_db', 'no')
+    # database commands taking longer (in seconds) are logged by the
+    # 'x84.db.slow' logger, 0 disables.
+    cfg_bbs.set('session', 'db_slow_threshold', '0.5')
     cfg_bbs.set('session', 'default_encoding', 'utf8')
 
     cfg_bbs.add_section('irc')
@@ -256,6 +291,16 @@ def init_bbs_ini():
     # those of the groups specified may.
     cfg_bbs.set('msg', 'moderated_tags', 'no')
     cfg_bbs.set('msg', 'tag_moderators', 'sysop, moderator')
+    # message networks are polled concurrently; each publishes batches of
+    # push_batch_size messages by up to push_concurrency requests, and a
+    # failed poll delays the next by backoff_base seconds, doubled by each
+    # failure up to backoff_max.  A message rejected by push_max_rejects
+    # polls is no longer sent.
+    cfg_bbs.set('msg', 'push_concurrency', '4')
+    cfg_bbs.set('msg', 'push_batch_size', '50')
+    cfg_bbs.set('msg', 'backoff_base', '60')
+    cfg_bbs.set('msg', 'backoff_max', '3600')
+    cfg_bbs.set('msg', 'push_max_rejects', '3')
 
     return cfg_bbs
 
@@ -275,7 +320,7 @@ def init_log_ini():
     cfg_log.set('formatter_default', 'datefmt', '%a-%m-%d %I:%M%p')
 
     cfg_log.add_section('handlers')
-    cfg_log.set('handlers', 'keys', 'console, rotate_daily')
+    cfg_log.set('handlers', 'keys', 'console, rotate_daily, db_slow')
 
     cfg_log.add_section('handler_console')
     cfg_log.set('handler_console', 'class', 'logging.StreamHandler')
@@ -294,9 +339,22 @@ def init_log_ini():
     cfg_log.set('handler_rotate_daily', 'args',
                 '("' + daily_log + '", "midnight", 1, 60)')
 
+    # slow database commands, see [session] option db_slow_threshold
+    cfg_log.add_section('handler_db_slow')
+    cfg_log.set('handler_db_slow', 'class',
+                'logging.handlers.TimedRotatingFileHandler')
+    cfg_log.set('handler_db_slow', 'level', 'WARN')
+    cfg_log.set('handler_db_slow', 'suffix', '%Y%m%d')
+    cfg_log.set('handler_db_slow', 'encoding', 'utf8')
+    cfg_log.set('handler_db_slow', 'formatter', 'default')
+    db_slow_log = os.path.join(os.path.expanduser(
+        os.path.join('~', '.x84', 'db_slow.log')))
+    cfg_log.set('handler_db_slow', 'args',
+                '("' + db_slow_log + '", "midnight", 1, 14)')
+
     cfg_log.add_section('loggers')
     cfg_log.set('loggers', 'keys',
-                'root, sqlitedict, paramiko, xmodem, requests, irc')
+                'root, sqlitedict, paramiko, xmodem, requests, irc, db_slow')
 
     cfg_log.add_section('logger_root')
     cfg_log.set('logger_root', 'level', 'INFO')
@@ -338,6 +396,13 @@ def init_log_ini():
     cfg_log.set('logger_irc', 'handlers', 'console, rotate_daily')
     cfg_log.set('logger_irc', 'qualname', 'irc.client')
 
+    # slow database commands are written to a log of their own
+    cfg_log.add_section('logger_db_slow')
+    cfg_log.set('logger_db_slow', 'level', 'WARN')
+    cfg_log.set('logger_db_slow', 'formatter', 'default')
+    cfg_log.set('logger_db_slow', 'handlers', 'db_slow')
+    cfg_log.set('logger_db_slow', 'qualname', 'x84.db.slow')
+
     return cfg_log
 
 
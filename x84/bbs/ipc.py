@@ -1,25 +1,64 @@
 """ Session IPC package for x/84. """
 # std imports
+import logging.handlers
 import logging
+import time
 
-# local
-from x84.bbs.session import getsession
 
+#: maximum number of log records sent by a single ``logger`` event.
+LOG_BATCH_SIZE = 64
 
-def make_root_logger(out_queue):
+#: seconds a log record may be held before it is sent.
+LOG_FLUSH_INTERVAL = 0.5
+
+
+def get_log_level():
+    """
+    Return the lowest level of log record written by the root logger.
+
+    Called by the engine so that sessions may discard records that would
+    not be written anyway, rather than sending them over IPC.
+
+    :rtype: int
+    """
+    root = logging.getLogger()
+    handler_level = min([handler.level for handler in root.handlers] or
+                        [logging.NOTSET])
+    return max(root.getEffectiveLevel(), handler_level)
+
+
+def make_root_logger(out_queue, level=None):
     """
     Remove and re-address the root logging handler.
 
     Any existing handlers of the current process are removed and
     the root logger is re-address to send via an IPC output event
     queue.
+
+    :param multiprocessing.Pipe out_queue: session output queue.
+    :param int level: log level of root logger, as determined by
+                      :func:`get_log_level` of the engine process.
     """
     root = logging.getLogger()
     map(root.removeHandler, root.handlers)
     root.addHandler(IPCLogHandler(out_queue=out_queue))
+    if level is not None:
+        root.setLevel(level)
+
+
+def flush_log(force=False):
+    """
+    Send log records held by the :class:`IPCLogHandler` of this process.
+
+    :param bool force: send regardless of :data:`LOG_FLUSH_INTERVAL`.
+    """
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, IPCLogHandler):
+            if force or handler.is_stale():
+                handler.flush()
 
 
-class IPCLogHandler(logging.Handler):
+class IPCLogHandler(logging.handlers.BufferingHandler):
 
     """
     Log handler that sends the log up the 'event pipe'.
@@ -27,32 +66,76 @@ class IPCLogHandler(logging.Handler):
     This is a rather novel solution that seems overlooked in documentation,
     a forked process must have some method to propagate its logging records
     up through the main process, otherwise they are lost.
+
+    Records are held and sent as a list by a single ``logger`` event when
+    :data:`LOG_BATCH_SIZE` records are held, a record of ``WARNING`` or
+    greater is emitted, or by :func:`flush_log` after
+    :data:`LOG_FLUSH_INTERVAL` seconds.
     """
 
-    def __init__(self, out_queue):
+    def __init__(self, out_queue, capacity=LOG_BATCH_SIZE,
+                 flush_level=logging.WARNING, interval=LOG_FLUSH_INTERVAL):
         """ Constructor method, requires multiprocessing.Pipe. """
-        logging.Handler.__init__(self)
+        logging.handlers.BufferingHandler.__init__(self, capacity)
         self.oqueue = out_queue
+        self.flush_level = flush_level
+        self.interval = interval
+        self.last_flush = time.time()
+
+    def prepare(self, record):
+        """
+        Prepare ``record`` for pickling.
+
+        The message is formatted and exception text rendered here, so
+        that the engine need not, and ``args`` and ``exc_info``, which may
+        not be pickled, are discarded.
+        """
+        if record.exc_info:
+            # a strange side-effect,
+            # sets record.exc_text
+            dummy = self.format(record)  # NOQA
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        from x84.bbs.session import getsession
+        record.handle = None
+        session = getsession()
+        if session:
+            record.handle = session.user.handle
+        return record
 
     def emit(self, record):
-        """ Emit log record via IPC output queue. """
+        """ Hold log record, sending held records when necessary. """
         try:
-            e_inf = record.exc_info
-            if e_inf:
-                # a strange side-effect,
-                # sets record.exc_text
-                dummy = self.format(record)  # NOQA
-                record.exc_info = None
-            record.handle = None
-            session = getsession()
-            if session:
-                record.handle = session.user.handle
-            self.oqueue.send(('logger', record))
+            self.buffer.append(self.prepare(record))
+            if self.shouldFlush(record):
+                self.flush()
         except (KeyboardInterrupt, SystemExit):
             raise
         except Exception:
             self.handleError(record)
 
+    def shouldFlush(self, record):
+        """ Whether held records should be sent after ``record``. """
+        return (record.levelno >= self.flush_level or
+                logging.handlers.BufferingHandler.shouldFlush(self, record))
+
+    def is_stale(self):
+        """ Whether records have been held for at least ``interval``. """
+        return bool(self.buffer and
+                    time.time() - self.last_flush >= self.interval)
+
+    def flush(self):
+        """ Send all held records by a single ``logger`` event. """
+        self.acquire()
+        try:
+            if self.buffer:
+                self.oqueue.send(('logger', self.buffer))
+                self.buffer = []
+            self.last_flush = time.time()
+        finally:
+            self.release()
+
 
 class IPCStream(object):
 
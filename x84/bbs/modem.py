@@ -1,4 +1,20 @@
-""" File transfer routines for x/84. """
+"""
+File transfer routines for x/84.
+
+Protocols ``xmodem`` and ``xmodem1k`` are provided by the :mod:`xmodem`
+package.  The streaming protocols ``ymodem-g`` and ``zmodem`` are
+implemented here by :class:`YModemG` and :class:`ZModem`: they transfer
+a batch of files, with names and sizes, without waiting for the receiver
+to acknowledge each packet.  ZMODEM further recovers from errors without
+restarting the transfer, and resumes a file previously received in part.
+"""
+# std imports
+import binascii
+import logging
+import struct
+import time
+import os
+import re
 
 # local imports
 from x84.bbs.session import getsession
@@ -6,16 +22,1016 @@ from x84.bbs.session import getsession
 # 3rd party
 import xmodem
 
+#: protocols supported by :func:`send_modem` and :func:`recv_modem`
+PROTOCOLS = ('xmodem', 'xmodem1k', 'ymodem-g', 'zmodem')
+
+# control characters
+SOH, STX, EOT, ACK, NAK, CAN, SUB = (
+    '\x01', '\x02', '\x04', '\x06', '\x15', '\x18', '\x1a')
+XON, XOFF = '\x11', '\x13'
+
+#: sequence sent to cancel a transfer in progress, as sent by lrzsz
+ABORT_SEQ = CAN * 10 + '\b' * 10
+
+#: flow control characters discarded from received data
+FLOW_CHARS = ''.join((XON, XOFF, chr(0x91), chr(0x93)))
+
+# ZMODEM frame encodings and special characters
+ZPAD, ZDLE = '*', CAN
+ZBIN, ZHEX, ZBIN32 = 'A', 'B', 'C'
+
+# ZMODEM frame types
+(ZRQINIT, ZRINIT, ZSINIT, ZACK, ZFILE, ZSKIP, ZNAK, ZABORT, ZFIN, ZRPOS,
+ ZDATA, ZEOF, ZFERR, ZCRC, ZCHALLENGE, ZCOMPL, ZCAN, ZFREECNT, ZCOMMAND,
+ ZSTDERR) = range(20)
+
+# ZMODEM data subpacket frame ends, and escaped delete characters
+ZCRCE, ZCRCG, ZCRCQ, ZCRCW = 'h', 'i', 'j', 'k'
+ZRUB0, ZRUB1 = 'l', 'm'
+FRAME_ENDS = (ZCRCE, ZCRCG, ZCRCQ, ZCRCW)
+
+# ZMODEM ZRINIT capability flags, and ZFILE conversion option
+CANFDX, CANOVIO, CANFC32, ESCCTL = 0x01, 0x02, 0x20, 0x40
+ZCBIN = 1
+
+#: characters escaped by ZDLE in all ZMODEM frames: ZDLE, DLE, XON and
+#: XOFF with or without parity, and carriage return, which some telnet
+#: implementations would otherwise follow by NUL.
+ZMODEM_ESCAPE = re.compile('[\x18\x10\x90\x11\x91\x13\x93\x0d\x8d]')
+
+#: characters escaped when the receiver requests ``ESCCTL``.
+ZMODEM_ESCAPE_CTL = re.compile('[\x00-\x1f\x7f-\x9f\xff]')
+
+
+class TransferError(Exception):
+
+    """ A file transfer failed, such as by timeout or CRC error. """
+
+
+class TransferCancelled(TransferError):
+
+    """ A file transfer was cancelled by the remote end. """
+
+
+class ModemChannel(object):
+
+    """
+    Buffered byte stream over session input and output.
+
+    Input received by the session's ``input`` event is appended to a single
+    buffer as it arrives, and drained of all further input waiting, so that
+    a protocol may read a byte or a whole packet at a time without joining
+    each ``input`` event by string concatenation.
+    """
+
+    #: size of consumed buffer at which it is compacted
+    compact_size = 65536
+
+    def __init__(self, session=None):
+        """
+        Class initializer.
+
+        :param session: session, with methods ``read_event``,
+                        ``poll_event`` and ``write_bytes``; the current
+                        session by default.
+        """
+        self.session = session or getsession()
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def __len__(self):
+        return len(self.buffer) - self.offset
+
+    def fill(self, timeout):
+        """
+        Receive input into buffer, waiting up to ``timeout`` seconds.
+
+        :returns: whether any input was received.
+        :rtype: bool
+        """
+        data = self.session.read_event(
+            'input', timeout=timeout if timeout > 0 else -1)
+        if data is None:
+            return False
+        if self.offset >= self.compact_size:
+            del self.buffer[:self.offset]
+            self.offset = 0
+        self.buffer.extend(data)
+        while True:
+            # drain all input already received, without blocking.
+            data = self.session.poll_event('input')
+            if data is None:
+                break
+            self.buffer.extend(data)
+        return True
+
+    def _wait(self, size, timeout):
+        """ Fill until ``size`` bytes are buffered or ``timeout`` elapses. """
+        stime = time.time()
+        while len(self) < size:
+            remaining = timeout - (time.time() - stime)
+            if remaining <= 0:
+                break
+            self.fill(remaining)
+
+    def read(self, size, timeout):
+        """ Return up to ``size`` bytes, fewer when ``timeout`` elapses. """
+        self._wait(size, timeout)
+        data = bytes(self.buffer[self.offset:self.offset + size])
+        self.offset += len(data)
+        return data
+
+    def read_byte(self, timeout):
+        """ Return a single byte, or ``None`` when ``timeout`` elapses. """
+        if not len(self):
+            self._wait(1, timeout)
+            if not len(self):
+                return None
+        self.offset += 1
+        return chr(self.buffer[self.offset - 1])
+
+    def read_until(self, char, timeout):
+        """
+        Return bytes up to byte ``char``, which is consumed but not returned.
+
+        :returns: tuple of ``(data, found)``, where ``found`` is False when
+                  ``timeout`` elapsed; ``data`` is then all that was received.
+        :rtype: tuple
+        """
+        stime = time.time()
+        searched = 0
+        while True:
+            idx = self.buffer.find(char, self.offset + searched)
+            if idx != -1:
+                data = bytes(self.buffer[self.offset:idx])
+                self.offset = idx + 1
+                return data, True
+            # fill() may compact the buffer, so the length searched is
+            # kept relative to offset.
+            searched = len(self)
+            remaining = timeout - (time.time() - stime)
+            if remaining <= 0 or not self.fill(remaining):
+                if time.time() - stime >= timeout:
+                    return self.read(len(self), 0), False
+
+    def peek(self):
+        """ Return next byte without consuming it, or None, without blocking. """
+        if not self.pending():
+            return None
+        return chr(self.buffer[self.offset])
+
+    def pending(self):
+        """ Whether any input is waiting, without blocking. """
+        if not len(self):
+            self.fill(-1)
+        return bool(len(self))
+
+    def flush_input(self):
+        """ Discard all input received. """
+        while self.pending():
+            self.buffer, self.offset = bytearray(), 0
+
+    def write(self, data):
+        """ Send raw bytes ``data``. """
+        self.session.write_bytes(data)
+
+    def abort(self):
+        """ Send cancellation sequence. """
+        self.write(ABORT_SEQ)
+
+    def getc(self, size, timeout=1):
+        """ Callback function for :class:`xmodem.XMODEM` interface. """
+        return self.read(size, timeout) or None
+
+    def putc(self, data, timeout=1):
+        # pylint: disable=W0613
+        #         Unused argument 'timeout'
+        """ Callback function for :class:`xmodem.XMODEM` interface. """
+        self.write(data)
+        return len(data)
+
+
+def get_file_info(fileobj):
+    """ Return ``(name, size, mtime, mode)`` of open file ``fileobj``. """
+    name = os.path.basename(getattr(fileobj, 'name', 'untitled'))
+    try:
+        stat = os.fstat(fileobj.fileno())
+        return name, stat.st_size, int(stat.st_mtime), stat.st_mode
+    except (AttributeError, OSError, IOError, ValueError):
+        # not a file of the operating system, such as StringIO.
+        pos = fileobj.tell()
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell()
+        fileobj.seek(pos)
+        return name, size, int(time.time()), 0o100644
+
+
+def format_file_info(name, size, mtime, mode, files_left, bytes_left):
+    """ Return file information header of YMODEM and ZMODEM. """
+    if isinstance(name, unicode):
+        name = name.encode('utf8')
+    return '{0}\x00{1} {2:o} {3:o} 0 {4} {5}\x00'.format(
+        name, size, mtime, mode, files_left, bytes_left)
+
+
+def parse_file_info(data):
+    """
+    Parse file information header of YMODEM and ZMODEM.
+
+    :returns: tuple of ``(name, size, mtime)``, where ``size`` and
+              ``mtime`` are None when unspecified.
+    :rtype: tuple
+    """
+    name, _, info = bytes(data).partition('\x00')
+    fields = info.split('\x00', 1)[0].split()
+    size = mtime = None
+    try:
+        if fields:
+            size = int(fields[0])
+        if len(fields) > 1:
+            mtime = int(fields[1], 8)
+    except ValueError:
+        pass
+    return name, size, mtime
+
+
+class ZModem(object):
+
+    """
+    ZMODEM streaming file transfer.
+
+    Data is streamed without waiting for the receiver, which reports errors
+    by ``ZRPOS`` so that the sender resumes from the last good position.
+    The sender requests acknowledgement every ``window / 4`` bytes, and
+    waits when more than ``window`` bytes are unacknowledged.  A receiver
+    resumes a file received in part by replying to ``ZFILE`` with the
+    position of the end of its partial file.
+    """
+
+    #: initial and maximum size of each data subpacket
+    blocksize, max_blocksize = 1024, 8192
+
+    def __init__(self, channel, retry=16, timeout=30, window=131072,
+                 callback=None):
+        """
+        Class initializer.
+
+        :param ModemChannel channel: channel of transfer.
+        :param int retry: number of consecutive errors before failing.
+        :param int timeout: seconds to elapse for response before failing.
+        :param int window: maximum bytes of data unacknowledged by receiver,
+                           0 disables.
+        :param callable callback: called with ``(total_bytes, bytes_done,
+                                  error_count)`` as a transfer progresses.
+        """
+        self.channel = channel
+        self.retry = retry
+        self.timeout = timeout
+        self.window = window
+        self.callback = callback
+        self.log = logging.getLogger(__name__)
+        self.use_crc32 = False
+        # CRC width of the header last received, by which the data
+        # subpackets following it are read.
+        self.rx_crc32 = False
+        self.escape = ZMODEM_ESCAPE
+        self.errors = 0
+        self.retries = 0
+
+    # encoding
+    #
+    def zdle_encode(self, data):
+        """ Return ``data`` with special characters escaped by ZDLE. """
+        def _escape(match):
+            """ Return escape sequence of matched character. """
+            char = match.group()
+            if char == '\x7f':
+                return ZDLE + ZRUB0
+            elif char == '\xff':
+                return ZDLE + ZRUB1
+            return ZDLE + chr(ord(char) ^ 0x40)
+        return self.escape.sub(_escape, data)
+
+    @staticmethod
+    def make_args(value):
+        """ Return 4-byte header arguments of position ``value``. """
+        return struct.pack('<I', value & 0xffffffff)
+
+    def send_hex_header(self, frametype, args):
+        """ Send hex-encoded header, used by receivers. """
+        data = chr(frametype) + args
+        frame = ''.join((ZPAD, ZPAD, ZDLE, ZHEX, binascii.hexlify(
+            data + struct.pack('>H', binascii.crc_hqx(data, 0))), '\r\x8a'))
+        if frametype not in (ZFIN, ZACK):
+            frame += XON
+        self.channel.write(frame)
+
+    def send_bin_header(self, frametype, args):
+        """ Send binary header, with CRC-32 when supported by receiver. """
+        data = chr(frametype) + args
+        if self.use_crc32:
+            crc = struct.pack('<I', binascii.crc32(data) & 0xffffffff)
+            frame = ZPAD + ZDLE + ZBIN32 + self.zdle_encode(data + crc)
+        else:
+            crc = struct.pack('>H', binascii.crc_hqx(data, 0))
+            frame = ZPAD + ZDLE + ZBIN + self.zdle_encode(data + crc)
+        self.channel.write(frame)
+
+    def encode_subpacket(self, data, frame_end):
+        """ Return data subpacket of ``data`` ended by ``frame_end``. """
+        if self.use_crc32:
+            crc = struct.pack('<I', binascii.crc32(data + frame_end)
+                              & 0xffffffff)
+        else:
+            crc = struct.pack('>H', binascii.crc_hqx(data + frame_end, 0))
+        packet = ''.join((self.zdle_encode(data), ZDLE, frame_end,
+                          self.zdle_encode(crc)))
+        if frame_end == ZCRCW:
+            packet += XON
+        return packet
+
+    # decoding
+    #
+    def read_escaped(self, timeout):
+        """
+        Read a single ZDLE-decoded byte.
+
+        :returns: the byte, or a frame end (preceded by ZDLE) as a tuple.
+        :raises TransferError: timeout, cancellation or invalid escape.
+        """
+        while True:
+            char = self.channel.read_byte(timeout)
+            if char is None:
+                raise TransferError('timeout')
+            if char in FLOW_CHARS:
+                continue
+            if char != ZDLE:
+                return char
+            while True:
+                char = self.channel.read_byte(timeout)
+                if char is None:
+                    raise TransferError('timeout')
+                if char not in FLOW_CHARS:
+                    break
+            return self.decode_escape(char)
+
+    def decode_escape(self, char):
+        """ Decode ``char`` following ZDLE, see :meth:`read_escaped`. """
+        if char in FRAME_ENDS:
+            return (char,)
+        elif char == ZRUB0:
+            return '\x7f'
+        elif char == ZRUB1:
+            return '\xff'
+        elif char == CAN:
+            if self.channel.read(3, 1) == CAN * 3:
+                raise TransferCancelled('cancelled by remote')
+        elif ord(char) & 0x60 == 0x40:
+            return chr(ord(char) ^ 0x40)
+        raise TransferError('invalid escape {0!r}'.format(char))
+
+    def read_header(self, timeout=None):
+        """
+        Read next header, discarding any garbage preceding it.
+
+        :returns: tuple of ``(frametype, args)``, where ``args`` is 4 bytes,
+                  or ``(None, None)`` for a header of invalid CRC.
+        :raises TransferError: timeout or cancellation.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        stime, cancels = time.time(), 0
+        while True:
+            remaining = timeout - (time.time() - stime)
+            char = self.channel.read_byte(max(remaining, 0))
+            if char is None:
+                raise TransferError('timeout waiting for header')
+            cancels = cancels + 1 if char == CAN else 0
+            if cancels >= 5:
+                raise TransferCancelled('cancelled by remote')
+            if char != ZPAD:
+                continue
+            while char == ZPAD:
+                char = self.channel.read_byte(max(remaining, 1))
+            if char != ZDLE:
+                continue
+            encoding = self.channel.read_byte(max(remaining, 1))
+            try:
+                if encoding == ZHEX:
+                    return self._read_hex_header()
+                elif encoding == ZBIN:
+                    return self._read_bin_header(crc32=False)
+                elif encoding == ZBIN32:
+                    return self._read_bin_header(crc32=True)
+            except (TypeError, ValueError, struct.error, binascii.Error):
+                return None, None
+
+    def _read_hex_header(self):
+        """ Read remainder of hex header. """
+        self.rx_crc32 = False
+        data = binascii.unhexlify(self.channel.read(14, self.timeout).lower())
+        if len(data) != 7:
+            # short read by timeout, retried as a header of invalid CRC.
+            return None, None
+        # discard trailing CR, LF and XON, when sent.
+        for chars in ('\r', '\n\x8a', XON):
+            if self.channel.peek() in tuple(chars):
+                self.channel.read_byte(0)
+        if binascii.crc_hqx(data[:5], 0) != struct.unpack('>H', data[5:])[0]:
+            return None, None
+        return ord(data[0]), data[1:5]
+
+    def _read_bin_header(self, crc32):
+        """ Read remainder of binary header. """
+        self.rx_crc32 = crc32
+        length = 9 if crc32 else 7
+        data = ''.join(self.read_escaped(self.timeout) for _ in range(length))
+        if crc32:
+            crc = struct.unpack('<I', data[5:])[0]
+            valid = binascii.crc32(data[:5]) & 0xffffffff == crc
+        else:
+            crc = struct.unpack('>H', data[5:])[0]
+            valid = binascii.crc_hqx(data[:5], 0) == crc
+        if not valid:
+            return None, None
+        return ord(data[0]), data[1:5]
+
+    def read_subpacket(self, crc32, max_length=16384):
+        """
+        Read data subpacket.
+
+        :returns: tuple of ``(data, frame_end)``.
+        :raises TransferError: timeout, cancellation or CRC error.
+        """
+        chunks, length = [], 0
+        while length <= max_length:
+            data, found = self.channel.read_until(ZDLE, self.timeout)
+            data = data.translate(None, FLOW_CHARS)
+            chunks.append(data)
+            length += len(data)
+            if not found:
+                raise TransferError('timeout in data subpacket')
+            char = self.channel.read_byte(self.timeout)
+            while char is not None and char in FLOW_CHARS:
+                char = self.channel.read_byte(self.timeout)
+            if char is None:
+                raise TransferError('timeout in data subpacket')
+            value = self.decode_escape(char)
+            if isinstance(value, tuple):
+                frame_end = value[0]
+                break
+            chunks.append(value)
+            length += 1
+        else:
+            raise TransferError('data subpacket too long')
+
+        data = ''.join(chunks)
+        crc_data = ''.join(self.read_escaped(self.timeout)
+                           for _ in range(4 if crc32 else 2))
+        if crc32:
+            valid = (binascii.crc32(data + frame_end) & 0xffffffff ==
+                     struct.unpack('<I', crc_data)[0])
+        else:
+            valid = (binascii.crc_hqx(data + frame_end, 0) ==
+                     struct.unpack('>H', crc_data)[0])
+        if not valid:
+            raise TransferError('CRC error in data subpacket')
+        return data, frame_end
+
+    def _error(self, reason):
+        """ Count error by ``reason``, raising when retries are exhausted. """
+        self.errors += 1
+        self.retries += 1
+        self.log.debug('zmodem error #{0}: {1}'.format(self.errors, reason))
+        if self.retries > self.retry:
+            raise TransferError('too many errors, last: {0}'.format(reason))
+
+    def _progress(self, total, done):
+        """ Report progress to callback. """
+        if self.callback is not None:
+            self.callback(total, done, self.errors)
+
+    # sender
+    #
+    def send(self, files):
+        """
+        Send list of open ``files``.
+
+        :returns: True if all files were transferred or skipped.
+        :rtype: bool
+        """
+        try:
+            self._send_init()
+            bytes_left = sum(get_file_info(fileobj)[1] for fileobj in files)
+            for num, fileobj in enumerate(files):
+                info = get_file_info(fileobj)
+                self._send_file(fileobj, info, len(files) - num, bytes_left)
+                bytes_left -= info[1]
+            self._send_fin()
+        except TransferError as err:
+            self.log.warn('zmodem send failed: {0}'.format(err))
+            self.channel.abort()
+            return False
+        return True
+
+    def _send_init(self):
+        """ Request and await receiver's ZRINIT, recording its abilities. """
+        self.channel.write('rz\r')
+        for _ in range(self.retry):
+            self.send_hex_header(ZRQINIT, self.make_args(0))
+            try:
+                frametype, args = self.read_header(timeout=10)
+            except TransferCancelled:
+                raise
+            except TransferError as err:
+                continue
+            if frametype == ZRINIT:
+                flags = ord(args[3])
+                self.use_crc32 = bool(flags & CANFC32)
+                if flags & ESCCTL:
+                    self.escape = ZMODEM_ESCAPE_CTL
+                return
+            elif frametype == ZCHALLENGE:
+                self.send_hex_header(ZACK, args)
+        raise TransferError('receiver did not respond')
+
+    def _send_file(self, fileobj, info, files_left, bytes_left):
+        """ Send file ``fileobj`` of ``(name, size, mtime, mode)``. """
+        name, size = info[0], info[1]
+        header = format_file_info(name, size, info[2], info[3],
+                                  files_left, bytes_left)
+        resend = True
+        while True:
+            if resend:
+                self.send_bin_header(ZFILE, chr(0) * 3 + chr(ZCBIN))
+                self.channel.write(self.encode_subpacket(header, ZCRCW))
+            resend = True
+            try:
+                frametype, args = self.read_header()
+            except TransferCancelled:
+                raise
+            except TransferError as err:
+                self._error(err)
+                continue
+            if frametype == ZRPOS:
+                break
+            elif frametype == ZSKIP:
+                self.log.info('zmodem: {0} skipped by receiver'.format(name))
+                return
+            elif frametype == ZCRC:
+                pos = fileobj.tell()
+                fileobj.seek(0)
+                crc = binascii.crc32(fileobj.read()) & 0xffffffff
+                fileobj.seek(pos)
+                self.send_hex_header(ZCRC, self.make_args(crc))
+                resend = False
+            elif frametype in (ZABORT, ZFERR, ZCAN):
+                raise TransferError('aborted by receiver')
+            elif frametype == ZRINIT:
+                # repeated reply to our ZRQINIT
+                resend = False
+            else:
+                self._error('unexpected frame {0} for ZFILE'
+                            .format(frametype))
+
+        pos = struct.unpack('<I', args)[0]
+        if pos:
+            self.log.info('zmodem: resuming {0} at {1}'.format(name, pos))
+        self._send_data(fileobj, size, pos)
+
+    def _send_data(self, fileobj, size, pos):
+        """ Stream file data from ``pos`` until acknowledged by ZRINIT. """
+        blocksize, good = self.blocksize, 0
+        acked = pos
+        fileobj.seek(pos)
+        self.send_bin_header(ZDATA, self.make_args(pos))
+        while True:
+            data = fileobj.read(blocksize)
+            at_eof = pos + len(data) >= size or len(data) < blocksize
+            if at_eof:
+                frame_end = ZCRCE
+            elif self.window and (pos + len(data)) // (
+                    self.window // 4) != pos // (self.window // 4):
+                frame_end = ZCRCQ
+            else:
+                frame_end = ZCRCG
+            self.channel.write(self.encode_subpacket(data, frame_end))
+            pos += len(data)
+            self._progress(size, pos)
+
+            good += 1
+            if good % 16 == 0 and blocksize < self.max_blocksize:
+                blocksize *= 2
+
+            if at_eof:
+                new_pos = self._send_eof(pos)
+                if new_pos is None:
+                    return
+            else:
+                new_pos = None
+                # handle any reply of receiver, waiting while too many
+                # bytes are not yet acknowledged.
+                while new_pos is None and (
+                        self.channel.peek() is not None or
+                        (self.window and pos - acked > self.window)):
+                    if self.channel.peek() not in (None, ZPAD):
+                        # discard anything but the start of a header,
+                        # such as the trailing bytes of a hex header.
+                        self.channel.read_byte(0)
+                        continue
+                    try:
+                        frametype, args = self.read_header()
+                    except TransferCancelled:
+                        raise
+                    except TransferError as err:
+                        self._error(err)
+                        continue
+                    if frametype == ZACK:
+                        acked = max(acked, struct.unpack('<I', args)[0])
+                        self.retries = 0
+                    elif frametype == ZRPOS:
+                        new_pos = struct.unpack('<I', args)[0]
+                        self.channel.write(self.encode_subpacket('', ZCRCE))
+                    elif frametype in (ZABORT, ZFERR, ZCAN, ZSKIP):
+                        raise TransferError('aborted by receiver')
+
+            if new_pos is not None:
+                if new_pos > acked:
+                    # receiver made progress since last error
+                    self.retries = 0
+                self._error('receiver requested position {0}'
+                            .format(new_pos))
+                blocksize, good = max(256, blocksize // 4), 0
+                pos = acked = new_pos
+                fileobj.seek(pos)
+                self.send_bin_header(ZDATA, self.make_args(pos))
+
+    def _send_eof(self, pos):
+        """
+        Send ZEOF at ``pos``, awaiting ZRINIT.
+
+        :returns: None when complete, or the position requested by ZRPOS.
+        """
+        while True:
+            self.send_bin_header(ZEOF, self.make_args(pos))
+            while True:
+                try:
+                    frametype, args = self.read_header()
+                except TransferCancelled:
+                    raise
+                except TransferError as err:
+                    self._error(err)
+                    break
+                if frametype in (ZRINIT, ZSKIP):
+                    return None
+                elif frametype == ZRPOS:
+                    return struct.unpack('<I', args)[0]
+                elif frametype in (ZABORT, ZFERR, ZCAN):
+                    raise TransferError('aborted by receiver')
+                elif frametype != ZACK:
+                    self._error('unexpected frame {0} for ZEOF'
+                                .format(frametype))
+                    break
+
+    def _send_fin(self):
+        """ End session by ZFIN, answered by ZFIN and ``OO``. """
+        for _ in range(4):
+            self.send_hex_header(ZFIN, self.make_args(0))
+            try:
+                frametype, _ = self.read_header(timeout=5)
+            except TransferError:
+                continue
+            if frametype == ZFIN:
+                break
+        self.channel.write('OO')
+
+    # receiver
+    #
+    def recv(self, open_file):
+        """
+        Receive files, each opened by callable ``open_file``.
+
+        :param callable open_file: given ``(name, size, mtime)`` of each file
+            offered, returns an open file object, or None to skip it.  The
+            file's current position, such as that of a file opened for
+            append, is the position the transfer resumes from.  The file is
+            closed when received or the transfer fails.
+        :returns: True if the session was completed.
+        :rtype: bool
+        """
+        fileobj, size, pos = None, None, 0
+        try:
+            self.send_rinit()
+            while True:
+                try:
+                    frametype, args = self.read_header()
+                except TransferCancelled:
+                    raise
+                except TransferError as err:
+                    self._error(err)
+                    if fileobj is None:
+                        self.send_rinit()
+                    else:
+                        self.send_hex_header(ZRPOS, self.make_args(pos))
+                    continue
+
+                if frametype is None:
+                    self._error('header CRC error')
+                    if fileobj is not None:
+                        self.send_hex_header(ZRPOS, self.make_args(pos))
+                    else:
+                        self.send_hex_header(ZNAK, self.make_args(0))
+
+                elif frametype == ZRQINIT:
+                    self.send_rinit()
+
+                elif frametype == ZSINIT:
+                    self.read_subpacket(self.rx_crc32)
+                    self.send_hex_header(ZACK, self.make_args(0))
+
+                elif frametype == ZFILE:
+                    try:
+                        data, _ = self.read_subpacket(self.rx_crc32)
+                    except TransferCancelled:
+                        raise
+                    except TransferError as err:
+                        self._error(err)
+                        self.send_hex_header(ZNAK, self.make_args(0))
+                        continue
+                    if fileobj is not None:
+                        fileobj.close()
+                    name, size, mtime = parse_file_info(data)
+                    fileobj = open_file(name, size, mtime)
+                    if fileobj is None:
+                        self.send_hex_header(ZSKIP, self.make_args(0))
+                        continue
+                    pos = fileobj.tell()
+                    self.send_hex_header(ZRPOS, self.make_args(pos))
+
+                elif frametype == ZDATA:
+                    if fileobj is None:
+                        self.send_rinit()
+                    elif struct.unpack('<I', args)[0] != pos:
+                        self.send_hex_header(ZRPOS, self.make_args(pos))
+                    else:
+                        pos = self._recv_data(fileobj, size, pos)
+
+                elif frametype == ZEOF:
+                    if fileobj is not None and struct.unpack(
+                            '<I', args)[0] == pos:
+                        fileobj.close()
+                        fileobj = None
+                        self.send_rinit()
+                    elif fileobj is None:
+                        self.send_rinit()
+
+                elif frametype == ZFIN:
+                    self.send_hex_header(ZFIN, self.make_args(0))
+                    self.channel.read(2, 1)
+                    return True
+
+                elif frametype in (ZABORT, ZCAN, ZFERR):
+                    raise TransferError('aborted by sender')
+
+        except TransferError as err:
+            self.log.warn('zmodem receive failed: {0}'.format(err))
+            self.channel.abort()
+            return False
+        finally:
+            if fileobj is not None:
+                fileobj.close()
+
+    def send_rinit(self):
+        """ Send ZRINIT, offering full streaming with CRC-32. """
+        self.send_hex_header(ZRINIT, chr(0) * 3 + chr(
+            CANFDX | CANOVIO | CANFC32))
+
+    def _recv_data(self, fileobj, size, pos):
+        """ Receive data subpackets of ZDATA frame, returning new position. """
+        while True:
+            try:
+                data, frame_end = self.read_subpacket(self.rx_crc32)
+            except TransferCancelled:
+                raise
+            except TransferError as err:
+                self._error(err)
+                self.send_hex_header(ZRPOS, self.make_args(pos))
+                return pos
+            fileobj.write(data)
+            pos += len(data)
+            self.retries = 0
+            self._progress(size, pos)
+            if frame_end in (ZCRCW, ZCRCQ):
+                self.send_hex_header(ZACK, self.make_args(pos))
+            if frame_end in (ZCRCW, ZCRCE):
+                return pos
+
+
+class YModemG(object):
+
+    """
+    YMODEM-G streaming file transfer.
+
+    Blocks are sent without waiting for acknowledgement and there is no
+    error recovery: any error cancels the transfer.  It is suited only to
+    error-free connections, such as telnet or ssh.
+    """
+
+    def __init__(self, channel, retry=16, timeout=30, callback=None):
+        """
+        Class initializer.
+
+        :param ModemChannel channel: channel of transfer.
+        :param int retry: number of times to request a transfer to begin.
+        :param int timeout: seconds to elapse for response before failing.
+        :param callable callback: called with ``(total_bytes, bytes_done,
+                                  error_count)`` as a transfer progresses.
+        """
+        self.channel = channel
+        self.retry = retry
+        self.timeout = timeout
+        self.callback = callback
+        self.log = logging.getLogger(__name__)
+
+    def write_block(self, seq, data):
+        """ Send block ``seq`` of ``data``, 128 or 1024 bytes. """
+        self.channel.write(''.join((
+            STX if len(data) == 1024 else SOH,
+            chr(seq & 0xff), chr(0xff - (seq & 0xff)), data,
+            struct.pack('>H', binascii.crc_hqx(data, 0)))))
+
+    def read_block(self, start):
+        """
+        Read block, whose first byte ``start`` has been read.
+
+        :returns: tuple of ``(seq, data)``.
+        :raises TransferError: timeout or CRC error.
+        """
+        length = 1024 if start == STX else 128
+        block = self.channel.read(length + 4, self.timeout)
+        if len(block) != length + 4:
+            raise TransferError('timeout in block')
+        seq, inverse = ord(block[0]), ord(block[1])
+        data, crc = block[2:-2], struct.unpack('>H', block[-2:])[0]
+        if seq != 0xff - inverse or binascii.crc_hqx(data, 0) != crc:
+            raise TransferError('error in block {0}'.format(seq))
+        return seq, data
+
+    def wait_for(self, chars, timeout=None):
+        """ Discard input until any of ``chars``, returning it. """
+        stime = time.time()
+        timeout = self.timeout if timeout is None else timeout
+        cancels = 0
+        while True:
+            char = self.channel.read_byte(
+                max(0, timeout - (time.time() - stime)))
+            if char is None:
+                raise TransferError('timeout waiting for {0!r}'.format(chars))
+            if char in chars:
+                return char
+            cancels = cancels + 1 if char == CAN else 0
+            if cancels >= 2:
+                raise TransferCancelled('cancelled by remote')
+
+    # sender
+    #
+    def send(self, files):
+        """
+        Send list of open ``files``.
+
+        :returns: True if all files were transferred.
+        :rtype: bool
+        """
+        try:
+            bytes_left = sum(get_file_info(fileobj)[1] for fileobj in files)
+            for num, fileobj in enumerate(files):
+                info = get_file_info(fileobj)
+                self.wait_for('GC')
+                header = format_file_info(info[0], info[1], info[2], info[3],
+                                          len(files) - num, bytes_left)
+                self.write_block(0, header.ljust(
+                    128 if len(header) <= 128 else 1024, '\x00'))
+                if self.wait_for(ACK + 'G') == ACK:
+                    self.wait_for('G')
+                self._send_data(fileobj, info[1])
+                bytes_left -= info[1]
+            # end of batch, by block 0 of empty file name
+            self.wait_for('GC')
+            self.write_block(0, '\x00' * 128)
+            try:
+                self.wait_for(ACK, timeout=5)
+            except TransferError:
+                pass
+        except TransferError as err:
+            self.log.warn('ymodem-g send failed: {0}'.format(err))
+            self.channel.abort()
+            return False
+        return True
+
+    def _send_data(self, fileobj, size):
+        """ Stream blocks of ``fileobj``, followed by EOT. """
+        seq, done = 1, 0
+        while True:
+            data = fileobj.read(1024)
+            if not data:
+                break
+            self.write_block(seq, data.ljust(
+                128 if len(data) <= 128 else 1024, SUB))
+            seq, done = seq + 1, done + len(data)
+            if self.callback is not None:
+                self.callback(size, done, 0)
+            if self.channel.peek() == CAN:
+                raise TransferCancelled('cancelled by remote')
+        for _ in range(self.retry):
+            self.channel.write(EOT)
+            try:
+                if self.wait_for(ACK + NAK, timeout=10) == ACK:
+                    return
+            except TransferCancelled:
+                raise
+            except TransferError:
+                pass
+        raise TransferError('EOT not acknowledged')
+
+    # receiver
+    #
+    def recv(self, open_file):
+        """
+        Receive files, each opened by callable ``open_file``.
+
+        :param callable open_file: given ``(name, size, mtime)`` of each file
+            offered, returns an open file object; the transfer is cancelled
+            when None.  The file is closed when received or the transfer
+            fails.
+        :returns: True if all files offered were received.
+        :rtype: bool
+        """
+        fileobj = None
+        try:
+            while True:
+                for _ in range(self.retry):
+                    self.channel.write('G')
+                    try:
+                        start = self.wait_for(SOH + STX, timeout=10)
+                    except TransferCancelled:
+                        raise
+                    except TransferError:
+                        continue
+                    break
+                else:
+                    raise TransferError('sender did not respond')
+                seq, data = self.read_block(start)
+                if seq != 0:
+                    raise TransferError('expected block 0, got {0}'
+                                        .format(seq))
+                name, size, mtime = parse_file_info(data)
+                if not name:
+                    self.channel.write(ACK)
+                    return True
+                fileobj = open_file(name, size, mtime)
+                if fileobj is None:
+                    raise TransferError('file {0!r} refused'.format(name))
+                self.channel.write(ACK + 'G')
+                self._recv_data(fileobj, size)
+                fileobj.close()
+                fileobj = None
+        except TransferError as err:
+            self.log.warn('ymodem-g receive failed: {0}'.format(err))
+            self.channel.abort()
+            return False
+        finally:
+            if fileobj is not None:
+                fileobj.close()
+
+    def _recv_data(self, fileobj, size):
+        """ Receive blocks into ``fileobj`` until EOT. """
+        seq, done = 1, 0
+        while True:
+            start = self.wait_for(SOH + STX + EOT)
+            if start == EOT:
+                self.channel.write(ACK)
+                return
+            block_seq, data = self.read_block(start)
+            if block_seq != seq & 0xff:
+                raise TransferError('expected block {0}, got {1}'
+                                    .format(seq & 0xff, block_seq))
+            if size is not None:
+                data = data[:max(0, size - done)]
+            fileobj.write(data)
+            seq, done = seq + 1, done + len(data)
+            if self.callback is not None:
+                self.callback(size, done, 0)
+
 
 def send_modem(stream, protocol='xmodem1k', retry=16, timeout=30,
                callback=None):
     """
-    Send a file using 'xmodem1k' or 'xmodem' protocol.
+    Send a file using 'xmodem1k', 'xmodem', 'ymodem-g' or 'zmodem' protocol.
 
-    Currently, these are the only protocols supported.  Returns ``True`` upon
-    successful transmission, otherwise ``False``.
+    Returns ``True`` upon successful transmission, otherwise ``False``.
 
-    :param stream: The file-like stream object to send data from.
+    :param stream: The file-like stream object to send data from, or for
+                   batch protocols 'ymodem-g' and 'zmodem', optionally
+                   a list of them.
     :param int retry: The maximum number of times to try to resend a failed
                       packet before failing.
     :param int timeout: seconds to elapse for response before failing.
@@ -24,86 +1040,92 @@ def send_modem(stream, protocol='xmodem1k', retry=16, timeout=30,
            status updates while a transfer is underway::
 
                def callback(total_count, success_count, error_count)
+
+           For 'ymodem-g' and 'zmodem', counts are of bytes, rather than
+           packets, of the current file.
     """
-    # get protocol implementation class
-    supported_protocols = ('xmodem', 'xmodem1k')
-    assert protocol in supported_protocols, (protocol, supported_protocols)
+    assert protocol in PROTOCOLS, (protocol, PROTOCOLS)
+    channel = ModemChannel()
+    if protocol in ('ymodem-g', 'zmodem'):
+        files = stream if isinstance(stream, (list, tuple)) else [stream]
+        if protocol == 'zmodem':
+            modem = ZModem(channel, retry=retry, timeout=timeout,
+                           callback=callback)
+        else:
+            modem = YModemG(channel, retry=retry, timeout=timeout,
+                            callback=callback)
+        return modem.send(files)
+
     Modem = {
         'xmodem': xmodem.XMODEM,
         'xmodem1k': xmodem.XMODEM1k,
     }[protocol]
 
     # the session's 'input' event buffer is used for receiving
-    # transmissions.  It arrives in raw bytes, and session.write
-    # is used, sending "unicode" data as encoding iso8859-1.
-    session = getsession()
-
-    def getc(size, timeout=10):
-        """ Callback function for (X)Modem interface. """
-        val = b''
-        while len(val) < size:
-            next_val = session.read_event('input', timeout=timeout)
-            if next_val is None:
-                break
-            val += next_val
-        if len(val) > size:
-            session.buffer_input(val[size:])
-        return val[:size] or None
-
-    def putc(data, timeout=10):
-        # pylint: disable=W0613
-        #         Unused argument 'timeout'
-        """ Callback function for (X)Modem interface. """
-        session.write(data.decode('iso8859-1'), 'iso8859-1')
-
-    modem = Modem(getc, putc)
+    # transmissions.  It arrives in raw bytes, and session.write_bytes
+    # is used for sending.
+    modem = Modem(channel.getc, channel.putc)
     return modem.send(stream=stream, retry=retry, timeout=timeout,
                       quiet=True, callback=callback)
 
 
 def recv_modem(stream, protocol='xmodem1k', retry=16, timeout=30):
     """
-    Receive a file using 'xmodem1k' or 'xmodem' protocol into ``stream``.
+    Receive a file using 'xmodem1k', 'xmodem', 'ymodem-g' or 'zmodem'.
 
-    Currently, these are the only protocols supported.  Returns ``True`` upon
-    successful transmission, otherwise ``False``.
+    Returns ``True`` upon successful transmission, otherwise ``False``.
 
-    :param stream: The file-like stream object to send data from.
+    :param stream: The file-like stream object to receive data to.  For
+                   batch protocols 'ymodem-g' and 'zmodem', this may be
+                   a callable receiving the ``(name, size, mtime)`` of each
+                   file offered by the sender, returning a file object
+                   opened for writing, or None to skip it (zmodem only).
+                   A 'zmodem' transfer resumes from the current position
+                   of the file returned, such as one opened for append.
     :param int retry: The maximum number of times to try to resend a failed
                       packet before failing.
     :param int timeout: seconds to elapse for response before failing.
     """
-    # get protocol implementation class
-    supported_protocols = ('xmodem', 'xmodem1k')
-    assert protocol in supported_protocols, (protocol, supported_protocols)
+    assert protocol in PROTOCOLS, (protocol, PROTOCOLS)
+    channel = ModemChannel()
+    if protocol in ('ymodem-g', 'zmodem'):
+        if callable(stream):
+            open_file = stream
+        else:
+            # only the first file offered is received into a stream,
+            # which remains open for the caller.
+            offered = []
+
+            class _Unclosed(object):
+
+                """ Proxy of ``stream`` whose close() is ignored. """
+
+                def __getattr__(self, attr):
+                    return getattr(stream, attr)
+
+                def close(self):
+                    """ Do not close ``stream``. """
+                    pass
+
+            def open_file(*_):
+                """ Return ``stream`` for first file only. """
+                offered.append(True)
+                return _Unclosed() if len(offered) == 1 else None
+
+        if protocol == 'zmodem':
+            modem = ZModem(channel, retry=retry, timeout=timeout)
+        else:
+            modem = YModemG(channel, retry=retry, timeout=timeout)
+        return modem.recv(open_file)
+
     Modem = {
         'xmodem': xmodem.XMODEM,
         'xmodem1k': xmodem.XMODEM1k,
     }[protocol]
 
     # the session's 'input' event buffer is used for receiving
-    # transmissions.  It arrives in raw bytes, and session.write
-    # is used, sending "unicode" data as encoding iso8859-1.
-    session = getsession()
-
-    def getc(size, timeout=10):
-        """ Callback function for (X)Modem interface. """
-        val = b''
-        while len(val) < size:
-            next_val = session.read_event('input', timeout=timeout)
-            if next_val is None:
-                break
-            val += next_val
-        if len(val) > size:
-            session.buffer_input(val[size:])
-        return val[:size] or None
-
-    def putc(data, timeout=10):
-        """ Callback function for (X)Modem interface. """
-        # pylint: disable=W0613
-        #         Unused argument 'timeout'
-        session.write(data.decode('iso8859-1'), 'iso8859-1')
-
-    modem = Modem(getc, putc)
+    # transmissions.  It arrives in raw bytes, and session.write_bytes
+    # is used for sending.
+    modem = Modem(channel.getc, channel.putc)
     return modem.recv(stream=stream, retry=retry,
                       timeout=timeout, quiet=True)
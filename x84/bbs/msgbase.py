@@ -1,11 +1,13 @@
 """ Messaging database package for x/84. """
 # std imports
 import datetime
+import fnmatch
 import logging
+import time
 
 # local
 from x84.bbs.dbproxy import DBProxy
-from x84.bbs.session import getsession
+from x84.bbs.session import getsession, publish_notifications
 from x84.bbs.ini import get_ini
 
 # 3rd party
@@ -15,6 +17,36 @@ MSGDB = 'msgbase'
 TAGDB = 'tags'
 PRIVDB = 'privmsg'
 
+#: table of TAGDB, highest message index of each tag
+LATEST_TABLE = 'latest'
+
+#: table of MSGDB, ``next_idx``, index of the next message saved, which is
+#: never lowered, so that the index of a message deleted or archived is not
+#: reused.
+ALLOC_TABLE = 'alloc'
+
+#: materialized view of users' subscriptions: table ``bytag``, ``(stime,
+#: indices)``, the time built and public messages of each tag pattern
+#: subscribed, and ``users``, tag patterns subscribed by each user.
+VIEWDB = 'msgview'
+
+#: seconds after which the view of a tag pattern is rebuilt.  Views are
+#: updated by each process saving messages, whose locks do not exclude
+#: one another, so that an update lost to that of another process is kept
+#: no longer than this.
+VIEW_MAX_AGE = 3600
+
+#: reply graph of messages: table ``nodes``, ``(parent, root)`` of each
+#: reply, ``children``, set of replies of each message, and ``threads``,
+#: the index of the latest message of each thread, keyed by its root.
+THREADDB = 'msgthread'
+
+#: networks whose translation index is verified by this process
+_TRANS_INDEXED = set()
+
+#: whether reply graph is verified by this process
+_THREADS_INDEXED = []
+
 # TODO(jquast, maze): Use modeling to construct rfc-compliant mail messaging
 # formats.  It would be possible to use standard mbox-formatted mail boxes,
 # and integrate with external systems.  This is a v3.0 release.
@@ -81,6 +113,522 @@ def list_tags():
     return [_tag.decode('utf8') for _tag in DBProxy(TAGDB).keys()]
 
 
+def _check_threads(use_session=True):
+    """ Build reply graph of messages saved by earlier versions. """
+    if _THREADS_INDEXED:
+        return
+    db_meta = DBProxy(THREADDB, 'meta', use_session=use_session)
+    if not db_meta.get('indexed'):
+        log = logging.getLogger(__name__)
+        with DBProxy(THREADDB, 'nodes', use_session=use_session):
+            parents = dict((int(key), msg.parent) for key, msg in
+                           DBProxy(MSGDB, use_session=use_session).items())
+            # every message is linked, so that each root without
+            # replies is also recorded as a thread.
+            msgs = [(idx, parent if parent in parents and parent != idx
+                     else None)
+                    for idx, parent in sorted(parents.items())]
+            _link_msgs(msgs, use_session)
+            db_meta['indexed'] = True
+        log.info('indexed {0} replies of {1} messages.'
+                 .format(len([parent for _, parent in msgs
+                              if parent is not None]), len(parents)))
+    _THREADS_INDEXED.append(True)
+
+
+def _link_msgs(msgs, use_session):
+    """
+    Record new messages in the reply graph of :data:`THREADDB`.
+
+    Caller should hold the lock of table ``nodes``.
+
+    :param list msgs: ``(idx, parent)`` of each message, ordered by
+                      index, where ``parent`` is None or an existing
+                      message.
+    """
+    db_nodes = DBProxy(THREADDB, 'nodes', use_session=use_session)
+    db_children = DBProxy(THREADDB, 'children', use_session=use_session)
+    nodes, children, threads = dict(), dict(), dict()
+    for idx, parent in msgs:
+        root = idx
+        if parent is not None:
+            key = '%d' % (parent,)
+            root = (nodes.get(key) or db_nodes.get(key, (None, parent)))[1]
+            nodes['%d' % (idx,)] = (parent, root)
+            if key not in children:
+                children[key] = db_children.get(key, set())
+            children[key].add(idx)
+        threads['%d' % (root,)] = idx
+    if nodes:
+        db_nodes.update(nodes)
+    if children:
+        db_children.update(children)
+    DBProxy(THREADDB, 'threads', use_session=use_session).update(threads)
+
+
+def get_thread_root(idx):
+    """ Return index of first message of thread of message ``idx``. """
+    _check_threads()
+    return DBProxy(THREADDB, 'nodes').get('%d' % int(idx), (None, idx))[1]
+
+
+def get_ancestors(idx):
+    """
+    Return indices of messages replied by message ``idx``.
+
+    :returns: list of its parent, its parent's parent, and so on to the
+              first message of the thread.
+    :rtype: list
+    """
+    _check_threads()
+    db_nodes = DBProxy(THREADDB, 'nodes')
+    ancestors = list()
+    parent = db_nodes.get('%d' % int(idx), (None, None))[0]
+    while parent is not None and parent not in ancestors:
+        ancestors.append(parent)
+        parent = db_nodes.get('%d' % (parent,), (None, None))[0]
+    return ancestors
+
+
+def get_descendants(idx):
+    """
+    Return indices of all replies to message ``idx``, and their replies.
+
+    :returns: set of message indices, some may have since been deleted.
+    :rtype: set
+    """
+    _check_threads()
+    db_children = DBProxy(THREADDB, 'children')
+    descendants = set()
+    pending = [int(idx)]
+    while pending:
+        replies = db_children.get('%d' % (pending.pop(),), set())
+        pending.extend(replies - descendants)
+        descendants.update(replies)
+    return descendants
+
+
+def list_threads():
+    """
+    Return threads of messages, most recently active first.
+
+    :returns: list of ``(root, latest)``, the indices of the first and
+              most recent message of each thread.
+    :rtype: list
+    """
+    _check_threads()
+    return sorted(((int(root), latest) for root, latest in
+                   DBProxy(THREADDB, 'threads').items()),
+                  key=lambda thread: thread[1], reverse=True)
+
+
+def sort_by_thread(indices):
+    """
+    Return message ``indices`` ordered by thread.
+
+    Threads are ordered by their most recent message, the least recently
+    active first.  The messages of each thread follow one another, each
+    reply following the message it replied to.
+
+    A stored procedure of the engine, see :func:`x84.db.load_procedures`:
+    the reply graph is read beside the database, only the ordered indices
+    are returned.
+
+    :param indices: message indices, such as of a subscription.
+    :rtype: list
+    """
+    _check_threads()
+    nodes = dict((int(key), node) for key, node in
+                 DBProxy(THREADDB, 'nodes').items())
+    activity = dict((int(root), latest) for root, latest in
+                    DBProxy(THREADDB, 'threads').items())
+
+    def path(idx):
+        """ Return indices from root of thread to message ``idx``. """
+        result = [idx]
+        while result[-1] in nodes and nodes[result[-1]][0] not in result:
+            result.append(nodes[result[-1]][0])
+        return result[::-1]
+
+    def sort_key(idx):
+        root = nodes.get(idx, (None, idx))[1]
+        return (activity.get(root, root), root, path(idx))
+    return sorted(indices, key=sort_key)
+
+
+def unread_counts(handle, patterns):
+    """
+    Return number of messages of subscription ``patterns`` for ``handle``.
+
+    A stored procedure of the engine, see :func:`x84.db.load_procedures`:
+    the subscription view of the user and the messages read by them are
+    read beside the database, only their counts are returned.
+
+    :param str handle: user handle.
+    :param list patterns: tag patterns of subscription, as for
+                          :func:`fnmatch.fnmatch`.
+    :returns: ``(counts, counts_bytag)``, where ``counts`` is a dictionary
+              of the number of ``'all'``, ``'new'`` and ``'private'``
+              messages, and ``'newest'``, the index of the newest unread
+              message, or -1.  ``counts_bytag`` is a dictionary of numbers
+              of ``'all'`` and ``'new'`` messages by tag pattern.
+    :rtype: tuple
+    """
+    from x84.bbs.userbase import USERDB
+    view = get_subscription_view(handle, patterns)
+    messages_read = DBProxy(USERDB, 'attrs').get(
+        handle, dict()).get('readmsgs', set())
+
+    all_msgs = set()
+    counts_bytag = dict()
+    for tag_pattern in patterns:
+        matched = view['bytag'][tag_pattern]
+        all_msgs.update(matched)
+        counts_bytag[tag_pattern] = {
+            'all': len(matched), 'new': len(matched - messages_read)}
+
+    new_msgs = (all_msgs | view['private']) - messages_read
+    counts = {'all': len(all_msgs), 'new': len(new_msgs),
+              'private': len(view['private']),
+              'newest': max(new_msgs or [-1])}
+    return counts, counts_bytag
+
+
+def build_pattern_view(tag_pattern, use_session=True):
+    """
+    Return indices of public messages of tags matching ``tag_pattern``.
+
+    :rtype: set
+    """
+    tagged = dict((tag.decode('utf8'), msgs) for tag, msgs in
+                  DBProxy(TAGDB, use_session=use_session).items())
+    matched = set()
+    for tag_match in fnmatch.filter(tagged.keys(), tag_pattern):
+        matched.update(tagged[tag_match])
+    return matched & tagged.get(u'public', set())
+
+
+def _is_stale_view(view):
+    """ Whether ``view``, ``(stime, indices)`` of a pattern, is rebuilt. """
+    return (not isinstance(view, tuple) or
+            not 0 <= time.time() - view[0] < VIEW_MAX_AGE)
+
+
+def get_subscription_view(handle, patterns):
+    """
+    Return subscription view of ``patterns`` of user ``handle``.
+
+    The public messages of each tag pattern subscribed by any user are kept
+    by table ``bytag`` of database :data:`VIEWDB`, updated as messages are
+    saved, so that the messages of a subscription are found by a single
+    database command for each of its patterns.  The messages of a pattern
+    are built when first subscribed, rebuilt once older than
+    :data:`VIEW_MAX_AGE`, and discarded once no user remains subscribed to
+    it.  Private messages are those of the user's key of database
+    :data:`PRIVDB`.
+
+    :returns: dictionary of ``'patterns'``, ``'bytag'``, a set of public
+              message indices by tag pattern, and ``'private'``, the set of
+              private messages addressed to the user.
+    :rtype: dict
+    """
+    db_bytag = DBProxy(VIEWDB, 'bytag')
+    bytag = dict((tag_pattern, db_bytag.get(tag_pattern))
+                 for tag_pattern in patterns)
+    stale = [tag_pattern for tag_pattern, view in bytag.items()
+             if _is_stale_view(view)]
+    db_users = DBProxy(VIEWDB, 'users')
+    if stale or db_users.get(handle) != list(patterns):
+        # built and stored while holding the lock of update_subscription_
+        # views(), so that no message saved meanwhile by this process is
+        # missed.
+        with db_bytag:
+            for tag_pattern in stale:
+                view = db_bytag.get(tag_pattern)
+                if _is_stale_view(view):
+                    view = (time.time(), build_pattern_view(tag_pattern))
+                    db_bytag[tag_pattern] = view
+                bytag[tag_pattern] = view
+            with db_users:
+                unsubscribed = (set(db_users.get(handle, ())) -
+                                set(patterns))
+                db_users[handle] = list(patterns)
+                if unsubscribed:
+                    for _patterns in db_users.values():
+                        unsubscribed -= set(_patterns)
+            for tag_pattern in unsubscribed & set(db_bytag.keys()):
+                del db_bytag[tag_pattern]
+    private = DBProxy(PRIVDB).get(handle, set())
+    return {'patterns': list(patterns),
+            'bytag': dict((tag_pattern, indices) for tag_pattern, (_, indices)
+                          in bytag.items()),
+            'private': private}
+
+
+def update_subscription_views(msgs=(), untagged=(), deleted=(),
+                              use_session=True):
+    """
+    Update subscription views of all users for saved or deleted messages.
+
+    Only the messages of tag patterns matching the tags of ``msgs``, or
+    those of ``untagged``, are updated.
+
+    :param list msgs: :class:`Msg` instances, new or whose tags changed.
+    :param list untagged: tags removed of ``msgs``.
+    :param list deleted: indices of deleted messages.
+    """
+    db_bytag = DBProxy(VIEWDB, 'bytag', use_session=use_session)
+    with db_bytag:
+        added, removed = dict(), dict()
+        tag_patterns = db_bytag.keys()
+        for msg in msgs:
+            for tag_pattern in tag_patterns:
+                if 'public' in msg.tags and fnmatch.filter(
+                        msg.tags, tag_pattern):
+                    added.setdefault(tag_pattern, set()).add(msg.idx)
+                elif fnmatch.filter(list(msg.tags) + list(untagged),
+                                    tag_pattern):
+                    removed.setdefault(tag_pattern, set()).add(msg.idx)
+        if deleted:
+            for tag_pattern in tag_patterns:
+                removed.setdefault(tag_pattern, set()).update(deleted)
+        updated = dict()
+        for tag_pattern in set(added) | set(removed):
+            view = db_bytag[tag_pattern]
+            if _is_stale_view(view):
+                # rebuilt when next read.
+                continue
+            stime, indices = view
+            changed = ((indices | added.get(tag_pattern, set())) -
+                       removed.get(tag_pattern, set()))
+            if changed != indices:
+                updated[tag_pattern] = (stime, changed)
+        if updated:
+            db_bytag.update(updated)
+
+
+def allocate_idx(db_msg, count=1, use_session=True):
+    """
+    Return index of first of ``count`` new messages, reserving them.
+
+    Caller should hold the lock of :data:`MSGDB`, ``db_msg``.  The next
+    index is that of table :data:`ALLOC_TABLE`, or for a message base of
+    an earlier version, one greater than the highest index of a message.
+    A ``count`` of 0 only records the next index.
+    """
+    db_alloc = DBProxy(MSGDB, table=ALLOC_TABLE, use_session=use_session)
+    next_idx = db_alloc.get('next_idx')
+    if next_idx is None:
+        next_idx = max(map(int, db_msg.keys()) or [-1]) + 1
+    elif not count:
+        return next_idx
+    db_alloc['next_idx'] = next_idx + count
+    return next_idx
+
+
+def get_latest_idx(tag, use_session=True):
+    """
+    Return highest index of messages tagged ``tag``, or -1.
+
+    Read from table :data:`LATEST_TABLE`, recorded as messages are saved,
+    so that the messages of a tag need not be read to determine whether
+    any are new.  A tag is indexed on first use.
+    """
+    latest = DBProxy(TAGDB, table=LATEST_TABLE,
+                     use_session=use_session).get(tag)
+    if latest is None:
+        with DBProxy(TAGDB, use_session=use_session) as db_tag:
+            latest = _update_latest(
+                db_tag, dict(((tag, db_tag.get(tag, set())),)),
+                use_session)[tag]
+    return latest
+
+
+def _update_latest(db_tag, tagged, use_session):
+    """
+    Record highest message index of tags, ``tagged``.
+
+    :param DBProxy db_tag: TAGDB, whose lock is held by caller.
+    :param dict tagged: set of new message indices by tag.
+    :returns: highest message index by tag.
+    :rtype: dict
+    """
+    db_latest = DBProxy(TAGDB, table=LATEST_TABLE, use_session=use_session)
+    latest = dict()
+    for tag, idxs in tagged.items():
+        current = db_latest.get(tag)
+        if current is None:
+            current = max(db_tag.get(tag) or [-1])
+        latest[tag] = max([current] + list(idxs))
+    db_latest.update(latest)
+    return latest
+
+
+def save_msgs(msgs, ctimes=None):
+    """
+    Save list of new messages ``msgs`` to database in bulk.
+
+    Rather than the several database commands of each message by
+    :meth:`Msg.save`, each database is updated by a single command for
+    all messages, such as a batch received by a message network server.
+    Messages are not queued for delivery to message networks.
+
+    :param list msgs: new :class:`Msg` instances, their ``idx`` is set.
+    :param list ctimes: creation time of each message, optional.
+    """
+    log = logging.getLogger(__name__)
+    if not msgs:
+        return
+    use_session = bool(getsession() is not None)
+
+    # persist message records to MSGDB
+    with DBProxy(MSGDB, use_session=use_session) as db_msg:
+        next_idx = allocate_idx(db_msg, len(msgs), use_session)
+        records = dict()
+        for num, msg in enumerate(msgs):
+            msg.idx = next_idx + num
+            ctime = ctimes[num] if ctimes else None
+            # pylint: disable=W0212
+            #         Access to a protected member
+            if ctime is not None:
+                msg._ctime = msg._stime = ctime
+            else:
+                msg._stime = datetime.datetime.now()
+            records['%d' % (msg.idx,)] = msg
+        db_msg.update(records)
+
+        # persist messages as replies of their parents
+        replies = list()
+        for msg in msgs:
+            parent = msg.parent
+            if parent is not None and not (
+                    '%d' % int(parent) in records or
+                    '%d' % int(parent) in db_msg):
+                log.warn('Child message {0}.parent = {1}: parent does '
+                         'not exist!'.format(msg.idx, parent))
+                parent = None
+            replies.append((msg.idx, None if parent is None else int(parent)))
+    _check_threads(use_session)
+    with DBProxy(THREADDB, 'nodes', use_session=use_session):
+        _link_msgs(replies, use_session)
+
+    # persist message idx to TAGDB
+    tagged = dict()
+    for msg in msgs:
+        for tag in msg.tags:
+            tagged.setdefault(tag, set()).add(msg.idx)
+    with DBProxy(TAGDB, use_session=use_session) as db_tag:
+        db_tag.update(dict((tag, db_tag.get(tag, set()) | idxs)
+                           for tag, idxs in tagged.items()))
+        _update_latest(db_tag, tagged, use_session)
+
+    # persist message records to PRIVDB
+    private = dict()
+    for msg in msgs:
+        if 'public' not in msg.tags:
+            private.setdefault(msg.recipient, set()).add(msg.idx)
+    if private:
+        with DBProxy(PRIVDB, use_session=use_session) as db_priv:
+            db_priv.update(dict(
+                (recipient, db_priv.get(recipient, set()) | idxs)
+                for recipient, idxs in private.items()))
+
+    update_subscription_views(msgs, use_session=use_session)
+    publish_notifications([msg.notification for msg in msgs])
+
+    log.info(u'saved {0} new messages.'.format(len(msgs)))
+
+
+class TransIndex(object):
+
+    """
+    Translation of message ids of a message network to local message ids.
+
+    Stored by database ``<network>trans``, where the default table is keyed
+    by network message id, and table ``local`` by local message index, so
+    that both directions are a single indexed lookup.  Used by both the
+    message network client, :mod:`x84.msgpoll`, and its server,
+    :mod:`x84.webmodules.msgserve`.
+
+    The reverse table of a database written by earlier versions is built
+    on first use.  This object is a context manager of the database lock,
+    held when both tables are written.
+    """
+
+    def __init__(self, network, use_session=True):
+        """
+        Class initializer.
+
+        :param str network: name of message network.
+        :param bool use_session: as of :class:`~x84.bbs.dbproxy.DBProxy`.
+        """
+        schema = '{0}trans'.format(network)
+        self.network = network
+        self.by_network = DBProxy(schema, use_session=use_session)
+        self.by_local = DBProxy(schema, table='local', use_session=use_session)
+        self._meta = DBProxy(schema, table='meta', use_session=use_session)
+        if network not in _TRANS_INDEXED:
+            self._check_index()
+            _TRANS_INDEXED.add(network)
+
+    def _check_index(self):
+        """ Build reverse table, when not yet built. """
+        if self._meta.get('indexed'):
+            return
+        log = logging.getLogger(__name__)
+        with self:
+            translations = [(net_id, int(idx))
+                            for net_id, idx in self.by_network.items()]
+            self.by_local.update(dict(
+                (str(idx), net_id) for net_id, idx in translations))
+            self._meta['indexed'] = True
+        log.info('[{0}] indexed {1} translated message ids.'
+                 .format(self.network, len(translations)))
+
+    # keys are always strings, as stored by sqlite, whereas message ids
+    # of the network's json are integers.
+
+    def __contains__(self, net_id):
+        """ Whether network message ``net_id`` is translated. """
+        return str(net_id) in self.by_network
+
+    def get_local(self, net_id, default=None):
+        """ Return local index of network message ``net_id``. """
+        return self.by_network.get(str(net_id), default)
+
+    def get_network(self, idx, default=None):
+        """ Return network message id of local message index ``idx``. """
+        return self.by_local.get(str(idx), default)
+
+    def add(self, net_id, idx):
+        """
+        Record translation of network message ``net_id`` to index ``idx``.
+
+        Caller should hold the lock of this object.
+        """
+        self.by_network[str(net_id)] = int(idx)
+        self.by_local[str(idx)] = net_id
+
+    def add_many(self, translations):
+        """
+        Record translations of sequence of ``(net_id, idx)``.
+
+        Caller should hold the lock of this object.
+        """
+        translations = list(translations)
+        self.by_network.update(dict(
+            (str(net_id), int(idx)) for net_id, idx in translations))
+        self.by_local.update(dict(
+            (str(idx), net_id) for net_id, idx in translations))
+
+    def __enter__(self):
+        self.by_network.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.by_network.release()
+
+
 class Msg(object):
 
     """
@@ -121,6 +669,37 @@ class Msg(object):
         """
         return self._stime
 
+    @property
+    def notification(self):
+        """
+        Notification of this message, ``'kind'`` is ``'mail'`` or ``'post'``.
+
+        See :func:`x84.bbs.session.publish_notifications`.
+
+        :rtype: dict
+        """
+        return {'kind': 'post' if 'public' in self.tags else 'mail',
+                'idx': self.idx,
+                'author': self.author,
+                'recipient': self.recipient,
+                'subject': self.subject,
+                'tags': list(self.tags)}
+
+    @property
+    def children(self):
+        """
+        Indices of messages replying to this message.
+
+        Kept by the reply graph of :data:`THREADDB`, see also
+        :func:`get_descendants`.
+
+        :rtype: set
+        """
+        if self.idx is None:
+            return set()
+        _check_threads()
+        return DBProxy(THREADDB, 'children').get('%d' % (self.idx,), set())
+
     def __init__(self, recipient=None, subject=u'', body=u''):
         self.author = None
         session = getsession()
@@ -133,7 +712,6 @@ class Msg(object):
         self.subject = subject
         self.body = body
         self.tags = set()
-        self.children = set()
         self.parent = None
         self.idx = None
 
@@ -152,7 +730,7 @@ class Msg(object):
         # persist message record to MSGDB
         with DBProxy(MSGDB, use_session=use_session) as db_msg:
             if new:
-                self.idx = max(map(int, db_msg.keys()) or [-1]) + 1
+                self.idx = allocate_idx(db_msg, use_session=use_session)
                 if ctime is not None:
                     self._ctime = self._stime = ctime
                 else:
@@ -161,40 +739,45 @@ class Msg(object):
             db_msg['%d' % (self.idx,)] = self
 
         # persist message idx to TAGDB
+        retagged, untagged = new, list()
         with DBProxy(TAGDB, use_session=use_session) as db_tag:
             for tag in db_tag.keys():
                 msgs = db_tag[tag]
                 if tag in self.tags and self.idx not in msgs:
                     msgs.add(self.idx)
                     db_tag[tag] = msgs
+                    retagged = True
                     log.debug("msg {self.idx} tagged '{tag}'"
                               .format(self=self, tag=tag))
                 elif tag not in self.tags and self.idx in msgs:
                     msgs.remove(self.idx)
                     db_tag[tag] = msgs
+                    retagged = True
+                    untagged.append(tag)
                     log.info("msg {self.idx} removed tag '{tag}'"
                              .format(self=self, tag=tag))
             for tag in [_tag for _tag in self.tags if _tag not in db_tag]:
                 db_tag[tag] = set([self.idx])
-
-        # persist message as child to parent;
-        assert self.parent not in self.children, ('circular reference',
-                                                  self.parent, self.children)
-        if self.parent is not None:
-            try:
-                parent_msg = get_msg(self.parent)
-            except KeyError:
+                retagged = True
+            _update_latest(db_tag, dict((tag, set([self.idx]))
+                                        for tag in self.tags), use_session)
+
+        # persist new message as reply to parent, without loading it.
+        if new:
+            parent = self.parent
+            if parent is not None and '%d' % int(parent) not in db_msg:
                 log.warn('Child message {0}.parent = {1}: '
-                         'parent does not exist!'.format(self.idx, self.parent))
-            else:
-                if self.idx != parent_msg.idx:
-                    parent_msg.children.add(self.idx)
-                    parent_msg.save()
-                else:
-                    log.error('Parent idx same as message idx; stripping')
-                    self.parent = None
-                    with db_msg:
-                        db_msg['%d' % (self.idx)] = self
+                         'parent does not exist!'.format(self.idx, parent))
+                parent = None
+            elif parent is not None and int(parent) == self.idx:
+                log.error('Parent idx same as message idx; stripping')
+                self.parent = parent = None
+                with db_msg:
+                    db_msg['%d' % (self.idx)] = self
+            _check_threads(use_session)
+            with DBProxy(THREADDB, 'nodes', use_session=use_session):
+                _link_msgs([(self.idx, None if parent is None
+                             else int(parent))], use_session)
 
         # persist message record to PRIVDB
         if 'public' not in self.tags:
@@ -202,6 +785,16 @@ class Msg(object):
                 db_priv[self.recipient] = (
                     db_priv.get(self.recipient, set()) | set([self.idx]))
 
+        # update subscription views of users matching its tags, or
+        # those no longer matching, such as when deleted.
+        if retagged:
+            update_subscription_views([self], untagged,
+                                      use_session=use_session)
+
+        # notify recipient and subscribers of its tags that are online.
+        if new:
+            publish_notifications([self.notification])
+
         # if either any of 'server_tags' or 'network_tags' are enabled,
         # then queue for potential delivery.
         if send_net and new and (
@@ -231,10 +824,10 @@ class Msg(object):
             # server networks offered by this server,
             # message is for a network we host
             if tag in get_ini(section='msg', key='server_tags', split=True):
-                with DBProxy('{0}trans'.format(tag)) as transdb:
+                with TransIndex(tag) as transdb:
                     self.body = u''.join((self.body, format_origin_line()))
                     self.save()
-                    transdb[self.idx] = self.idx
+                    transdb.add(net_id=self.idx, idx=self.idx)
                 log.info('[{tag}] Stored for network (msgid {self.idx}).'
                          .format(tag=tag, self=self))
 
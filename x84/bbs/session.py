@@ -12,7 +12,9 @@ import sys
 import os
 
 # local
+from x84 import metrics, profiler
 from x84.bbs.exception import Disconnected, Goto
+from x84.bbs.ipc import flush_log
 from x84.bbs.script_def import Script
 from x84.bbs.userbase import User
 from x84.bbs.ini import get_ini
@@ -21,6 +23,10 @@ from x84.bbs.ini import get_ini
 #: singleton representing the session connected by current process
 SESSION = None
 
+#: database of notifications published by processes without a session,
+#: delivered by the engine, see :func:`x84.terminal.drain_notifications`.
+NOTIFY_DB = 'notify'
+
 
 def getsession():
     """ Return :class:`Session` instance of current process. """
@@ -64,6 +70,34 @@ def getch(timeout=None):
     return keystroke
 
 
+def publish_notifications(notes):
+    """
+    Publish notifications to online sessions.
+
+    Each notification is a dictionary of at least ``'kind'``, ``'author'``,
+    ``'recipient'`` and ``'tags'``.  It is received as data of event
+    ``notify`` by sessions of user ``recipient``, and by sessions whose
+    subscription, as by :meth:`Session.subscribe_notifications`, matches
+    any of its ``tags`` when it is public, except those of its ``author``.
+
+    When published by a process without a session, such as a job of the
+    scheduler, notifications are queued by database :data:`NOTIFY_DB` and
+    delivered by the engine shortly.
+
+    :param list notes: notification dictionaries.
+    """
+    if not notes:
+        return
+    session = getsession()
+    if session is not None:
+        session.send_event('notify', list(notes))
+        return
+    from x84.bbs.dbproxy import DBProxy
+    key = '{0:.6f}-{1}'.format(time.time(), os.getpid())
+    with DBProxy(NOTIFY_DB, use_session=False) as notifydb:
+        notifydb[key] = list(notes)
+
+
 def gosub(script, *args, **kwargs):
     """ Call bbs script with optional arguments, Returns value. """
     script = Script(name=script, args=args, kwargs=kwargs)
@@ -135,6 +169,7 @@ class Session(object):
         ]
         self._connect_time = time.time()
         self._last_input_time = time.time()
+        self._last_report_time = time.time()
         self._node = None
 
         # create event buffer
@@ -218,6 +253,7 @@ class Session(object):
         #         Missing docstring
         self.log.info("user {!r} -> {!r}".format(self._user, value.handle))
         self._user = value
+        self.subscribe_notifications(value.get('msg_subscription', []))
 
     @property
     def encoding(self):
@@ -406,6 +442,22 @@ class Session(object):
         if self.log.isEnabledFor(logging.DEBUG) and self.tap_output:
             self.log.debug('--> {!r}'.format(ucs))
 
+    def write_bytes(self, data):
+        """
+        Write raw bytes ``data`` to client, without any encoding.
+
+        Used for binary transfers and doors of raw output, the bytes are
+        sent to the client as-is, but for any escaping required by the
+        transport protocol, such as IAC of telnet.
+        """
+        # do not write empty strings
+        if not data:
+            return
+        self.writer.send(('output-bytes', bytes(data)))
+
+        if self.log.isEnabledFor(logging.DEBUG) and self.tap_output:
+            self.log.debug('--> {!r}'.format(data))
+
     def flush_event(self, event):
         """
         Flush and return all data buffered for ``event``.
@@ -446,6 +498,12 @@ class Session(object):
 
         - ``gosub``: Allows one session to send another to a different script,
           this is used by the default board ``chat.py`` for a chat request.
+
+        - ``profile``: Where data is ``(action, duration)``, starts or stops
+          the sampling profiler of :mod:`x84.profiler` for this session.
+
+        Notifications, event ``notify``, are buffered as any other event,
+        see :meth:`read_notifications`.
         """
         # exceptions aren't buffered; they are thrown!
         if event == 'exception':
@@ -487,6 +545,12 @@ class Session(object):
                 self.buffer_event('refresh', data)
             return True
 
+        # start or stop sampling profiler of this session process
+        if event == 'profile':
+            action, duration = data
+            profiler.handle_profile(self.sid, action, duration)
+            return True
+
         # respond to 'info-req' events by returning pickled session info
         if event == 'info-req':
             self.send_event('route', (
@@ -502,6 +566,7 @@ class Session(object):
             # important in the case of screen resize.
             self._buffer[event] = collections.deque(
                 maxlen={'global': 128,
+                        'notify': 128,
                         'refresh': 1,
                         }.get(event, 65534))
 
@@ -559,10 +624,14 @@ class Session(object):
 
         - ``disconnect``: Session wishes to disconnect.
 
-        - ``logger``: Data is logging record, used by IPCLogHandler.
+        - ``logger``: Data is a list of logging records, used by
+          :class:`x84.bbs.ipc.IPCLogHandler`.
 
         - ``output``: Unicode data to write to client.
 
+        - ``output-bytes``: Raw bytes to write to client, see
+          :meth:`write_bytes`.
+
         - ``global``: Broadcast event to other sessions.
 
         - ``route``: Send an event to another session.
@@ -571,13 +640,75 @@ class Session(object):
 
         - ``db=<schema>``: Request sqlite dict method result as iterable.
 
+        - ``dbproc``: Run stored procedure, data is ``(name, handle,
+          args)``, see :func:`x84.bbs.dbproxy.call_procedure`.
+
         - ``lock-<name>``: Fine-grained global bbs locking.
 
+        - ``fetch``: Request URL through the shared response cache, data is
+          ``(reply event, kwargs)``, see :class:`x84.bbs.fetchproxy.FetchProxy`.
+
+        - ``profile``: Start or stop the sampling profiler of a process,
+          data is ``(target, action, duration)``, see :mod:`x84.profiler`.
+
+        - ``metrics``: Counters, histograms and current script name,
+          sent by :meth:`report_metrics`.
+
+        - ``notify``: Notifications to other sessions, data is a list of
+          dictionaries, see :func:`publish_notifications`.
+
+        - ``notify-subscribe``: Register ``(handle, tag patterns)`` of
+          notifications received by this session.
+
         :param str event: event name.
         :param data: event data.
         """
         self.writer.send((event, data))
 
+    def subscribe_notifications(self, patterns):
+        """
+        Receive notifications of new public messages of tag ``patterns``.
+
+        Called when the session's user is set, by its ``msg_subscription``,
+        and again whenever it changes.  Private messages addressed to the
+        user are always notified.
+
+        :param list patterns: tag patterns, as for :func:`fnmatch.fnmatch`.
+        """
+        self.send_event('notify-subscribe', (self.user.handle, list(patterns)))
+
+    def read_notifications(self):
+        """
+        Return all notifications received, without waiting.
+
+        Scripts may instead wait for event ``notify`` by
+        :meth:`read_events`, each event is a list of notifications.
+
+        :rtype: list
+        """
+        return [note for notes in reversed(self.flush_event('notify'))
+                for note in notes]
+
+    def report_metrics(self, force=False):
+        """
+        Send accumulated session metrics to the engine.
+
+        Counters and histograms are sent as a delta by the ``metrics``
+        event, along with the name of the current script, at most once
+        every :data:`x84.metrics.REPORT_INTERVAL` seconds unless ``force``
+        is set.
+
+        :param bool force: send regardless of time elapsed.
+        """
+        if not force and (time.time() - self._last_report_time
+                          < metrics.REPORT_INTERVAL):
+            return
+        self._last_report_time = time.time()
+        data = metrics.collect(clear=True)
+        script = self.current_script
+        data['script'] = script.name if script is not None else None
+        self.send_event('metrics', data)
+
     def poll_event(self, event):
         """
         Non-blocking poll for session event.
@@ -619,6 +750,9 @@ class Session(object):
         if event:
             return (event, data)
 
+        self.report_metrics()
+        flush_log()
+
         timeleft = lambda cmp_time: (
             None if timeout is None else
             timeout if timeout < 0 else
@@ -627,7 +761,10 @@ class Session(object):
         # begin scanning for matching `events' up to timeout.
         stime = time.time()
         waitfor = timeleft(stime)
-        while waitfor is None or waitfor > 0:
+        while waitfor is None or waitfor > 0 or timeout == -1:
+            # send log records held longer than LOG_FLUSH_INTERVAL,
+            flush_log()
+
             # ask engine process for new event data,
             poll = min(0.5, waitfor) or 0.01
             if self.reader.poll(poll):
@@ -636,6 +773,7 @@ class Session(object):
                 except pickle.UnpicklingError as err:
                     self.log.error(err)
                     disconnect(reason='{0}'.format(err))
+                metrics.incr('session_events', event)
                 # it is necessary to always buffer an event, as some
                 # side-effects may occur by doing so.  When buffer_event
                 # returns True, those side-effects caused no data to be
@@ -673,6 +811,8 @@ class Session(object):
         """
         self.log.info("runscript {0!r}".format(script.name))
         self._script_stack.append(script)
+        metrics.incr('session_scripts', script.name)
+        self.report_metrics(force=True)
 
         # if given a script name such as 'extras.target', adjust the lookup
         # path to be extended by {default_scriptdir}/extras, and adjust
@@ -707,6 +847,7 @@ class Session(object):
         # remove the current script from the script stack, since it has
         # finished executing.
         self._script_stack.pop()
+        self.report_metrics(force=True)
 
         return value
 
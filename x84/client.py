@@ -11,6 +11,7 @@ import warnings
 # local
 from x84.bbs.exception import Disconnected
 from x84.terminal import spawn_client_session
+from x84 import metrics
 
 
 class BaseClient(object):
@@ -101,6 +102,9 @@ class BaseClient(object):
                 raise Disconnected('send: {0}'.format(err))
 
         sent = _send(ready_bytes)
+        metrics.observe('client_send_bytes', len(ready_bytes),
+                        self.kind, buckets=metrics.SIZE_BUCKETS)
+        metrics.incr('client_bytes_sent', self.kind, sent)
         if sent < len(ready_bytes):
             # re-buffer data that could not be pushed to socket;
             self.send_buffer.fromstring(ready_bytes[sent:])
@@ -144,6 +148,7 @@ class BaseClient(object):
             raise Disconnected('socket_recv error: {0}'.format(err))
 
         self.bytes_received += recv
+        metrics.incr('client_bytes_received', self.kind, recv)
         self.last_input_time = time.time()
         self.recv_buffer.fromstring(data)
         return recv
@@ -166,6 +171,14 @@ class BaseClient(object):
         """ Buffer unicode string, encoded for client as 'encoding'. """
         self.send_str(ucs.encode(encoding, 'replace'))
 
+    def send_bytes(self, data):
+        """
+        Buffer raw bytes for client, such as binary file transfers.
+
+        Derived classes escape any bytes reserved by their protocol.
+        """
+        self.send_str(data)
+
     def is_active(self):
         """ Whether this connection is active (bool). """
         return self.active
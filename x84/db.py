@@ -3,15 +3,32 @@
 import multiprocessing
 import threading
 import logging
+import sqlite3
 import errno
+import time
 import os
 
 # 3rd-party
 import sqlitedict
 
+# local
+from x84 import metrics
+
 FILELOCK = multiprocessing.Lock()
 DATALOCK = {}
 
+#: default seconds elapsed for a database command to be logged as slow
+DB_SLOW_THRESHOLD = 0.5
+
+#: default seconds a caller waits for the result of a stored procedure
+PROCEDURE_TIMEOUT = 10
+
+#: prefix of .ini sections configuring stored procedures
+PROCEDURE_PREFIX = 'dbproc:'
+
+#: stored procedures, ``(func, timeout, groups)`` by name.
+PROCEDURES = {}
+
 
 def get_database(filepath, table):
     """ Return :class:`sqlitedict.SqliteDict` instance for given database. """
@@ -54,6 +71,44 @@ def get_db_filepath(schema):
     return os.path.join(folder, '{0}.sqlite3'.format(schema))
 
 
+def compact_db(schema, min_free=0.1, max_size=None, timeout=30):
+    """
+    Compact database ``schema`` by command ``VACUUM``.
+
+    Only compacted when at least ``min_free`` of its pages are free, such as
+    after many records are deleted, and when no larger than ``max_size``
+    bytes.
+
+    While compacted, other processes may read the database, but a command
+    writing to it waits for the busy timeout of its connection: 5 seconds
+    for those of :func:`get_database`, after which it fails by
+    :class:`sqlite3.OperationalError`, ``database is locked``.  Compacting
+    takes time in proportion to the size of the database, so that
+    ``max_size`` bounds how long writers wait.  This process waits up to
+    ``timeout`` seconds for a lock of the database.
+
+    :returns: number of bytes reclaimed.
+    :rtype: int
+    :raises sqlite3.OperationalError: database could not be locked.
+    """
+    filepath = get_db_filepath(schema)
+    if not os.path.exists(filepath):
+        return 0
+    size = os.path.getsize(filepath)
+    if max_size is not None and size > max_size:
+        return 0
+    conn = sqlite3.connect(filepath, timeout=timeout)
+    try:
+        pages = conn.execute('PRAGMA page_count').fetchone()[0]
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if not pages or free < pages * min_free:
+            return 0
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+    return size - os.path.getsize(filepath)
+
+
 def get_db_lock(schema, table):
     """ Return database lock for given ``(schema, table)``. """
     key = (schema, table)
@@ -111,6 +166,59 @@ def log_db_cmd(log, schema, cmd, args):
                                             args=s_args))
 
 
+def get_slow_threshold():
+    """
+    Return seconds elapsed for a database command to be logged as slow.
+
+    By ``[session]`` option ``db_slow_threshold``, a value of ``0``
+    disables the slow-operation log.
+
+    :rtype: float
+    """
+    from x84.bbs.ini import get_ini
+    value = get_ini('session', 'db_slow_threshold', getter='getfloat')
+    if value == u'':
+        return DB_SLOW_THRESHOLD
+    return value
+
+
+def record_db_cmd(schema, cmd, args, timings, caller=None):
+    """
+    Record timings of a database command, logging it if slow.
+
+    Each phase is recorded to :mod:`x84.metrics` histograms ``db_<phase>``,
+    labeled by ``schema/cmd``, so that aggregate statistics are kept by
+    schema and method.  When the total of all phases exceeds
+    :func:`get_slow_threshold`, the command is logged by logger
+    ``x84.db.slow``.
+
+    :param str schema: database schema.
+    :param str cmd: dictionary method name.
+    :param tuple args: dictionary method arguments.
+    :param dict timings: seconds elapsed by phase, any of ``queue`` (wait
+                         for a handler thread), ``lock`` (wait for and
+                         open database), ``exec`` (execution), and
+                         ``transfer`` (IPC transfer of result).
+    :param str caller: name of calling script or thread, when known.
+    """
+    label = '{0}/{1}'.format(schema, cmd)
+    total = sum(timings.values())
+    metrics.incr('db_commands', label)
+    metrics.observe('db_latency', total, schema)
+    for phase, elapsed in timings.items():
+        metrics.observe('db_{0}'.format(phase), elapsed, label)
+
+    threshold = get_slow_threshold()
+    if threshold and total > threshold:
+        log = logging.getLogger('x84.db.slow')
+        log.warn('{label}(*{nargs}) {total:0.3f}s {phases} caller={caller}'
+                 .format(label=label, nargs=len(args), total=total,
+                         phases=' '.join(
+                             '{0}={1:0.3f}'.format(phase, elapsed)
+                             for phase, elapsed in sorted(timings.items())),
+                         caller=caller or 'unknown'))
+
+
 class DBHandler(threading.Thread):
 
     """
@@ -123,7 +231,7 @@ class DBHandler(threading.Thread):
     The return values are sent to the session queue with equal 'event' name.
     """
 
-    def __init__(self, queue, event, data):
+    def __init__(self, queue, event, data, script=None):
         """
         Class initializer.
 
@@ -137,39 +245,60 @@ class DBHandler(threading.Thread):
         :param tuple data: a dict method proxy command sequence in form of
                            ``(table, command, arguments)``.  For example,
                            ``('unnamed', 'pop', 0).
+        :param str script: name of script run by the requesting session,
+                           recorded in the slow-operation log.
         """
         self.log = logging.getLogger(__name__)
         self.queue, self.event = queue, event
         self.table, self.cmd, self.args = data
+        self.script = script
+        self.queued = time.time()
 
         self.iterable, self.schema = parse_dbevent(event)
         self.filepath = get_db_filepath(self.schema)
 
         from x84.bbs.ini import get_ini
         self._tap_db = self.log.isEnabledFor(logging.DEBUG) and (
-            get_ini('session', 'tab_db', getter='getboolean'))
+            get_ini('session', 'tap_db', getter='getboolean'))
 
         threading.Thread.__init__(self)
 
     def run(self):
         """ Execute database command and return results to session queue. """
+        metrics.incr('db_requests', self.schema)
+        timings = {'queue': time.time() - self.queued,
+                   'exec': 0, 'transfer': 0}
+        stime = time.time()
         dictdb = get_database(self.filepath, self.table)
+        timings['lock'] = time.time() - stime
         func = get_db_func(dictdb, self.cmd)
         if self._tap_db:
             log_db_cmd(self.log, self.schema, self.cmd, self.args)
 
+        def send(data):
+            """ Send ``data`` to session queue, timing its transfer. """
+            stime = time.time()
+            self.queue.send(data)
+            timings['transfer'] += time.time() - stime
+
         try:
             # single value result,
             if not self.iterable:
+                stime = time.time()
                 result = func(*self.args)
-                self.queue.send((self.event, result))
+                timings['exec'] += time.time() - stime
+                send((self.event, result))
 
             # iterable value result,
             else:
-                self.queue.send((self.event, (None, 'StartIteration'),))
+                send((self.event, (None, 'StartIteration'),))
+                stime = time.time()
                 for item in func(*self.args):
-                    self.queue.send((self.event, item,))
-                self.queue.send((self.event, (None, StopIteration,),))
+                    timings['exec'] += time.time() - stime
+                    send((self.event, item,))
+                    stime = time.time()
+                timings['exec'] += time.time() - stime
+                send((self.event, (None, StopIteration,),))
 
         # pylint: disable=W0703
         #         Catching too general exception
@@ -187,3 +316,168 @@ class DBHandler(threading.Thread):
 
         finally:
             dictdb.close()
+            record_db_cmd(self.schema, self.cmd, self.args, timings,
+                          caller=self.script)
+
+
+class ProcedureError(Exception):
+
+    """ A stored procedure is unknown, not permitted, failed or timed out. """
+
+
+def register_procedure(name, func, timeout=None, groups=()):
+    """
+    Register stored procedure ``name``.
+
+    Stored procedures are functions run by the engine beside its databases,
+    so that only their result, rather than the database records they read,
+    is transferred to the calling session.
+
+    :param str name: name of procedure.
+    :param callable func: function of procedure, called with the arguments
+                          of the caller.
+    :param int timeout: seconds the caller waits for its result.
+    :param groups: user groups permitted to call procedure; any user when
+                   empty.
+    """
+    PROCEDURES[name] = (func, timeout or PROCEDURE_TIMEOUT, frozenset(groups))
+
+
+def load_procedures():
+    """
+    Register built-in stored procedures, and those of the .ini file.
+
+    Procedures are installed by a section of the .ini file for each::
+
+        [dbproc:top_posters]
+        target = extras.stats.top_posters
+        timeout = 5
+        groups = sysop
+
+    Where ``target`` is a function of a script, as for jobs of
+    :mod:`x84.scheduler`, and optional ``groups`` restricts the procedure
+    to members of any of the user groups given.  A procedure of the same
+    name as a built-in procedure replaces it.
+    """
+    from x84.bbs.ini import CFG
+    from x84.bbs.msgbase import unread_counts, sort_by_thread
+    from x84.scheduler import load_target
+    log = logging.getLogger(__name__)
+
+    register_procedure('unread_counts', unread_counts)
+    register_procedure('sort_by_thread', sort_by_thread)
+
+    for section in CFG.sections():
+        if not section.startswith(PROCEDURE_PREFIX):
+            continue
+        if (CFG.has_option(section, 'enabled') and
+                not CFG.getboolean(section, 'enabled')):
+            continue
+        name = section[len(PROCEDURE_PREFIX):]
+        options = dict(CFG.items(section))
+        try:
+            register_procedure(
+                name, load_target(options['target']),
+                timeout=int(options.get('timeout') or 0),
+                groups=[group.strip() for group in
+                        options.get('groups', '').split(',')
+                        if group.strip()])
+        # pylint: disable=W0703
+        #         Catching too general exception
+        except Exception as err:
+            log.error('[{0}] invalid procedure: {1}'.format(section, err))
+
+
+def run_procedure(name, handle, args):
+    """
+    Return result of stored procedure ``name`` called with ``args``.
+
+    The procedure is run by its own thread, so that a caller waits no
+    longer than its timeout.  A procedure that times out is not
+    interrupted, its result is discarded.
+
+    :param str handle: handle of calling user, None for engine services,
+                       which are permitted any procedure.
+    :raises ProcedureError: procedure is unknown, not permitted to
+                            ``handle``, failed or timed out.
+    """
+    log = logging.getLogger(__name__)
+    if name not in PROCEDURES:
+        raise ProcedureError('{0}: no such procedure'.format(name))
+    func, timeout, groups = PROCEDURES[name]
+    if groups and handle is not None:
+        from x84.bbs.userbase import get_user
+        try:
+            user_groups = get_user(handle).groups
+        except KeyError:
+            user_groups = set()
+        if not groups & user_groups:
+            metrics.incr('dbproc_denied', name)
+            raise ProcedureError('{0}: not permitted for {1}'
+                                 .format(name, handle))
+
+    result = []
+
+    def target():
+        """ Run procedure, storing its result. """
+        try:
+            result.append((True, func(*args)))
+        # pylint: disable=W0703
+        #         Catching too general exception
+        except Exception as err:
+            log.exception('procedure {0} failed: {1}'.format(name, err))
+            result.append((False, err))
+
+    stime = time.time()
+    thread = threading.Thread(target=target,
+                              name='dbproc:{0}'.format(name))
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    metrics.incr('dbproc_calls', name)
+    metrics.observe('dbproc_latency', time.time() - stime, name)
+    if not result:
+        metrics.incr('dbproc_timeouts', name)
+        log.warn('procedure {0} timed out after {1}s.'.format(name, timeout))
+        raise ProcedureError('{0}: timed out after {1}s'
+                             .format(name, timeout))
+    success, value = result[0]
+    if not success:
+        raise ProcedureError('{0}: {1}'.format(name, value))
+    return value
+
+
+class ProcHandler(threading.Thread):
+
+    """
+    This handler runs a stored procedure on behalf of a session.
+
+    The result, or a :class:`ProcedureError`, is returned to the session's
+    IPC queue as data of event ``dbproc``.
+    """
+
+    def __init__(self, queue, data):
+        """
+        Class initializer.
+
+        :param multiprocessing.Pipe queue: parent input end of a tty session
+                                           ipc queue (``tty.master_write``).
+        :param tuple data: procedure call, ``(name, handle, args)``.
+        """
+        self.queue = queue
+        self.procedure, self.handle, self.args = data
+        threading.Thread.__init__(self, name='dbproc')
+
+    def run(self):
+        """ Run stored procedure and return result to session queue. """
+        try:
+            result = run_procedure(self.procedure, self.handle, self.args)
+        except ProcedureError as err:
+            result = err
+        try:
+            self.queue.send(('dbproc', result))
+        except IOError as err:
+            if err.errno != errno.EBADF:
+                raise
+            # our pipe/queue has been disconnected (the session
+            # has disconnected) while the procedure was run.
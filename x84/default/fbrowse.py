@@ -1,13 +1,13 @@
 """ File browser/manager for x/84. """
 # std imports
 from __future__ import division
-import zipfile
 import os
 
 # local
 from x84.bbs import getsession, getterminal, echo, syncterm_setfont
 from x84.bbs import get_ini, DBProxy, Lightbar, LineEditor
 from x84.bbs import send_modem, recv_modem
+from x84.bbs.fileindex import get_directory, describe, search
 from x84.default.common import filesize
 
 #: file description database
@@ -49,11 +49,32 @@ FLAGGED_DIRNAME = get_ini(
     section='fbrowse', key='flagged_dirname'
 ) or u'__flagged__{0}'.format(os.path.sep)
 
+#: name of virtual directory for listing search results
+SEARCH_DIRNAME = u'__search__{0}'.format(os.path.sep)
+
+#: maximum number of search results listed
+SEARCH_LIMIT = get_ini(
+    section='fbrowse', key='search_limit', getter='getint'
+) or 200
+
 #: decoding to use for ASCII collies
 COLLY_DECODING = get_ini(
     section='fbrowse', key='colly_decoding'
 ) or 'amiga'
 
+#: default file transfer protocol, one of ``x84.bbs.modem.PROTOCOLS``
+PROTOCOL = get_ini(
+    section='fbrowse', key='protocol'
+) or 'zmodem'
+
+#: file transfer protocols by key of selection prompt
+PROTOCOL_KEYS = (
+    (u'z', 'zmodem'),
+    (u'y', 'ymodem-g'),
+    (u'k', 'xmodem1k'),
+    (u'x', 'xmodem'),
+)
+
 
 class FileBrowser(object):
 
@@ -65,84 +86,14 @@ class FileBrowser(object):
     max_diz_width = 0
     max_diz_height = 0
     flagged_files = set()
-    diz_extractors = dict()
+    search_results = list()
+    # index entries of current directory, see x84.bbs.fileindex
+    index = dict()
 
 # instance to be used throughout the script
 browser = FileBrowser()  # pylint:disable=C0103
 
 
-def diz_from_dms(binary, filename):
-    """
-    Amiga diskmasher format. Depends on the external binary 'xdms'.
-    """
-    import subprocess
-    args = ('d', filename)
-    proc = subprocess.Popen((binary,) + args, stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE)
-    output, _ = proc.communicate()
-    if proc.returncode == 0:
-        return output.decode('cp437_art')
-    else:
-        return u'No description'
-
-
-def diz_from_lha(binary, filename):
-    """
-    Amiga LHA format. Depends on the external binary 'lha'.
-    """
-    import subprocess
-    import tempfile
-    import shutil
-    description = u'No description'
-    path = tempfile.mkdtemp(prefix='x84_')
-    args = ('xw={0}'.format(path), filename)
-    proc = subprocess.Popen((binary,) + args, stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE)
-    proc.wait()
-    dizfilename = os.path.join(path, 'file_id.diz')
-    if proc.returncode == 0 and os.path.isfile(dizfilename):
-        with open(dizfilename, 'rb') as dizfile:
-            description = dizfile.read().decode('cp437_art')
-    try:
-        shutil.rmtree(path)
-    except OSError:
-        pass
-    return description
-
-
-def diz_from_zip(filename, method=zipfile.ZIP_STORED):
-    """
-    Pull FILE_ID.DIZ from `filename` using particular zipfile `method`.
-    """
-    try:
-        myzip = zipfile.ZipFile(filename, compression=method, allowZip64=True)
-        for cname in (cname for cname in myzip.namelist()
-                      if cname.lower() == 'file_id.diz'):
-            return myzip.read(cname).decode('cp437_art')
-        return u'No description'
-    except zipfile.BadZipfile:
-        return u'Bad zip file, cannot parse'
-    except zipfile.LargeZipFile:
-        # since we do allowZip64=True above, this shouldn't happen any longer
-        return u'Large zip file, cannot parse'
-    except NotImplementedError:
-        return u'Unsupported compression, cannot parse'
-
-
-def get_diz_from_colly(filepath):
-    """ Get FILE_ID.DIZ from within an ASCII collection. """
-    colly = open(filepath, 'r').read()
-    colly_diz_begin = '@BEGIN_FILE_ID.DIZ'
-    colly_diz_end = '@END_FILE_ID.DIZ'
-    pos = colly.find(colly_diz_begin)
-    if pos > 0:
-        colly = colly[pos + len(colly_diz_begin):]
-        pos = colly.find(colly_diz_end)
-        if pos > 0:
-            return colly[:pos].splitlines()
-    return None
-
-
 def get_instructions(term, is_sysop=None):
     """ Show file browser instructions. """
     return [
@@ -160,6 +111,8 @@ def get_instructions(term, is_sysop=None):
         .format(term.reverse(u'(-)')),
         u'{0}     Upload file(s)'
         .format(term.reverse(u'(u)')),
+        u'{0}     Search files'
+        .format(term.reverse(u'(s)')),
         u'{0}     Edit description'
         .format(term.reverse(u'(e)')) if is_sysop else u'',
         u'{0}     Quit'
@@ -184,33 +137,136 @@ def edit_description(filepath, db_desc):
         db_desc[filepath] = new_desc.splitlines()
 
 
-def download_files(term, session, protocol='xmodem1k'):
+def select_protocol(term):
+    """ Prompt for file transfer protocol, returning None when cancelled. """
+    echo(u''.join((
+        u'\r\n', u', '.join(
+            u'{0} {1}'.format(term.reverse(u'({0})'.format(key)), name)
+            for key, name in PROTOCOL_KEYS),
+        u'\r\nProtocol [{0}]? '.format(PROTOCOL))))
+    while True:
+        inp = term.inkey()
+        if inp.code in (term.KEY_ENTER,):
+            protocol = PROTOCOL
+            break
+        elif inp.code in (term.KEY_ESCAPE,) or inp.lower() == u'q':
+            echo(u'\r\n')
+            return None
+        protocol = dict(PROTOCOL_KEYS).get(inp.lower())
+        if protocol is not None:
+            break
+    echo(u'{0}\r\n'.format(protocol))
+    return protocol
+
+
+def download_files(term, session):
     """ Download flagged files. """
     if not len(browser.flagged_files):
         return False
     echo(term.clear)
-    flagged = browser.flagged_files.copy()
-    for fname in flagged:
-        _fname = fname[fname.rfind(os.path.sep) + 1:].decode('utf8')
+    protocol = select_protocol(term)
+    if protocol is None:
+        return False
+    flagged = sorted(browser.flagged_files)
+    if protocol in ('zmodem', 'ymodem-g'):
+        # batch protocols send all flagged files in one transfer
+        batches = [flagged]
+    else:
+        batches = [[fname] for fname in flagged]
+    for fnames in batches:
+        _fnames = u', '.join(fname[fname.rfind(os.path.sep) + 1:]
+                             .decode('utf8') for fname in fnames)
         echo(term.bold_green(
             u'Start your {protocol} receiving program '
-            u'to begin transferring {_fname}...\r\n'
-            .format(protocol=protocol, _fname=_fname)))
+            u'to begin transferring {_fnames}...\r\n'
+            .format(protocol=protocol, _fnames=_fnames)))
         echo(u'Press ^X twice to cancel\r\n')
 
-        fin = open(fname, 'rb')
-        if not send_modem(fin, protocol):
+        streams = [open(fname, 'rb') for fname in fnames]
+        try:
+            if protocol in ('zmodem', 'ymodem-g'):
+                success = send_modem(streams, protocol)
+            else:
+                success = send_modem(streams[0], protocol)
+        finally:
+            for stream in streams:
+                stream.close()
+        if not success:
             echo(term.bold_red(u'Transfer failed!\r\n'))
         else:
-            browser.flagged_files.remove(fname)
+            browser.flagged_files -= set(fnames)
             session.user['flaggedfiles'] = browser.flagged_files
             echo(term.bold(u'Transfer(s) finished.\r\n'))
     term.inkey()
 
 
-def upload_files(term, protocol='xmodem1k'):
+def is_legal_filename(filename):
+    """
+    Whether ``filename`` may be stored in the uploads folder.
+
+    ``filename`` is unicode, or bytes as named by the sender of a batch
+    upload, which are decoded as utf8.
+    """
+    if isinstance(filename, bytes):
+        filename = filename.decode('utf8', 'replace')
+    return bool(filename) and not any(
+        illegal in filename for illegal in (os.path.sep, u'..', u'~',))
+
+
+def upload_batch(term, protocol):
+    """
+    Receive files by batch ``protocol``, named by the sender.
+
+    A zmodem upload resumes a file previously uploaded in part, and
+    skips any file already complete.
+    """
+    received = []
+
+    def open_file(name, size, _):
+        """ Open upload file ``name`` offered by sender. """
+        filename = name.replace('\\', '/').split('/')[-1]
+        if not is_legal_filename(filename):
+            echo(term.bold_red(u'Illegal filename: {0}\r\n'
+                               .format(filename.decode('utf8', 'replace'))))
+            return None
+        upload_filename = os.path.join(UPLOADS_DIR, filename)
+        mode = 'wb'
+        if os.path.exists(upload_filename):
+            if (protocol != 'zmodem' or size is None or
+                    os.path.getsize(upload_filename) >= size):
+                echo(term.bold_red(u'File exists: {0}\r\n'
+                                   .format(filename.decode('utf8',
+                                                           'replace'))))
+                return None
+            mode = 'ab'
+        try:
+            upload = open(upload_filename, mode)
+        except IOError as err:
+            echo(term.bold_red(u'IOError: {err}\r\n'.format(err=err)))
+            return None
+        received.append(upload_filename)
+        return upload
+
+    echo(term.bold(u'\r\nBegin your {0} sending program now.\r\n'
+                   .format(protocol)))
+    if not recv_modem(open_file, protocol):
+        echo(term.bold_red(u'Upload failed!\r\n'))
+        if protocol != 'zmodem' and received:
+            # only zmodem may resume the last file received
+            os.unlink(received[-1])
+    else:
+        echo(term.bold_green(u'Transfer succeeded.\r\n'))
+    term.inkey()
+
+
+def upload_files(term):
     """ Upload files. """
     echo(term.clear)
+    protocol = select_protocol(term)
+    if protocol is None:
+        return
+    if protocol in ('zmodem', 'ymodem-g'):
+        return upload_batch(term, protocol)
     while True:
         echo(u'Filename (empty to quit):\r\n')
         led = LineEditor(width=term.width - 1)
@@ -218,11 +274,10 @@ def upload_files(term, protocol='xmodem1k'):
         inp = led.read()
         led = None
         if inp:
-            for illegal in (os.path.sep, u'..', u'~',):
-                if illegal in inp:
-                    echo(term.bold_red(u'\r\nIllegal filename.\r\n'))
-                    term.inkey()
-                    return
+            if not is_legal_filename(inp):
+                echo(term.bold_red(u'\r\nIllegal filename.\r\n'))
+                term.inkey()
+                return
 
             echo(term.bold(
                 u'\r\nBegin your {0} sending program now.\r\n'
@@ -280,7 +335,8 @@ def describe_file(term, diz, directory, filename, isdir=None):
         # describe file
         _size = filesize(os.path.join(directory, filename))
         _filename = (filename[len(ROOT):].decode('utf8')
-                     if directory == os.path.join(ROOT, FLAGGED_DIRNAME)
+                     if directory in (os.path.join(ROOT, FLAGGED_DIRNAME),
+                                      os.path.join(ROOT, SEARCH_DIRNAME))
                      else filename.decode('utf8'))
         description = (u'{txt_Filename}: {filename}  {txt_Size}: {size}'
                        .format(txt_Filename=term.bold(u'Filename'),
@@ -337,6 +393,34 @@ def flagged_listdir():
     return sorted_files
 
 
+def search_listdir():
+    """ Build listing for search results pseudo-folder. """
+    files = [(os.path.join(ROOT, path),
+              u' {0}'.format(path.decode('utf8', 'replace')))
+             for path, _ in browser.search_results]
+    files.insert(0, (u'..{0}'.format(os.path.sep),
+                     u' ..{0}'.format(os.path.sep)))
+    return files
+
+
+def search_files(term):
+    """ Prompt for search query, returning whether any files were found. """
+    echo(term.clear)
+    echo(u'Search for files by name or description (empty to quit):\r\n')
+    led = LineEditor(width=term.width - 1)
+    led.refresh()
+    query = led.read()
+    led = None
+    if not query or not query.strip():
+        return False
+    browser.search_results = search(query, limit=SEARCH_LIMIT)
+    if not browser.search_results:
+        echo(term.bold_red(u'\r\nNo files found.\r\n'))
+        term.inkey()
+        return False
+    return True
+
+
 def regular_listdir(session, directory, sub):
     """ Build listing for regular folder. """
     files = sorted(os.listdir(directory), key=lambda x: x.lower())
@@ -368,9 +452,15 @@ def reload_dir(session, directory, lightbar, sub):
     if directory == os.path.join(ROOT, FLAGGED_DIRNAME):
         # pseudo-folder for flagged files list
         lightbar.update(flagged_listdir())
+        browser.index = dict()
+    elif directory == os.path.join(ROOT, SEARCH_DIRNAME):
+        # pseudo-folder for search results
+        lightbar.update(search_listdir())
+        browser.index = dict()
     else:
         # actual folder
         lightbar.update(regular_listdir(session, directory, sub))
+        browser.index = get_directory(directory)
 
 
 def is_flagged_dir(directory):
@@ -460,13 +550,21 @@ def browse_dir(session, db_desc, term, lightbar, directory, sub=False):
             reload_dir(session, directory, lightbar, sub)
             draw_interface(term, lightbar)
 
+        elif inp in (u's',):
+            if search_files(term):
+                draw_interface(term, lightbar)
+                if not browse_dir(session, db_desc, term, lightbar,
+                                  os.path.join(ROOT, SEARCH_DIRNAME), True):
+                    return False
+            reload_dir(session, directory, lightbar, sub)
+            draw_interface(term, lightbar)
+
         elif inp in (u'e',) and session.user.is_sysop and not isdir:
             edit_description(relativename, db_desc)
             reload_dir(session, directory, lightbar, sub)
             draw_interface(term, lightbar)
 
         clear_diz(term)
-        save_diz = True
 
         if lightbar.selected or inp.code in (term.KEY_LEFT, term.KEY_RIGHT,):
 
@@ -494,7 +592,6 @@ def browse_dir(session, db_desc, term, lightbar, directory, sub=False):
                 echo(lightbar.refresh())
 
         if relativename in db_desc:
-            save_diz = False
             diz = db_desc[relativename]
             if ext in COLLY_EXTENSIONS:
                 decoder = 'cp437_art'
@@ -506,45 +603,30 @@ def browse_dir(session, db_desc, term, lightbar, directory, sub=False):
                 except UnicodeEncodeError:
                     diz = [u'Invalid characters in FILE_ID.DIZ']
 
-        elif ext in browser.diz_extractors:
-            # is (supported) archive
-            diz = browser.diz_extractors[ext](filepath).splitlines()
-
-        elif ext in COLLY_EXTENSIONS:
-            # is ASCII colly, pull diz from between markers if available.
-            diz = get_diz_from_colly(filepath=filepath) or diz
-            # save diz in raw format, but display decoded
-            save_diz = False
-            db_desc[relativename] = diz
-            decoder = 'cp437_art'
-            if session.encoding == 'utf8':
-                decoder = COLLY_DECODING
-            try:
-                diz = [line.decode(decoder, errors='replace') for line in diz]
-            except UnicodeEncodeError:
-                diz = [u'Invalid characters in FILE_ID.DIZ']
-                db_desc[relativename] = diz
+        elif not isdir and not is_flagged_dir(filename):
+            # is file; its description is retrieved from the file index,
+            # indexing it now if not yet indexed or changed.
+            entry = describe(directory, filename, browser.index)
+            diz = (entry or {}).get('diz') or [u'No description']
+            if entry and entry['diz'] and ext in COLLY_EXTENSIONS:
+                # ASCII colly descriptions are indexed in raw format
+                decoder = 'cp437_art'
+                if session.encoding == 'utf8':
+                    decoder = COLLY_DECODING
+                try:
+                    diz = [line.decode(decoder, errors='replace')
+                           for line in diz]
+                except UnicodeEncodeError:
+                    diz = [u'Invalid characters in FILE_ID.DIZ']
 
         elif is_flagged_dir(filename):
             # is pseudo-folder for flagged files
-            save_diz = False
             diz = get_instructions(term, session.user.is_sysop)
 
         elif isdir:
             # is directory; don't give it a description
-            save_diz = False
             diz = []
 
-        else:
-            # is normal file
-            save_diz = False
-            diz = [u'No description']
-
-        if not UPLOADS_DIR.find(directory) and save_diz:
-            # write description to diz db when save_diz is True
-            with db_desc:
-                db_desc[relativename] = diz
-
         browser.last_diz_len = len(diz)
         describe_file(term=term, diz=diz, directory=directory,
                       filename=filename, isdir=isdir)
@@ -554,8 +636,6 @@ def browse_dir(session, db_desc, term, lightbar, directory, sub=False):
 
 def main():
     """ File browser launch point. """
-    import subprocess
-    import functools
     session, term = getsession(), getterminal()
     session.activity = u'Browsing files'
     db_desc = DBProxy(DIZ_DB)
@@ -564,21 +644,6 @@ def main():
     if SYNCTERM_FONT and term.kind.startswith('ansi'):
         echo(syncterm_setfont(SYNCTERM_FONT))
 
-    # assign extractors to file types
-    browser.diz_extractors['.zip'] = diz_from_zip
-
-    # detect LHA and DMS support
-    output, _ = subprocess.Popen(('which', 'lha'), stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE).communicate()
-    if output:
-        browser.diz_extractors['.lha'] = functools.partial(diz_from_lha,
-                                                          output.rstrip())
-    output, _ = subprocess.Popen(('which', 'xdms'), stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE).communicate()
-    if output:
-        browser.diz_extractors['.dms'] = functools.partial(diz_from_dms,
-                                                          output.rstrip())
-
     # load flagged files
     browser.flagged_files = session.user.get('flaggedfiles', set())
 
@@ -12,12 +12,13 @@ import math
 import sys
 
 # local
-from x84.bbs import getsession, getterminal, echo, LineEditor, get_ini
+from x84.bbs import (getsession, getterminal, echo, LineEditor, get_ini,
+                     FetchProxy)
+from x84.fetch import FetchError
 
 # 3rd-party
 import feedparser
 import html2text
-import requests
 
 #: fontset for SyncTerm emulator
 SYNCTERM_FONT = get_ini(
@@ -40,6 +41,10 @@ RSS_TITLE = 'Hacker News'
 ARTICLE_LIMIT = 100
 REQUEST_TIMEOUT = 10
 
+#: seconds articles and the rss feed are shared by all sessions
+ARTICLE_TTL = 3600
+RSS_TTL = 300
+
 #: structure defines an article
 Article = collections.namedtuple(
     'Article', ['title', 'link', 'comments', 'netloc'])
@@ -238,7 +243,8 @@ def view_article(session, term, url, title):
     # perform get request,
     headers = {'User-Agent': USER_AGENT}
     try:
-        req = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        req = FetchProxy(ttl=ARTICLE_TTL, timeout=REQUEST_TIMEOUT).get(
+            url, headers=headers)
     except Exception as err:
         # a wide variety of exceptions may occur; ssl errors, connect timeouts,
         # read errors, BadStatusLine, it goes on and on.
@@ -259,8 +265,7 @@ def view_article(session, term, url, title):
         return
 
     # translate to our session-native encoding,
-    req.encoding = session.encoding
-    html_text = req.text
+    html_text = req.content.decode(session.encoding, 'replace')
 
     keyset = get_keyset(term)
     _endline = term.clear_eol + u'\r\n'
@@ -357,14 +362,20 @@ def view_article_summaries(session, term, rss_url, rss_title):
     # fetch rss feed articles
     echo(term.move(term.height // 2, 0))
     echo(term.center('Fetching {0} ...'.format(term.bold(rss_url))).rstrip())
-    result = feedparser.parse(rss_url)
-    if result.get('status') != 200:
+    try:
+        resp = FetchProxy(ttl=RSS_TTL, timeout=REQUEST_TIMEOUT).get(
+            rss_url, headers={'User-Agent': USER_AGENT})
+        status = resp.status_code
+    except FetchError as err:
+        status = err
+    if status != 200:
         # display 404, 500, or whatever non-200 code returned.
         moveto_lastline = term.move(term.height, 0)
         echo(moveto_lastline)
-        echo(term.center('failed: status={0}'.format(result.get('status'))))
+        echo(term.center('failed: status={0}'.format(status)))
         term.inkey()
         return
+    result = feedparser.parse(resp.content)
 
     articles = [Article(title=post.title,
                         link=post.link,
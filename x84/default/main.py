@@ -199,6 +199,17 @@ def get_line_editor(term, menu):
                       colors={'highlight': getattr(term, color_backlight)})
 
 
+def describe_notification(note, colors):
+    """ Return text describing notification ``note`` of a new message. """
+    highlight = colors.get('highlight', lambda txt: txt)
+    if note['kind'] == 'mail':
+        return u'New mail from {0}: {1}'.format(
+            highlight(note['author']), note['subject'])
+    return u'New post by {0} in {1}: {2}'.format(
+        highlight(note['author']),
+        u', '.join(sorted(note['tags'])), note['subject'])
+
+
 def main():
     """ Main menu entry point. """
     session, term = getsession(), getterminal()
@@ -230,12 +241,19 @@ def main():
                            editor.refresh())))
             dirty = 0
 
-        event, data = session.read_events(('input', 'refresh'))
+        event, data = session.read_events(('input', 'refresh', 'notify'))
 
         if event == 'refresh':
             dirty = True
             continue
 
+        elif event == 'notify':
+            # new mail or posts of our subscription, display above prompt.
+            echo(u''.join([u'\r\n' + describe_notification(note, colors)
+                           for note in data] +
+                          [u'\r\n', display_prompt(term, colors),
+                           editor.refresh()]))
+
         elif event == 'input':
             session.buffer_input(data, pushback=True)
 
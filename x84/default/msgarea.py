@@ -19,7 +19,7 @@ import difflib
 from x84.bbs import (
     syncterm_setfont,
     ScrollingEditor,
-    list_privmsgs,
+    call_procedure,
     decode_pipe,
     getterminal,
     getsession,
@@ -35,6 +35,7 @@ from x84.bbs import (
     echo,
     Msg,
 )
+from x84.bbs.msgbase import get_subscription_view
 from common import (
     render_menu_entries,
     show_description,
@@ -100,22 +101,22 @@ subject_max_length = get_ini(
 ) or 40
 
 
-def get_menu(messages):
-    """ Return list of menu items by given dict ``messages``. """
+def get_menu(counts):
+    """ Return list of menu items by given dict of message ``counts``. """
     MenuItem = collections.namedtuple('MenuItem', ['inp_key', 'text'])
     items = []
-    if messages['new']:
+    if counts['new']:
         items.extend([
-            MenuItem(u'n', u'new ({0})'.format(len(messages['new']))),
+            MenuItem(u'n', u'new ({0})'.format(counts['new'])),
             MenuItem(u'm', u'mark all read'),
         ])
-    if messages['all']:
+    if counts['all']:
         items.append(
-            MenuItem(u'a', u'all ({0})'.format(len(messages['all'])))
+            MenuItem(u'a', u'all ({0})'.format(counts['all']))
         )
-    if messages['private']:
+    if counts['private']:
         items.append(
-            MenuItem(u'v', u'private ({0})'.format(len(messages['private'])))
+            MenuItem(u'v', u'private ({0})'.format(counts['private']))
         )
     items.extend([
         MenuItem(u'p', u'post public'),
@@ -135,26 +136,25 @@ def do_mark_as_read(session, message_indicies):
 
 
 def get_messages_by_subscription(session, subscription):
-    all_tags = list_tags()
+    """
+    Return messages of ``subscription``, by its materialized view.
+
+    See :func:`x84.bbs.msgbase.get_subscription_view`.
+    """
+    view = get_subscription_view(session.user.handle, subscription)
     messages = {'all': set(), 'new': set()}
     messages_bytag = {}
     messages_read = session.user.get('readmsgs', set())
 
-    # now occlude all private messages :)
-    all_private = list_privmsgs(None)
-
-    # this looks like perl code
+    # private messages are already occluded by the view :)
     for tag_pattern in subscription:
-        messages_bytag[tag_pattern] = collections.defaultdict(set)
-        for tag_match in fnmatch.filter(all_tags, tag_pattern):
-            msg_indicies = list_msgs(tags=(tag_match,))
-            messages['all'].update(msg_indicies - all_private)
-            messages_bytag[tag_pattern]['all'].update(msg_indicies - all_private)
-        messages_bytag[tag_pattern]['new'] = (
-            messages_bytag[tag_pattern]['all'] - messages_read)
+        matched = view['bytag'][tag_pattern]
+        messages['all'].update(matched)
+        messages_bytag[tag_pattern] = {'all': matched,
+                                       'new': matched - messages_read}
 
     # and make a list of only our own
-    messages['private'] = list_privmsgs(session.user.handle)
+    messages['private'] = view['private']
 
     # and calculate 'new' messages
     messages['new'] = (messages['all'] | messages['private']) - messages_read
@@ -162,16 +162,26 @@ def get_messages_by_subscription(session, subscription):
     return messages, messages_bytag
 
 
-def describe_message_area(term, subscription, messages_bytags, colors):
-    get_num = lambda lookup, tag_pattern, grp: len(lookup[tag_pattern][grp])
+def get_counts_by_subscription(session, subscription):
+    """
+    Return number of messages of ``subscription``, without reading them.
+
+    Counted by stored procedure ``unread_counts`` of the engine, see
+    :func:`x84.bbs.msgbase.unread_counts`.
+    """
+    return call_procedure('unread_counts', session.user.handle, subscription)
+
+
+def describe_message_area(term, subscription, counts_bytag, colors):
+    get_num = lambda lookup, tag_pattern, grp: lookup[tag_pattern][grp]
     return u''.join((
         colors['highlight'](u'msgarea: '),
         colors['text'](u', ').join((
             u''.join((
                 quote(tag_pattern, colors),
                 u'({num_new}/{num_all})'.format(
-                    num_new=get_num(messages_bytags, tag_pattern, 'new'),
-                    num_all=get_num(messages_bytags, tag_pattern, 'all'))
+                    num_new=get_num(counts_bytag, tag_pattern, 'new'),
+                    num_all=get_num(counts_bytag, tag_pattern, 'all'))
             )) for tag_pattern in subscription)),
         u'\r\n\r\n',
     ))
@@ -483,7 +493,6 @@ def delete_message(msg):
     msg.recipient = u''
     msg.subject = u''
     msg.body = u''
-    msg.children = set()
     msg.parent = None
     msg.tags = set()
     msg.save()
@@ -662,20 +671,21 @@ def main(quick=False):
                     prompt_subscription(
                         session=session, term=term, yloc=top_margin,
                         subscription=subscription, colors=colors))
+                session.subscribe_notifications(subscription)
                 continue
 
-            messages, messages_bytags = get_messages_by_subscription(
+            counts, counts_bytag = get_counts_by_subscription(
                 session, subscription)
 
             # When quick login ('y') selected in top.py, return immediately
             # when no new messages are matched any longer.
-            if quick and not messages['new']:
+            if quick and not counts['new']:
                 echo(term.move_x(xloc) + u'\r\nNo new messages.\r\n')
                 return waitprompt(term)
 
             txt = describe_message_area(
                 term=term, subscription=subscription,
-                messages_bytags=messages_bytags, colors=colors)
+                counts_bytag=counts_bytag, colors=colors)
 
             yloc = top_margin + show_description(
                 term=term, description=txt, color=None,
@@ -683,28 +693,29 @@ def main(quick=False):
 
             echo(render_menu_entries(
                 term=term, top_margin=yloc,
-                menu_items=get_menu(messages),
+                menu_items=get_menu(counts),
                 colors=colors, max_cols=2))
             echo(display_prompt(term=term, colors=colors))
             echo(colors['backlight'](u' \b'))
             dirty = False
 
-        event, data = session.read_events(('refresh', 'newmsg', 'input'))
+        event, data = session.read_events(('refresh', 'notify', 'input'))
 
         if event == 'refresh':
             # screen resized, redraw.
             dirty = 2
             continue
 
-        elif event == 'newmsg':
-            # When a new message is sent, 'newmsg' event is broadcasted.
-            session.flush_event('newmsg')
-            nxt_msgs, nxt_bytags = get_messages_by_subscription(
+        elif event == 'notify':
+            # new mail or posts of our subscription, published when saved;
+            # any others pending are counted by the same recount.
+            session.read_notifications()
+            nxt_counts, nxt_bytag = get_counts_by_subscription(
                 session, subscription)
-            if nxt_msgs['new'] - messages['new']:
+            if nxt_counts['newest'] > counts['newest']:
                 # beep and re-display when a new message has arrived.
                 echo(u'\b')
-                messages, messages_bytags = nxt_msgs, nxt_bytags
+                counts, counts_bytag = nxt_counts, nxt_bytag
                 dirty = True
                 continue
 
@@ -722,19 +733,26 @@ def main(quick=False):
             inp = given_inp.strip()
             if inp.lower() in (u'n', 'a', 'v'):
                 # read new/all/private messages
-                message_indices = sorted(list(
+                messages, _ = get_messages_by_subscription(
+                    session, subscription)
+                # ordered by stored procedure ``sort_by_thread`` of the
+                # engine, see :func:`x84.bbs.msgbase.sort_by_thread`.
+                message_indices = call_procedure(
+                    'sort_by_thread',
                     {'n': messages['new'],
                      'a': messages['all'],
                      'v': messages['private'],
-                     }[inp.lower()]))
+                     }[inp.lower()])
                 if message_indices:
                     dirty = 2
                     read_messages(session=session, term=term,
                                   message_indices=message_indices,
                                   colors=colors)
-            elif inp.lower() == u'm' and messages['new']:
+            elif inp.lower() == u'm' and counts['new']:
                 # mark all messages as read
                 dirty = 1
+                messages, _ = get_messages_by_subscription(
+                    session, subscription)
                 do_mark_as_read(session, messages['new'])
             elif inp.lower() in (u'p', u'w'):
                 # write new public/private message
@@ -942,5 +960,4 @@ def do_send_message(session, term, msg, colors):
     echo(u''.join((u'\r\n',
                    term.move_x(xpos),
                    colors['highlight']('message sent!'))))
-    session.send_event('global', ('newmsg', msg.idx,))
     term.inkey(1)
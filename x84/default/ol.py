@@ -14,13 +14,13 @@ configure a section in your .ini file::
 You'll have to contact a guy named 'frost',
 more than likely found on telnet://bbs.shroo.ms.
 """
-import threading
 import logging
 import time
 
 from x84.bbs import getsession, getterminal, echo, syncterm_setfont, LineEditor
 from x84.bbs import timeago, decode_pipe
-from x84.bbs import DBProxy, get_ini
+from x84.bbs import DBProxy, FetchProxy, get_ini
+from x84.fetch import FetchError
 from common import display_banner
 
 #: maximum username length of bbs
@@ -89,83 +89,118 @@ keysort_by_datetime = lambda oneliner: (
     time.strptime(oneliner['timestamp'], '%Y-%m-%d %H:%M:%S'))
 
 
-# prevents: ImportError: Failed to import _strptime because the import lock is
-# held by another thread. http://bugs.python.org/issue7980
-_ = time.strptime('20110101', '%Y%m%d')  # noqa
+#: event of shroo.ms api responses
+SHROO_MS_EVENT = 'shroo-ms'
 
+#: seconds shroo.ms oneliners are shared by all sessions
+SHROO_MS_TTL = 60
 
-class FetchUpdatesShrooMs(threading.Thread):
 
-    """ Fetch shroo.ms onliners as a background thread. """
+def get_shroo_ms_headers():
+    """ Return http headers of shroo.ms api requests. """
+    return {
+        'X-Parse-Application-Id': shroo_ms_api_key,
+        'X-Parse-REST-API-Key': shroo_ms_restkey,
+        'Content-Type': 'application/json'
+    }
 
-    def __init__(self):
-        # It's not safe to receive data from a database from
-        # within a thread ... something we should address ..
-        # so we do it in __init__, bug #154
-        self.existing_content = DBProxy('oneliner').copy()
-        self.new_content = None
-        self.log = logging.getLogger(__name__)
-        super(FetchUpdatesShrooMs, self).__init__()
 
-    def run(self):
-        import requests
-        params = {'limit': MAX_HISTORY, 'order': '-createdAt'}
-        headers = {
-            'X-Parse-Application-Id': shroo_ms_api_key,
-            'X-Parse-REST-API-Key': shroo_ms_restkey,
-            'Content-Type': 'application/json'
-        }
-        # It's ok for a thread to raise an exception naturally on request,
-        result = requests.get(shroo_ms_api_url, params=params, headers=headers)
-        if 200 != result.status_code:
-            # log non-200 error code
-            self.log.error('[shroo.ms] returned %d:', result.status_code)
-            self.log.error(result.content)
-            return
-        content = self.transform_result(result)
-        self.notify_update_database(content)
-
-    def notify_update_database(self, content):
-        new_content = {}
-        for key, oneliner in content:
-            if str(key) not in self.existing_content:
-                new_content[key] = oneliner
-        if new_content:
-            self.log.info('[shroo.ms] %d new entries', len(new_content))
-            self.new_content = new_content
-            getsession().buffer_event('oneliner', True)
-        else:
-            self.log.debug('[shroo.ms] no new entries')
-
-    def transform_result(self, result):
-        # strangely, convert... base-36 integers .. haliphax's work ?
-        content = [(str(int(item['objectId'], 36)), dict(
-            oneliner=item['bbstagline'],
-            alias=item['bbsuser'],
-            bbsname=self.parse_bbsname(item['bbsname']),
-            timestamp=self.parse_iso8601(item['createdAt'])
-        )) for item in result.json()['results']]
-        return content
-
-    @staticmethod
-    def parse_bbsname(bbsname):
-        # I like the aliases, rename hellbeard's
-        if bbsname == 'Blood Island/x':
-            return 'BI/X'
-        # and maze's
-        elif bbsname == 'Random Noize':
-            return 'RNz'
-        # and spidy's
-        elif bbsname == 'BO':
-            return 'BoF'
-        return bbsname
-
-    @staticmethod
-    def parse_iso8601(timestamp):
-        from dateutil.parser import parse
-        from dateutil.tz import tzlocal
-        as_localtime = parse(timestamp).astimezone(tzlocal())
-        return as_localtime.strftime('%Y-%m-%d %H:%M:%S')
+def get_shroo_ms_params():
+    """ Return query parameters of shroo.ms api requests. """
+    return {'limit': MAX_HISTORY, 'order': '-createdAt'}
+
+
+def request_shroo_ms(ttl=SHROO_MS_TTL):
+    """
+    Request shroo.ms oneliners without waiting for the response.
+
+    The response is shared by all sessions through the engine's fetch
+    cache, and is received by the main loop as event ``shroo-ms``.
+    """
+    FetchProxy(ttl=ttl).request(SHROO_MS_EVENT, shroo_ms_api_url,
+                                params=get_shroo_ms_params(),
+                                headers=get_shroo_ms_headers())
+
+
+def sync_shroo_ms():
+    """
+    Merge new oneliners of shroo.ms into the local database.
+
+    Run periodically by job ``shroo-ms`` of :mod:`x84.scheduler`.
+    """
+    if not shroo_ms_enabled:
+        return
+    try:
+        result = FetchProxy(ttl=SHROO_MS_TTL).get(
+            shroo_ms_api_url, params=get_shroo_ms_params(),
+            headers=get_shroo_ms_headers())
+    except FetchError as err:
+        result = err
+    new_content = get_new_shroo_ms(result)
+    if new_content:
+        do_merge_shroo_ms(new_content)
+
+
+def get_new_shroo_ms(result):
+    """
+    Return oneliners of shroo.ms api ``result`` not in local database.
+
+    :param result: data of event ``shroo-ms``, a response or FetchError.
+    :rtype: dict
+    """
+    log = logging.getLogger(__name__)
+    if isinstance(result, FetchError):
+        log.warn(result)
+        return dict()
+    if 200 != result.status_code:
+        # log non-200 error code
+        log.error('[shroo.ms] returned %d:', result.status_code)
+        log.error(result.content)
+        return dict()
+    existing_content = DBProxy('oneliner').copy()
+    new_content = dict()
+    for key, oneliner in transform_result(result):
+        if str(key) not in existing_content:
+            new_content[key] = oneliner
+    if new_content:
+        log.info('[shroo.ms] %d new entries', len(new_content))
+    else:
+        log.debug('[shroo.ms] no new entries')
+    return new_content
+
+
+def transform_result(result):
+    """ Return list of (key, oneliner) of shroo.ms api ``result``. """
+    # strangely, convert... base-36 integers .. haliphax's work ?
+    content = [(str(int(item['objectId'], 36)), dict(
+        oneliner=item['bbstagline'],
+        alias=item['bbsuser'],
+        bbsname=parse_bbsname(item['bbsname']),
+        timestamp=parse_iso8601(item['createdAt'])
+    )) for item in result.json()['results']]
+    return content
+
+
+def parse_bbsname(bbsname):
+    """ Return alias of shroo.ms ``bbsname``. """
+    # I like the aliases, rename hellbeard's
+    if bbsname == 'Blood Island/x':
+        return 'BI/X'
+    # and maze's
+    elif bbsname == 'Random Noize':
+        return 'RNz'
+    # and spidy's
+    elif bbsname == 'BO':
+        return 'BoF'
+    return bbsname
+
+
+def parse_iso8601(timestamp):
+    """ Return local time of iso8601 ``timestamp``. """
+    from dateutil.parser import parse
+    from dateutil.tz import tzlocal
+    as_localtime = parse(timestamp).astimezone(tzlocal())
+    return as_localtime.strftime('%Y-%m-%d %H:%M:%S')
 
 
 def post_shroo_ms(message, username):
@@ -178,11 +213,6 @@ def post_shroo_ms(message, username):
 
     log = logging.getLogger(__name__)
 
-    headers = {
-        'X-Parse-Application-Id': shroo_ms_api_key,
-        'X-Parse-REST-API-Key': shroo_ms_restkey,
-        'Content-Type': 'application/json'
-    }
     payload = json.dumps({
         'bbsname': system_bbsname,
         'bbsuser': username,
@@ -194,7 +224,8 @@ def post_shroo_ms(message, username):
         'bbsfakeuser': False,
     })
     try:
-        result = requests.post(shroo_ms_api_url, data=payload, headers=headers)
+        result = requests.post(shroo_ms_api_url, data=payload,
+                               headers=get_shroo_ms_headers())
     except Exception as err:
         # log exception string, cause message to post locally
         log.warn(err)
@@ -207,13 +238,9 @@ def post_shroo_ms(message, username):
             return False
         log.info('(%d) OK [shroo.ms]: %s', result.status_code, message)
 
-        # fetch our own post on shroo-ms in background
-        thread = FetchUpdatesShrooMs()
-        thread.start()
-        return thread
-
-
-# -- database functions
+        # fetch our own post on shroo-ms, bypassing any cached response
+        request_shroo_ms(ttl=0)
+        return True
 
 
 def do_merge_shroo_ms(new_content):
@@ -221,11 +248,14 @@ def do_merge_shroo_ms(new_content):
     udb = DBProxy('oneliner')
     with udb:
         udb.update(new_content)
-    maybe_expunge_records()
 
 
 def maybe_expunge_records():
-    """ Check ceiling of database keys; trim-to MAX_HISTORY. """
+    """
+    Check ceiling of database keys; trim-to MAX_HISTORY.
+
+    Run periodically by job ``oneliners`` of :mod:`x84.scheduler`.
+    """
     udb = DBProxy('oneliner')
     expunged = 0
     with udb:
@@ -253,7 +283,6 @@ def add_oneline(session, message):
             'bbsname': get_ini('system', 'bbsname'),
             'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
         }
-    maybe_expunge_records()
 
     # tell everybody a new oneliner was posted, including our
     # -- allows it to work something like a chatroom.
@@ -424,11 +453,6 @@ def display_oneliners(term, top_margin, offset):
 
 
 def do_prompt(term, session):
-    thread = None
-    if shroo_ms_enabled:
-        # fetch shroo-ms api oneliners
-        thread = FetchUpdatesShrooMs()
-        thread.start()
     dirty = -1
     top_margin = bot_margin = 0
     offset = 0
@@ -444,15 +468,6 @@ def do_prompt(term, session):
 
         if dirty == 1:
             # re-display all oneliners on update, or dirty == 1
-            # if any shroo-ms oneliners were received, merge them
-            # into the database from the main thread.
-            if thread is not None and not thread.is_alive():
-                if thread.new_content:
-                    echo(term.move_x(0) + term.clear_eol)
-                    echo(term.center(term.bold_red('This just in!')).rstrip())
-                    do_merge_shroo_ms(thread.new_content)
-                thread = None
-
             with term.hidden_cursor():
                 bot_margin, offset = display_oneliners(
                     term, top_margin, offset)
@@ -465,10 +480,20 @@ def do_prompt(term, session):
             dirty = 0
 
         event, data = session.read_events(
-            ('input', 'oneliner', 'refresh'))
+            ('input', 'oneliner', 'refresh', SHROO_MS_EVENT))
         if event == 'refresh':
             dirty = -1
             continue
+        elif event == SHROO_MS_EVENT:
+            # if any shroo-ms oneliners were received, merge them
+            # into the database.
+            new_content = get_new_shroo_ms(data)
+            if new_content:
+                echo(term.move_x(0) + term.clear_eol)
+                echo(term.center(term.bold_red('This just in!')).rstrip())
+                do_merge_shroo_ms(new_content)
+                dirty = 1
+            continue
         elif event == 'oneliner':
             dirty = 1
             continue
@@ -480,14 +505,7 @@ def do_prompt(term, session):
                 if inp.lower() in (u'y',):
                     # say something, refresh after
                     echo(inp)
-                    say_retval = say_something(term, session)
-                    if isinstance(say_retval, FetchUpdatesShrooMs):
-                        # a rather strange hack, we track the thread of
-                        # api calls so that we can merge its final content
-                        # into our local database. See __init__ for
-                        # bug id and description
-                        thread = say_retval
-                    elif say_retval:
+                    if say_something(term, session):
                         # user has said something to the local database,
                         # refresh it so that they can beam with pride ...
                         dirty = 1
@@ -1,8 +1,10 @@
 """
 Sysop area script for x/84.
 
-Currently, this only serves the purpose of adding new message networks.
+Currently, this serves the purpose of adding new message networks, and
+starting a sampling profile of the engine or a session.
 """
+import os
 
 from x84.bbs import getsession, getterminal, echo, get_ini, DBProxy, LineEditor
 
@@ -76,6 +78,31 @@ def add_leaf_msgnet():
     view_leaf_msgnet(server_tag, board_id)
 
 
+def start_profile():
+    """ Prompt for and start a sampling profile of a process. """
+    session = getsession()
+    echo(u'\r\nprofile target (engine, web, msgpoll, or session-id): ')
+    target = LineEditor(width=40).read()
+    if not target:
+        return
+    echo(u'\r\nduration in seconds, or [s]top: ')
+    inp = LineEditor(width=6).read()
+    if not inp:
+        return
+    if inp.lower() == u's':
+        session.send_event('profile', (target, 'stop', None))
+        echo(u'\r\nprofile of {0} stopped.'.format(target))
+        return
+    try:
+        duration = int(inp)
+    except ValueError:
+        return
+    session.send_event('profile', (target, 'start', duration))
+    echo(u'\r\nprofile of {0} started, saved to {1} after {2}s.'
+         .format(target, os.path.join(get_ini('system', 'datapath'),
+                                      'profile'), duration))
+
+
 def main():
     session, term = getsession(), getterminal()
     assert session.user.is_sysop
@@ -86,6 +113,8 @@ def main():
             echo(u'\r\n\r\nmessage network functions:\r\n')
             echo(u'    [a]dd new leaf node.\r\n')
             echo(u'    [v]iew leaf nodes.\r\n')
+            echo(u'\r\nsystem functions:\r\n')
+            echo(u'    [p]rofile a process.\r\n')
             echo(u'\r\n\r\n')
             echo(u'[q]uit\r\n')
             dirty = False
@@ -99,6 +128,10 @@ def main():
             echo(inp)
             add_leaf_msgnet()
             dirty = True
+        elif inp.lower() == u'p':
+            echo(inp)
+            start_profile()
+            dirty = True
         elif inp.lower() == u'v':
             echo(inp)
             echo(u'\r\n')
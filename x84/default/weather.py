@@ -2,12 +2,12 @@
 from xml.etree import cElementTree as ET
 import itertools
 import textwrap
-import requests
 import warnings
 import logging
 import time
 import os
 
+from x84.bbs import FetchProxy
 
 log = logging.getLogger(__name__)
 
@@ -117,9 +117,10 @@ def fetch_weather(postal):
     """
     import StringIO
     disp_msg(u'fEtChiNG')
-    resp = requests.get(u'http://apple.accuweather.com'
-                        + u'/adcbin/apple/Apple_Weather_Data.asp',
-                        params=(('zipcode', postal),))
+    # forecasts are shared by all sessions for 15 minutes
+    resp = FetchProxy(ttl=900).get(u'http://apple.accuweather.com'
+                                   + u'/adcbin/apple/Apple_Weather_Data.asp',
+                                   params=(('zipcode', postal),))
     if resp is None:
         disp_notfound()
         return None
@@ -136,9 +137,10 @@ def do_search(term, search):
     import StringIO
     from x84.bbs import echo
     disp_msg(u'SEARChiNG')
-    resp = requests.get(u'http://apple.accuweather.com'
-                        + u'/adcbin/apple/Apple_find_city.asp',
-                        params=(('location', search),))
+    # locations are shared by all sessions for a day
+    resp = FetchProxy(ttl=86400).get(u'http://apple.accuweather.com'
+                                     + u'/adcbin/apple/Apple_find_city.asp',
+                                     params=(('location', search),))
     locations = list()
     if resp is None:
         disp_notfound()
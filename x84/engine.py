@@ -21,6 +21,7 @@ __credits__ = [
 __license__ = 'ISC'
 
 # std
+import threading
 import logging
 import select
 import socket
@@ -29,9 +30,11 @@ import sys
 
 # local
 __import__('encodings')  # provides alternate encodings
-from x84 import cmdline
-from x84.db import DBHandler
-from x84.terminal import get_terminals, kill_session, find_tty
+from x84 import cmdline, metrics, profiler
+from x84.db import DBHandler, ProcHandler, load_procedures
+from x84.fetch import FetchHandler
+from x84.terminal import (get_terminals, kill_session, find_tty, log_records,
+                          route_notifications, drain_notifications)
 from x84.fail2ban import get_fail2ban_function
 
 
@@ -63,20 +66,44 @@ def main():
     # retrieve list of managed servers
     servers = get_servers(CFG)
 
+    # register stored procedures, run on behalf of sessions.
+    load_procedures()
+
     # begin unmanaged servers
     if (CFG.has_section('web') and
             (not CFG.has_option('web', 'enabled')
              or CFG.getboolean('web', 'enabled'))):
-        # start https server for one or more web modules.
+        # start https server for one or more web modules, supervised
+        # as a sub-process.
         from x84 import webserve
         webserve.main()
 
     if get_ini(section='msg', key='network_tags'):
-        # start background timer to poll for new messages
-        # of message networks we may be a member of.
+        # schedule polling for new messages of message
+        # networks we may be a member of.
         from x84 import msgpoll
         msgpoll.main()
 
+    if get_ini(section='fileindex', key='enabled', getter='getboolean'):
+        # schedule indexing of file area descriptions.
+        from x84 import fileindex
+        fileindex.main()
+
+    if get_ini(section='msgarchive', key='enabled', getter='getboolean'):
+        # schedule archival of expired messages.
+        from x84 import msgarchive
+        msgarchive.main()
+
+    # begin scheduler of periodic jobs, such as those registered above, and
+    # those of the default oneliners script, ol.py.
+    from x84 import scheduler
+    scheduler.register('oneliners', 'ol.maybe_expunge_records',
+                       cron='17 * * * *')
+    if get_ini(section='shroo-ms', key='enabled', getter='getboolean'):
+        scheduler.register('shroo-ms', 'ol.sync_shroo_ms',
+                           interval=300, jitter=30)
+    scheduler.main()
+
     try:
         # begin main event loop
         _loop(servers)
@@ -272,6 +299,66 @@ def session_send(terminals):
             kill_session(tty.client, 'timeout')
 
 
+def get_event_kind(event):
+    """
+    Return label of IPC ``event`` name for metrics.
+
+    Database and lock events are reduced to their prefix, ``'db'`` and
+    ``'lock'``, as their full event name contains a schema or lock name.
+    """
+    for prefix in ('db', 'lock'):
+        if event.startswith(prefix):
+            return prefix
+    return event
+
+
+def register_gauges(servers):
+    """ Register metrics gauges describing engine state of ``servers``. """
+    def sessions():
+        """ Number of sessions by current script. """
+        result = dict()
+        for _, tty in get_terminals():
+            script = tty.script or 'unknown'
+            result[script] = result.get(script, 0) + 1
+        return result
+
+    def clients():
+        """ Number of connected clients by kind. """
+        return dict((server.client_factory.kind, len(server.clients))
+                    for server in servers)
+
+    def buffer_size(attr):
+        """ Return gauge callback for total and maximum buffer size. """
+        def gauge():
+            """ Total and maximum size of client buffer. """
+            sizes = [len(getattr(client, attr))
+                     for server in servers
+                     for client in server.clients.values()]
+            return {'total': sum(sizes), 'max': max(sizes or [0])}
+        return gauge
+
+    def threads():
+        """ Number of engine threads by kind. """
+        return {
+            'connect': sum(len(server.threads) for server in servers),
+            'db': len([thread for thread in threading.enumerate()
+                       if isinstance(thread, DBHandler)]),
+            'fetch': len([thread for thread in threading.enumerate()
+                          if isinstance(thread, FetchHandler)]),
+            'dbproc': len([thread for thread in threading.enumerate()
+                           if isinstance(thread, ProcHandler)]),
+            'total': threading.active_count(),
+        }
+
+    metrics.register_gauge('engine_sessions', sessions)
+    metrics.register_gauge('engine_clients', clients)
+    metrics.register_gauge('engine_threads', threads)
+    metrics.register_gauge('client_send_buffer_bytes',
+                           buffer_size('send_buffer'))
+    metrics.register_gauge('client_recv_buffer_bytes',
+                           buffer_size('recv_buffer'))
+
+
 def handle_lock(locks, tty, event, data, tap_events, log):
     """ handle locking event of ``(lock-key, (method, stale))``. """
     # pylint: disable=R0913
@@ -350,6 +437,37 @@ def handle_lock(locks, tty, event, data, tap_events, log):
                           .format(tty=tty, event=event))
 
 
+def handle_profile(terminals, tty, data, log):
+    """
+    Handle profiling event of ``(target, action, duration)``.
+
+    Target ``engine`` is profiled within this process, target ``web`` is
+    routed to the web server process, a job of :mod:`x84.scheduler`, such
+    as ``msgpoll``, to the sub-process of its next run, and any other
+    target to the session of matching session-id.
+    """
+    target, action, duration = data
+    log.info('[{tty.sid}] profile {action} {target}'
+             .format(tty=tty, action=action, target=target))
+    if target == 'web':
+        from x84 import webserve
+        if webserve.handle_profile(action, duration):
+            return
+    if target == 'engine' or target in profiler.TARGET_THREADS:
+        profiler.handle_profile(target, action, duration)
+        return
+    from x84 import scheduler
+    if scheduler.handle_profile(target, action, duration):
+        return
+    for _sid, _tty in terminals:
+        if _sid == target:
+            _tty.master_write.send(('profile', (action, duration)))
+            break
+    else:
+        log.warn('[{tty.sid}] profile target {target} not found'
+                 .format(tty=tty, target=target))
+
+
 def session_recv(locks, terminals, log, tap_events):
     """
     Receive data waiting for terminal sessions.
@@ -369,21 +487,26 @@ def session_recv(locks, terminals, log, tap_events):
                 log.exception('unpickling error: {0}'.format(err))
                 break
 
+            metrics.incr('engine_events', get_event_kind(event))
+
             # 'exit' event, unregisters client
             if event == 'exit':
                 kill_session(tty.client, 'client exit')
                 break
 
-            # 'logger' event, prefix log message with handle and IP address
+            # 'logger' event, list of log records written by a thread,
+            # prefixed by handle and IP address
             elif event == 'logger':
-                data.msg = ('{data.handle}[{tty.sid}] {data.msg}'
-                            .format(data=data, tty=tty))
-                log.handle(data)
+                log_records(tty.sid, data)
 
             # 'output' event, buffer for tcp socket
             elif event == 'output':
                 tty.client.send_unicode(ucs=data[0], encoding=data[1])
 
+            # 'output-bytes' event, buffer raw bytes for tcp socket
+            elif event == 'output-bytes':
+                tty.client.send_bytes(data)
+
             # 'remote-disconnect' event, hunt and destroy
             elif event == 'remote-disconnect':
                 for _sid, _tty in terminals:
@@ -411,6 +534,22 @@ def session_recv(locks, terminals, log, tap_events):
                     if sid != _sid:
                         _tty.master_write.send((event, data,))
 
+            # 'notify-subscribe': handle and tag patterns of notifications
+            elif event == 'notify-subscribe':
+                tty.subscription = data
+
+            # 'notify': notifications to recipient and subscribers' sessions
+            elif event == 'notify':
+                if tap_events:
+                    log.debug('[{tty.sid}] notify {data!r}'
+                              .format(tty=tty, data=data))
+                route_notifications(data, origin=sid)
+
+            # 'metrics': counters, histograms and script name of session
+            elif event == 'metrics':
+                tty.script = data.get('script', tty.script)
+                metrics.merge(data)
+
             # 'set-timeout': set user-preferred timeout
             elif event == 'set-timeout':
                 if tap_events:
@@ -418,14 +557,33 @@ def session_recv(locks, terminals, log, tap_events):
                               .format(tty=tty, data=data))
                 tty.timeout = data
 
+            # 'profile': start or stop sampling profiler
+            elif event == 'profile':
+                handle_profile(terminals, tty, data, log)
+
+            # 'dbproc': run stored procedure beside the databases
+            elif event == 'dbproc':
+                if tap_events:
+                    log.debug('[{tty.sid}] dbproc {data[0]}'
+                              .format(tty=tty, data=data))
+                ProcHandler(tty.master_write, data).start()
+
             # 'db*': access DBProxy API for shared sqlitedict
             elif event.startswith('db'):
-                DBHandler(tty.master_write, event, data).start()
+                DBHandler(tty.master_write, event, data,
+                          script=tty.script).start()
 
             # 'lock': access fine-grained bbs-global locking
             elif event.startswith('lock'):
                 handle_lock(locks, tty, event, data, tap_events, log)
 
+            # 'fetch': access FetchProxy API for shared http response cache
+            elif event == 'fetch':
+                if tap_events:
+                    log.debug('[{tty.sid}] fetch {data!r}'
+                              .format(tty=tty, data=data))
+                FetchHandler(tty.master_write, *data).start()
+
             else:
                 log.error('[{tty.sid}] unhandled event, data: '
                           '({event}, {data})'
@@ -439,6 +597,7 @@ def _loop(servers):
     from x84.bbs.ini import CFG
 
     SELECT_POLL = 0.02  # polling time is 20ms
+    NOTIFY_INTERVAL = 1.0  # deliver queued notifications every second
 
     # WIN32 has no session_fds (multiprocess queues are not polled using
     # select), use a persistently empty set; for WIN32, sessions are always
@@ -454,6 +613,8 @@ def _loop(servers):
     tap_events = CFG.getboolean('session', 'tap_events')
     check_ban = get_fail2ban_function()
     locks = dict()
+    register_gauges(servers)
+    last_notify = 0
 
     while True:
         # shutdown, close & delete inactive clients,
@@ -492,6 +653,9 @@ def _loop(servers):
             log.debug('continue after select.error: {0}'.format(err))
             continue
 
+        # measure time spent handling i/o, excluding time spent waiting.
+        stime = time.time()
+
         for fd in ready_r:
             # see if any new tcp connections were made
             server = find_server(servers, fd)
@@ -516,6 +680,16 @@ def _loop(servers):
         # send session data, poll for user-timeout and disconnect them
         session_send(terms)
 
+        # deliver notifications published by processes without a session
+        if stime - last_notify >= NOTIFY_INTERVAL:
+            last_notify = stime
+            try:
+                drain_notifications()
+            except Exception as err:  # pylint: disable=W0703
+                log.exception('notifications not delivered: {0}'.format(err))
+
+        metrics.observe('engine_loop', time.time() - stime)
+
 
 if __name__ == '__main__':
     exit(main())
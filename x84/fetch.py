@@ -0,0 +1,260 @@
+"""
+Shared HTTP fetch service for x/84.
+
+Scripts fetching from the web, such as weather reports or news, request a
+URL by :class:`x84.bbs.fetchproxy.FetchProxy`, which is forwarded to the
+main engine as event ``fetch``.  Responses are cached by the engine for all
+sessions, keyed by URL, query parameters and request headers:
+
+- A response younger than its time-to-live is returned without request.
+- An expired response younger than ``stale_ttl`` further seconds is
+  returned at once, while it is revalidated by a background thread.
+- Concurrent requests of the same URL are coalesced into a single request,
+  whose response is shared by all of its callers.
+- When a request fails, an expired response is returned, when available.
+
+Only responses of status 200 are cached.
+"""
+# std imports
+import collections
+import threading
+import logging
+import errno
+import json
+import time
+
+# local
+from x84 import metrics
+
+
+class FetchError(IOError):
+
+    """ A URL could not be fetched. """
+
+
+class FetchResponse(object):
+
+    """
+    Response of a fetched URL.
+
+    A subset of the interface of :class:`requests.Response`, so that it may
+    be returned to sessions by IPC pipe and shared by the cache.
+    """
+
+    def __init__(self, url, status_code, headers, content, encoding=None):
+        """
+        Class initializer.
+
+        :param str url: final URL of response, after any redirect.
+        :param int status_code: HTTP status code.
+        :param dict headers: response headers.
+        :param bytes content: response body.
+        :param str encoding: character encoding of body, if known.
+        """
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+        #: time of response.
+        self.fetched = time.time()
+
+    @property
+    def ok(self):
+        """ Whether status code is less than 400. """
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        """ Response body as unicode. """
+        return self.content.decode(self.encoding or 'utf8', 'replace')
+
+    def json(self):
+        """ Return response body decoded as JSON. """
+        return json.loads(self.text)
+
+
+def get_key(url, params=None, headers=None):
+    """ Return cache key of a request. """
+    if isinstance(params, dict):
+        params = params.items()
+    return (url,
+            tuple(sorted(params or ())),
+            tuple(sorted((headers or dict()).items())))
+
+
+class _Flight(object):
+
+    """ A request in progress, shared by its concurrent callers. """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class FetchCache(object):
+
+    """ Time-to-live cache of HTTP GET responses, with request coalescing. """
+
+    def __init__(self, maxsize=256, ttl=300, stale_ttl=3600, timeout=10):
+        """
+        Class initializer.
+
+        :param int maxsize: maximum number of cached responses.
+        :param int ttl: default seconds a response is fresh.
+        :param int stale_ttl: seconds an expired response may be returned
+                              while it is revalidated.
+        :param int timeout: default seconds to wait for a response.
+        """
+        self.log = logging.getLogger(__name__)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self.responses = collections.OrderedDict()
+        self.flights = dict()
+        self.lock = threading.Lock()
+
+    def fetch(self, url, params=None, headers=None, ttl=None, timeout=None):
+        """
+        Return response of HTTP GET request of ``url``.
+
+        :param str url: URL to fetch.
+        :param params: query parameters, as dictionary or sequence of pairs.
+        :param dict headers: request headers.
+        :param int ttl: seconds a cached response is fresh.  When 0, the
+                        URL is always requested, though still coalesced
+                        with concurrent requests.
+        :param int timeout: seconds to wait for a response.
+        :rtype: FetchResponse
+        :raises FetchError: request failed and no response is cached.
+        """
+        key = get_key(url, params, headers)
+        ttl = self.ttl if ttl is None else ttl
+        timeout = timeout or self.timeout
+        with self.lock:
+            response = self.responses.get(key)
+            if response is not None:
+                age = time.time() - response.fetched
+                if age < ttl:
+                    # most recently used is last to be evicted
+                    self.responses[key] = self.responses.pop(key)
+                    metrics.incr('fetch_requests', 'hit')
+                    return response
+                if ttl and age < ttl + self.stale_ttl:
+                    metrics.incr('fetch_requests', 'stale')
+                    if key not in self.flights:
+                        flight = self.flights[key] = _Flight()
+                        thread = threading.Thread(
+                            target=self._request, name='fetch',
+                            args=(key, flight, url, params, headers, timeout))
+                        thread.daemon = True
+                        thread.start()
+                    return response
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+
+        if leader:
+            metrics.incr('fetch_requests', 'miss')
+            self._request(key, flight, url, params, headers, timeout)
+        else:
+            metrics.incr('fetch_requests', 'coalesced')
+            if not flight.done.wait(timeout * 2):
+                raise FetchError('{0}: timed out'.format(url))
+        if flight.error is not None:
+            raise flight.error
+        return flight.response
+
+    def _request(self, key, flight, url, params, headers, timeout):
+        """ Fetch ``url`` for ``flight`` and cache its response. """
+        import requests
+        stime = time.time()
+        try:
+            resp = requests.get(url, params=params, headers=headers,
+                                timeout=timeout)
+            flight.response = FetchResponse(
+                url=resp.url, status_code=resp.status_code,
+                headers=dict(resp.headers), content=resp.content,
+                encoding=resp.encoding or resp.apparent_encoding)
+            failure = (None if resp.status_code == 200 else
+                       'status {0}'.format(resp.status_code))
+        # pylint: disable=W0703
+        #         Catching too general exception
+        except Exception as err:
+            flight.error = FetchError('{0}: {1}'.format(url, err))
+            failure = err
+        metrics.observe('fetch_latency', time.time() - stime,
+                        requests.utils.urlparse(url).netloc)
+
+        with self.lock:
+            if failure is None:
+                self.responses.pop(key, None)
+                self.responses[key] = flight.response
+                while len(self.responses) > self.maxsize:
+                    self.responses.popitem(last=False)
+            elif key in self.responses:
+                # return the expired response, rather than the failure.
+                self.log.warn('{0}: {1}, returning response of {2:0.0f}s ago'
+                              .format(url, failure, time.time() -
+                                      self.responses[key].fetched))
+                flight.response, flight.error = self.responses[key], None
+            del self.flights[key]
+        flight.done.set()
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache():
+    """ Return process-wide :class:`FetchCache`, configured by ``[fetch]``. """
+    global _CACHE  # pylint: disable=W0603
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            from x84.bbs.ini import get_ini
+            _CACHE = FetchCache(
+                maxsize=get_ini('fetch', 'cache_size', getter='getint') or 256,
+                ttl=get_ini('fetch', 'ttl', getter='getint') or 300,
+                stale_ttl=get_ini('fetch', 'stale_ttl', getter='getint') or 0,
+                timeout=get_ini('fetch', 'timeout', getter='getint') or 10)
+    return _CACHE
+
+
+class FetchHandler(threading.Thread):
+
+    """
+    This thread fetches a URL on behalf of a session.
+
+    The response, or a :class:`FetchError`, is returned to the session's
+    IPC queue as data of the reply event named by the session.
+    """
+
+    def __init__(self, queue, event, kwargs):
+        """
+        Class initializer.
+
+        :param multiprocessing.Pipe queue: parent input end of a tty session
+                                           ipc queue.
+        :param str event: event name of reply.
+        :param dict kwargs: keyword arguments of :meth:`FetchCache.fetch`.
+        """
+        self.queue, self.event = queue, event
+        self.kwargs = kwargs
+        threading.Thread.__init__(self, name='fetch')
+
+    def run(self):
+        """ Fetch URL and return response to session queue. """
+        try:
+            result = get_cache().fetch(**self.kwargs)
+        except FetchError as err:
+            result = err
+        try:
+            self.queue.send((self.event, result))
+        except IOError as err:
+            if err.errno != errno.EBADF:
+                raise
+            # our pipe/queue has been disconnected (the session
+            # has disconnected) while the url was fetched.
@@ -0,0 +1,283 @@
+#!/usr/bin/env python2.7
+"""
+File area indexer for x/84.
+
+Periodically walks the file area, re-indexing only those files whose size
+or modification time have changed since they were last indexed, and
+removing entries of files and folders that no longer exist.  Descriptions
+are extracted from archives by a pool of worker processes, which is created
+only for the duration of a scan that finds files to index.  Finally, the
+search index is updated for files whose entry or sysop-edited description
+has changed.
+
+The index is served to the file browser by :mod:`x84.bbs.fileindex`.
+"""
+# std imports
+import multiprocessing
+import logging
+import time
+import os
+
+# local
+from . import cmdline
+
+
+def find_stale(directory, filenames, entries):
+    """
+    Return files of ``directory`` not current in index ``entries``.
+
+    :param list filenames: names of files of ``directory``.
+    :param dict entries: index of directory.
+    :rtype: list
+    """
+    from x84.bbs.fileindex import is_current
+    stale = []
+    for filename in filenames:
+        try:
+            stat = os.stat(os.path.join(directory, filename))
+        except OSError:
+            continue
+        if not is_current(entries.get(filename), stat):
+            stale.append(filename)
+    return stale
+
+
+def scan(root, processes):
+    """
+    Bring index of file area ``root`` up to date.
+
+    :param str root: root folder of file area.
+    :param int processes: number of worker processes.
+    :returns: number of files indexed.
+    :rtype: int
+    """
+    from x84.bbs.fileindex import INDEX_DB, get_directory_key, index_file
+    from x84.bbs import DBProxy
+
+    log = logging.getLogger(__name__)
+    indexdb = DBProxy(INDEX_DB, use_session=False)
+    index = dict(indexdb.items())
+    stale_dirs = dict()
+    directory_keys = set()
+
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        key = get_directory_key(directory, root)
+        directory_keys.add(key)
+        entries = index.get(key, dict())
+        filenames = set(filenames)
+        removed = [fname for fname in entries if fname not in filenames]
+        stale = find_stale(directory, filenames, entries)
+        if removed or stale:
+            stale_dirs[directory] = (key, removed, stale)
+
+    # remove index of folders that no longer exist
+    for key in set(index.keys()) - directory_keys:
+        with indexdb:
+            del indexdb[key]
+
+    num_stale = sum(len(stale) for _, _, stale in stale_dirs.values())
+    if not stale_dirs:
+        return 0
+
+    log.debug('{0} files to index in {1} folders.'
+              .format(num_stale, len(stale_dirs)))
+    pool = multiprocessing.Pool(processes=processes) if num_stale else None
+    try:
+        for directory, (key, removed, stale) in sorted(stale_dirs.items()):
+            filepaths = [os.path.join(directory, fname) for fname in stale]
+            results = (pool.imap_unordered(index_file, filepaths, chunksize=8)
+                       if filepaths else ())
+            updates = dict()
+            for filepath, entry in results:
+                if entry is not None:
+                    updates[os.path.basename(filepath)] = entry
+            # each folder is stored as it completes, so that large file
+            # areas are served incrementally as they are indexed.
+            with indexdb:
+                entries = indexdb.get(key, dict())
+                for fname in removed:
+                    entries.pop(fname, None)
+                entries.update(updates)
+                indexdb[key] = entries
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    log.info('indexed {0} files in {1} folders.'
+             .format(num_stale, len(stale_dirs)))
+    return num_stale
+
+
+def get_documents(index, descriptions):
+    """
+    Return searchable documents of file ``index``.
+
+    :param dict index: file index, entries by directory key.
+    :param dict descriptions: sysop-edited descriptions by path.
+    :returns: dictionary of ``(signature, filename, description)`` by path
+              relative to root, where ``signature`` changes with the file
+              or its description.
+    :rtype: dict
+    """
+    documents = dict()
+    for key, entries in index.items():
+        for filename, entry in entries.items():
+            path = (filename if key == os.curdir
+                    else os.path.join(key, filename))
+            description = descriptions.get(path)
+            if description is None:
+                description = entry['diz']
+            signature = (entry['size'], entry['mtime'],
+                         hash(repr(description)))
+            documents[path] = (signature, filename, description)
+    return documents
+
+
+def update_search():
+    """
+    Bring search index of file area up to date.
+
+    Files whose index entry or sysop-edited description has changed since
+    last indexed for search are re-indexed: their previous search terms,
+    kept by table ``documents``, are removed from the postings of table
+    ``terms``, and their current terms added.
+
+    :returns: number of files re-indexed for search.
+    :rtype: int
+    """
+    from x84.bbs.fileindex import INDEX_DB, DIZ_DB, get_document_terms
+    from x84.bbs import DBProxy
+
+    log = logging.getLogger(__name__)
+    index = dict(DBProxy(INDEX_DB, use_session=False).items())
+    descriptions = dict(
+        (path.lstrip(os.path.sep), description)
+        for path, description in DBProxy(DIZ_DB, use_session=False).items())
+    current = get_documents(index, descriptions)
+
+    docsdb = DBProxy(INDEX_DB, table='documents', use_session=False)
+    termsdb = DBProxy(INDEX_DB, table='terms', use_session=False)
+    indexed = dict(docsdb.items())
+
+    removed = [path for path in indexed if path not in current]
+    changed = [path for path, (signature, _, _) in current.items()
+               if indexed.get(path, (None, None))[0] != signature]
+    if not (removed or changed):
+        return 0
+
+    # determine postings to update, (path, old terms, new terms)
+    updates = list()
+    for path in removed:
+        updates.append((path, indexed[path][1], dict()))
+    doc_updates = dict()
+    for path in changed:
+        _, filename, description = current[path]
+        terms = get_document_terms(filename, description)
+        old_terms = indexed[path][1] if path in indexed else dict()
+        updates.append((path, old_terms, terms))
+        doc_updates[path] = (current[path][0], terms)
+
+    affected = set()
+    for _, old_terms, terms in updates:
+        affected.update(old_terms)
+        affected.update(terms)
+    if len(affected) > 1000:
+        # read all postings at once, rather than by a database
+        # command for each term, such as when first indexed.
+        postings = dict(termsdb.items())
+    else:
+        postings = dict((term, termsdb.get(term, dict()))
+                        for term in affected)
+
+    modified = dict()
+    for path, old_terms, terms in updates:
+        for term in old_terms:
+            posting = modified.setdefault(term, postings.get(term, dict()))
+            posting.pop(path, None)
+        for term, weight in terms.items():
+            posting = modified.setdefault(term, postings.get(term, dict()))
+            posting[path] = weight
+
+    with termsdb:
+        termsdb.update(modified)
+    with docsdb:
+        if doc_updates:
+            docsdb.update(doc_updates)
+        for path in removed:
+            del docsdb[path]
+    log.info('search index updated for {0} files.'
+             .format(len(removed) + len(changed)))
+    return len(removed) + len(changed)
+
+
+def index_area(root, processes):
+    """ Update file and search index of file area ``root``. """
+    log = logging.getLogger(__name__)
+    stime = time.time()
+    try:
+        scan(root, processes)
+        update_search()
+    except Exception as err:  # pylint: disable=W0703
+        log.exception('file index scan failed: {0}'.format(err))
+    log.debug('scan of {0} completed in {1:0.2f}s'
+              .format(root, time.time() - stime))
+
+
+def indexer(root, interval, processes):
+    """ Blocking function periodically indexes file area ``root``. """
+    while True:
+        index_area(root, processes)
+        time.sleep(interval)
+
+
+def main(background_daemon=True):
+    """
+    Entry point to begin indexing of the file area.
+
+    Called by x84/engine.py, function main(), to register a job of
+    :mod:`x84.scheduler`.  Each scan is run by a sub-process of the
+    scheduler, so that the engine's main loop is not slowed by the walk of
+    a large file area or its search index.
+
+    :param bool background_daemon: When True (default), this function returns
+                and the file area is indexed by job ``fileindex`` of the
+                scheduler.  Otherwise, function call to ``main()`` is
+                blocking.
+    :rtype: None
+    """
+    from x84.bbs.ini import get_ini
+    from x84 import scheduler
+    from x84.bbs.fileindex import get_root
+
+    log = logging.getLogger(__name__)
+
+    root = get_root()
+    if not os.path.isdir(root):
+        log.error('file area {0} not found, not indexed.'.format(root))
+        return
+
+    interval = get_ini(section='fileindex',
+                       key='interval',
+                       getter='getint'
+                       ) or 600
+
+    processes = get_ini(section='fileindex',
+                        key='processes',
+                        getter='getint'
+                        ) or multiprocessing.cpu_count()
+
+    if background_daemon:
+        scheduler.register('fileindex', index_area, args=(root, processes),
+                           interval=interval)
+        log.info('fileindex of {0} at {1}s intervals.'.format(root, interval))
+    else:
+        indexer(root, interval, processes)
+
+if __name__ == '__main__':
+    # index only the file area when executing this script directly.
+    import x84.bbs.ini
+    x84.bbs.ini.init(*cmdline.parse_args())
+
+    # do not execute indexer as a background thread.
+    main(background_daemon=False)
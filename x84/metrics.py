@@ -0,0 +1,270 @@
+"""
+Engine metrics and instrumentation for x/84.
+
+A small, process-local registry of counters, latency histograms and gauges.
+Counters and histograms are keyed by ``(name, label)``, where ``label`` is an
+optional string such as an event name or database schema.
+
+Session sub-processes keep their own registry, which is periodically
+reported to the engine with the ``metrics`` IPC event and merged by
+:func:`merge`.  The engine's registry is served by the ``metrics`` web
+module, :mod:`x84.webmodules.metrics`.
+
+Recording a value is a dictionary lookup and an integer increment under a
+single lock, so that instrumentation may be left enabled in production.
+"""
+# std imports
+import contextlib
+import threading
+import logging
+import bisect
+import time
+
+#: upper bounds (in seconds) of latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#: upper bounds (in bytes) of size histogram buckets
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+#: seconds elapsed between reports of session metrics to the engine
+REPORT_INTERVAL = 5.0
+
+_LOCK = threading.Lock()
+_COUNTERS = dict()
+_HISTOGRAMS = dict()
+_GAUGES = dict()
+_START_TIME = time.time()
+
+
+class Histogram(object):
+
+    """ Fixed-bucket histogram, suitable for latencies or sizes. """
+
+    __slots__ = ('buckets', 'counts', 'count', 'total', 'maximum')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        Class initializer.
+
+        :param tuple buckets: ascending upper bounds of each bucket; values
+                              greater than the last bound are counted in an
+                              implicit overflow bucket.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+
+    def observe(self, value):
+        """ Record a single ``value``. """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+
+    def percentile(self, pct):
+        """
+        Return estimated upper bound of percentile ``pct`` (0-100).
+
+        The estimate is the upper bound of the bucket containing the
+        requested rank, or :attr:`maximum` for the overflow bucket.
+        """
+        if not self.count:
+            return 0
+        rank = self.count * pct / 100.0
+        running = 0
+        for idx, num in enumerate(self.counts):
+            running += num
+            if running >= rank and num:
+                if idx < len(self.buckets):
+                    return min(self.buckets[idx], self.maximum)
+                break
+        return self.maximum
+
+    def to_dict(self):
+        """ Return histogram as a dictionary of plain types. """
+        return {'buckets': self.buckets,
+                'counts': self.counts[:],
+                'count': self.count,
+                'total': self.total,
+                'maximum': self.maximum}
+
+    @classmethod
+    def from_dict(cls, value):
+        """ Return new histogram instance from result of :meth:`to_dict`. """
+        hist = cls(buckets=value['buckets'])
+        hist.merge(value)
+        return hist
+
+    def merge(self, value):
+        """ Merge result of another histogram's :meth:`to_dict`. """
+        if tuple(value['buckets']) != self.buckets:
+            raise ValueError('bucket mismatch: {0!r} != {1!r}'
+                             .format(value['buckets'], self.buckets))
+        for idx, num in enumerate(value['counts']):
+            self.counts[idx] += num
+        self.count += value['count']
+        self.total += value['total']
+        self.maximum = max(self.maximum, value['maximum'])
+
+
+def incr(name, label=None, value=1):
+    """ Increment counter ``name`` (with optional ``label``) by ``value``. """
+    key = (name, label)
+    with _LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + value
+
+
+def observe(name, value, label=None, buckets=LATENCY_BUCKETS):
+    """ Record ``value`` into histogram ``name`` (with optional ``label``). """
+    key = (name, label)
+    with _LOCK:
+        hist = _HISTOGRAMS.get(key)
+        if hist is None:
+            hist = _HISTOGRAMS[key] = Histogram(buckets)
+        hist.observe(value)
+
+
+@contextlib.contextmanager
+def timed(name, label=None):
+    """ Context manager records elapsed time into histogram ``name``. """
+    stime = time.time()
+    try:
+        yield
+    finally:
+        observe(name, time.time() - stime, label)
+
+
+def register_gauge(name, func):
+    """
+    Register a gauge callback by ``name``.
+
+    ``func`` is called without arguments at the time of :func:`snapshot`,
+    and should return a number, or a dictionary of ``{label: number}``.
+    """
+    with _LOCK:
+        _GAUGES[name] = func
+
+
+def reset():
+    """
+    Discard all counters, histograms and gauges.
+
+    Called in a newly forked session sub-process, which would otherwise
+    inherit (and report twice) the values of the engine.
+    """
+    # pylint: disable=W0603
+    #         Using the global statement
+    global _START_TIME
+    with _LOCK:
+        _COUNTERS.clear()
+        _HISTOGRAMS.clear()
+        _GAUGES.clear()
+        _START_TIME = time.time()
+
+
+def collect(clear=False):
+    """
+    Return counters and histograms for transfer to another process.
+
+    :param bool clear: when True, counters and histograms are reset after
+                       collection, so that they may be sent as a delta.
+    :rtype: dict
+    """
+    with _LOCK:
+        result = {
+            'counters': _COUNTERS.items(),
+            'histograms': [(key, hist.to_dict())
+                           for key, hist in _HISTOGRAMS.items()],
+        }
+        if clear:
+            _COUNTERS.clear()
+            _HISTOGRAMS.clear()
+    return result
+
+
+def merge(data):
+    """ Merge the result of :func:`collect` from another process. """
+    with _LOCK:
+        for key, value in data.get('counters', ()):
+            key = tuple(key)
+            _COUNTERS[key] = _COUNTERS.get(key, 0) + value
+        for key, value in data.get('histograms', ()):
+            key = tuple(key)
+            if key in _HISTOGRAMS:
+                _HISTOGRAMS[key].merge(value)
+            else:
+                _HISTOGRAMS[key] = Histogram.from_dict(value)
+
+
+def snapshot():
+    """
+    Return all current metrics as a dictionary suitable for json.
+
+    :rtype: dict
+    """
+    log = logging.getLogger(__name__)
+
+    with _LOCK:
+        counters = _COUNTERS.items()
+        histograms = [(key, hist.to_dict())
+                      for key, hist in _HISTOGRAMS.items()]
+        gauges = _GAUGES.items()
+
+    result = {'uptime': time.time() - _START_TIME,
+              'counters': {},
+              'histograms': {},
+              'gauges': {}}
+
+    for (name, label), value in counters:
+        result['counters'].setdefault(name, {})[label or ''] = value
+
+    for (name, label), value in histograms:
+        hist = Histogram.from_dict(value)
+        value.update({'p50': hist.percentile(50),
+                      'p90': hist.percentile(90),
+                      'p99': hist.percentile(99)})
+        result['histograms'].setdefault(name, {})[label or ''] = value
+
+    for name, func in gauges:
+        try:
+            value = func()
+        # pylint: disable=W0703
+        #         Catching too general exception
+        except Exception as err:
+            # gauges inspect live engine structures from another thread,
+            # which may change size during iteration; skip this sample.
+            log.debug('gauge {0}: {1}'.format(name, err))
+            continue
+        if isinstance(value, dict):
+            result['gauges'][name] = dict(value)
+        else:
+            result['gauges'][name] = {'': value}
+
+    return result
+
+
+def format_text(data):
+    """ Return result of :func:`snapshot` as plain text, one per line. """
+    def fmt_name(name, label, suffix=''):
+        """ Return metric name with optional label. """
+        if label:
+            return '{0}{1}{{label="{2}"}}'.format(name, suffix, label)
+        return '{0}{1}'.format(name, suffix)
+
+    lines = ['uptime {0:0.3f}'.format(data['uptime'])]
+    for name, values in sorted(data['counters'].items()):
+        for label, value in sorted(values.items()):
+            lines.append('{0} {1}'.format(fmt_name(name, label), value))
+    for name, values in sorted(data['gauges'].items()):
+        for label, value in sorted(values.items()):
+            lines.append('{0} {1}'.format(fmt_name(name, label), value))
+    for name, values in sorted(data['histograms'].items()):
+        for label, value in sorted(values.items()):
+            for field in ('count', 'total', 'maximum', 'p50', 'p90', 'p99'):
+                lines.append('{0} {1}'.format(
+                    fmt_name(name, label, '_' + field), value[field]))
+    return '\n'.join(lines) + '\n'
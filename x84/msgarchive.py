@@ -0,0 +1,409 @@
+#!/usr/bin/env python2.7
+"""
+Message base archival for x/84.
+
+Messages are moved from the message base to database ``msgarchive`` once
+expired by the retention of their tags: older than ``max_age`` days, or not
+among the newest ``max_count`` messages of a tag.  Retention is configured
+for tags matching option ``tags`` of section ``[msgarchive]``, and for tags
+matching the pattern of a ``[msgarchive:<pattern>]`` section, whose options
+override those of ``[msgarchive]``::
+
+    [msgarchive]
+    enabled = yes
+    cron = 43 4 * * *
+    tags = *
+    max_age = 730
+
+    [msgarchive:fidonet]
+    max_age = 90
+    max_count = 5000
+
+    [msgarchive:announce]
+    max_age = 0
+
+A value of 0 does not expire messages, and messages of a tag without
+retention are kept.  A message is archived only once expired by the
+retention of each of its tags, other than tag ``public``, and never while
+queued for delivery to a message network.
+
+Archived messages are removed from the indices of tags, private messages
+and replies, from the subscription views and read messages of users, and
+from the translation indices of message networks.  Finally, the databases
+of the message base are compacted, while online, when enough of their
+space is free.  A database is compacted only when no larger than
+``compact_max_size`` megabytes (32), as writers to it wait while it is
+compacted, and fail after 5 seconds.  Larger databases may be compacted
+by ``sqlite3 <file> VACUUM`` while the board is stopped.
+"""
+# std imports
+import contextlib
+import datetime
+import logging
+import fnmatch
+import sqlite3
+import time
+import os
+
+# local
+from . import cmdline
+
+#: database of archived messages, keyed by message index and time saved
+ARCHIVE_DB = 'msgarchive'
+
+#: prefix of .ini sections configuring retention of tags
+SECTION_PREFIX = 'msgarchive:'
+
+#: messages archived or deleted by each transaction
+BATCH_SIZE = 500
+
+
+@contextlib.contextmanager
+def open_db(schema, table='unnamed'):
+    """
+    Open ``table`` of database ``schema`` for bulk commands.
+
+    Commands are committed together when the context exits, or by calling
+    ``commit()``, rather than by a transaction for each command as by
+    :class:`~x84.bbs.dbproxy.DBProxy`.
+    """
+    import sqlitedict
+    from x84.db import get_db_filepath, check_db
+    filepath = get_db_filepath(schema)
+    check_db(filepath)
+    dictdb = sqlitedict.SqliteDict(filename=filepath, tablename=table)
+    try:
+        yield dictdb
+        dictdb.commit()
+    finally:
+        dictdb.close()
+
+
+def get_retention():
+    """
+    Return retention of tags, as configured by the .ini file.
+
+    :returns: list of ``(pattern, max_age, max_count)``, those of
+              ``[msgarchive:<pattern>]`` sections first.
+    :rtype: list
+    """
+    from x84.bbs.ini import CFG, get_ini
+    max_age = get_ini('msgarchive', 'max_age', getter='getint') or 0
+    max_count = get_ini('msgarchive', 'max_count', getter='getint') or 0
+    retention = []
+    for section in CFG.sections():
+        if not section.startswith(SECTION_PREFIX):
+            continue
+        retention.append((
+            section[len(SECTION_PREFIX):],
+            (CFG.getint(section, 'max_age')
+             if CFG.has_option(section, 'max_age') else max_age),
+            (CFG.getint(section, 'max_count')
+             if CFG.has_option(section, 'max_count') else max_count)))
+    for pattern in get_ini('msgarchive', 'tags', split=True):
+        retention.append((pattern, max_age, max_count))
+    return retention
+
+
+def get_queued():
+    """ Return indices of messages queued for delivery to networks. """
+    from x84.bbs.ini import get_ini
+    from x84.bbs import DBProxy
+    queued = set()
+    for tag in filter(None, get_ini('msg', 'network_tags', split=True)):
+        queued.update(int(idx) for idx in DBProxy(
+            '{0}queues'.format(tag), use_session=False).keys())
+    return queued
+
+
+def find_expired(retention, now):
+    """
+    Return keys of messages expired by ``retention``.
+
+    Message records are read by a single pass of the message base.
+
+    :param list retention: as of :func:`get_retention`.
+    :param datetime.datetime now: current time.
+    :rtype: list
+    """
+    from x84.bbs.msgbase import MSGDB, TAGDB
+    from x84.bbs import DBProxy
+
+    rules = dict()
+
+    def get_rule(tag):
+        """ Return ``(max_age, max_count)`` of ``tag``, or None. """
+        if tag not in rules:
+            rules[tag] = next((
+                (max_age, max_count)
+                for pattern, max_age, max_count in retention
+                if fnmatch.fnmatch(tag, pattern)), None)
+        return rules[tag]
+
+    # messages of each tag exceeding its count, the oldest by index.
+    over_count = dict()
+    for tag, idxs in DBProxy(TAGDB, use_session=False).items():
+        rule = get_rule(tag)
+        if rule and rule[1] and len(idxs) > rule[1]:
+            over_count[tag] = set(sorted(idxs)[:-rule[1]])
+
+    queued = get_queued()
+    expired = list()
+    with open_db(MSGDB) as db_msg:
+        for key, msg in db_msg.iteritems():
+            if not msg.tags or msg.stime is None or msg.idx in queued:
+                continue
+            # tag 'public' is of each public message, its retention only
+            # applies to messages of no other tag.
+            for tag in (msg.tags - set([u'public'])) or msg.tags:
+                rule = get_rule(tag)
+                if rule is None or not (
+                        (rule[0] and msg.stime < now - datetime.timedelta(
+                            days=rule[0])) or
+                        msg.idx in over_count.get(tag, ())):
+                    break
+            else:
+                expired.append(key)
+    return expired
+
+
+def unlink_msgs(idxs):
+    """
+    Remove messages ``idxs`` from all indices of the message base.
+
+    :param set idxs: indices of messages.
+    """
+    # pylint: disable=R0914
+    #         Too many local variables
+    from x84.bbs.msgbase import (TAGDB, PRIVDB, THREADDB, TransIndex,
+                                 update_subscription_views)
+    from x84.bbs.userbase import USERDB
+    from x84.bbs.ini import get_ini
+    from x84.bbs import DBProxy
+
+    # tags and private messages, removing those now empty.
+    for schema in (TAGDB, PRIVDB):
+        dictdb = DBProxy(schema, use_session=False)
+        with dictdb:
+            updated, emptied = dict(), list()
+            for key, msgs in dictdb.items():
+                if msgs & idxs:
+                    if msgs - idxs:
+                        updated[key] = msgs - idxs
+                    else:
+                        emptied.append(key)
+            if updated:
+                dictdb.update(updated)
+            for key in emptied:
+                del dictdb[key]
+
+    update_subscription_views(deleted=idxs, use_session=False)
+
+    # reply graph, each table is written in turn, as only a single
+    # transaction of a database may write at once.  A thread whose latest
+    # message is archived is given the latest of those remaining, it is
+    # removed only when its first message is archived.
+    threads = dict((int(root), _latest) for root, _latest in
+                   DBProxy(THREADDB, 'threads', use_session=False).items())
+    latest = dict((root, root) for root, _latest in threads.items()
+                  if _latest in idxs and root not in idxs)
+    parents = set()
+    with open_db(THREADDB, 'nodes') as db_nodes:
+        for idx in idxs:
+            node = db_nodes.get('%d' % (idx,))
+            if node is not None:
+                parents.add(node[0])
+                del db_nodes['%d' % (idx,)]
+        if latest:
+            for key, (_, root) in db_nodes.iteritems():
+                if root in latest:
+                    latest[root] = max(latest[root], int(key))
+    with open_db(THREADDB, 'children') as db_children:
+        for idx in idxs:
+            if '%d' % (idx,) in db_children:
+                del db_children['%d' % (idx,)]
+        for parent in parents - idxs:
+            replies = db_children.get('%d' % (parent,))
+            if replies is not None:
+                db_children['%d' % (parent,)] = replies - idxs
+    with open_db(THREADDB, 'threads') as db_threads:
+        for root in set(threads) & idxs:
+            del db_threads['%d' % (root,)]
+        for root, _latest in latest.items():
+            db_threads['%d' % (root,)] = _latest
+
+    # read messages of users
+    db_attrs = DBProxy(USERDB, 'attrs', use_session=False)
+    with db_attrs:
+        updated = dict()
+        for handle, attrs in db_attrs.items():
+            if attrs.get('readmsgs', set()) & idxs:
+                attrs['readmsgs'] = attrs['readmsgs'] - idxs
+                updated[handle] = attrs
+        if updated:
+            db_attrs.update(updated)
+
+    # translation indices of message networks, and message sources of
+    # networks we host.
+    server_tags = filter(None, get_ini('msg', 'server_tags', split=True))
+    for tag in filter(None, get_ini('msg', 'network_tags', split=True)
+                      ) + server_tags:
+        schema = '{0}trans'.format(tag)
+        # ensure reverse table of earlier versions is built
+        TransIndex(tag, use_session=False)
+        net_ids = list()
+        with open_db(schema, 'local') as by_local:
+            for idx in idxs:
+                net_id = by_local.get(str(idx))
+                if net_id is not None:
+                    net_ids.append(net_id)
+                    del by_local[str(idx)]
+        with open_db(schema) as by_network:
+            for net_id in net_ids:
+                if str(net_id) in by_network:
+                    del by_network[str(net_id)]
+        if tag in server_tags:
+            with open_db('{0}source'.format(tag)) as db_source:
+                for idx in idxs:
+                    if str(idx) in db_source:
+                        del db_source[str(idx)]
+
+
+def get_archive_key(msg):
+    """
+    Return key of message ``msg`` in the archive.
+
+    Keyed by both index and time saved, so that a message of an index
+    reused by an earlier version does not replace the one archived.
+    """
+    return '{0}-{1}'.format(msg.idx, msg.stime.strftime('%Y%m%d%H%M%S%f'))
+
+
+def archive(now=None):
+    """
+    Move messages expired by their retention to the archive.
+
+    Messages are first stored by the archive, then removed from all
+    indices, and finally deleted from the message base, so that an
+    interrupted run is completed by the next.  The index of the next
+    message saved is recorded beforehand, so that the indices of those
+    archived are not reused, see :func:`x84.bbs.msgbase.allocate_idx`.
+
+    :returns: number of messages archived.
+    :rtype: int
+    """
+    from x84.bbs.msgbase import MSGDB, allocate_idx
+    from x84.bbs import DBProxy
+    log = logging.getLogger(__name__)
+    retention = get_retention()
+    if not retention:
+        return 0
+
+    expired = find_expired(retention, now or datetime.datetime.now())
+    if not expired:
+        return 0
+
+    with DBProxy(MSGDB, use_session=False) as db_msg:
+        allocate_idx(db_msg, count=0, use_session=False)
+
+    batches = [expired[start:start + BATCH_SIZE]
+               for start in range(0, len(expired), BATCH_SIZE)]
+    with open_db(MSGDB) as db_msg, open_db(ARCHIVE_DB) as db_archive:
+        for batch in batches:
+            records = dict()
+            for key in batch:
+                msg = db_msg.get(key)
+                if msg is not None:
+                    records[get_archive_key(msg)] = msg
+            db_archive.update(records)
+            db_archive.commit()
+
+    unlink_msgs(set(int(key) for key in expired))
+
+    with open_db(MSGDB) as db_msg:
+        for batch in batches:
+            for key in batch:
+                if key in db_msg:
+                    del db_msg[key]
+            db_msg.commit()
+    log.info('archived {0} messages.'.format(len(expired)))
+    return len(expired)
+
+
+def compact():
+    """ Compact databases of the message base, when enough space is free. """
+    from x84.bbs.msgbase import MSGDB, TAGDB, PRIVDB, THREADDB, VIEWDB
+    from x84.bbs.userbase import USERDB
+    from x84.bbs.ini import get_ini
+    from x84.db import compact_db, get_db_filepath
+    log = logging.getLogger(__name__)
+    max_size = (get_ini('msgarchive', 'compact_max_size', getter='getint')
+                or 32) * 1024 * 1024
+    schemas = [MSGDB, TAGDB, PRIVDB, THREADDB, VIEWDB, USERDB]
+    for tag in filter(None, get_ini('msg', 'network_tags', split=True)):
+        schemas.append('{0}trans'.format(tag))
+    for tag in filter(None, get_ini('msg', 'server_tags', split=True)):
+        schemas.extend(['{0}trans'.format(tag), '{0}source'.format(tag)])
+
+    for schema in schemas:
+        filepath = get_db_filepath(schema)
+        if os.path.exists(filepath) and os.path.getsize(filepath) > max_size:
+            log.info('{0} not compacted, larger than compact_max_size.'
+                     .format(schema))
+            continue
+        try:
+            reclaimed = compact_db(schema, max_size=max_size)
+        except sqlite3.OperationalError as err:
+            log.warn('{0} not compacted: {1}'.format(schema, err))
+            continue
+        if reclaimed:
+            log.info('{0} compacted, {1} bytes reclaimed.'
+                     .format(schema, reclaimed))
+
+
+def archive_msgbase():
+    """ Archive expired messages and compact the message base. """
+    log = logging.getLogger(__name__)
+    stime = time.time()
+    try:
+        archive()
+        compact()
+    except Exception as err:  # pylint: disable=W0703
+        log.exception('message archival failed: {0}'.format(err))
+    log.debug('message archival completed in {0:0.2f}s'
+              .format(time.time() - stime))
+
+
+def main(background_daemon=True):
+    """
+    Entry point to begin archival of the message base.
+
+    Called by x84/engine.py, function main(), to register a job of
+    :mod:`x84.scheduler`, run by a sub-process of the scheduler.
+
+    :param bool background_daemon: When True (default), this function returns
+                and the message base is archived by job ``msgarchive`` of
+                the scheduler.  Otherwise, the message base is archived
+                once.
+    :rtype: None
+    """
+    from x84.bbs.ini import get_ini
+    from x84 import scheduler
+
+    log = logging.getLogger(__name__)
+
+    cron = get_ini(section='msgarchive', key='cron') or '43 4 * * *'
+
+    if background_daemon:
+        scheduler.register('msgarchive', archive_msgbase, cron=cron)
+        log.info('msgarchive scheduled at {0}.'.format(cron))
+    else:
+        archive_msgbase()
+
+if __name__ == '__main__':
+    # archive only the message base when executing this script directly.
+    import x84.bbs.ini
+    x84.bbs.ini.init(*cmdline.parse_args())
+
+    # do not schedule archival as a job.
+    main(background_daemon=False)
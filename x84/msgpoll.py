@@ -1,7 +1,29 @@
 #!/usr/bin/env python2.7
-""" x84net message poll for x/84. """
+"""
+x84net message poll for x/84.
+
+Each network is polled by its own thread, so that a slow or unreachable
+hub does not delay the others, and by a keep-alive HTTP session for all
+requests of a poll.  Messages are published in batches of up to
+``push_batch_size`` messages by each request, by up to ``push_concurrency``
+concurrent requests, a reply only once its parent has been published.  A
+hub not accepting batches is sent one message by each request.
+
+When a network cannot be polled, further polls of it are delayed by
+``backoff_base`` seconds, doubled by each consecutive failure up to
+``backoff_max``.  A message rejected by the hub, such as by ``400 Bad
+Request``, is not a failure of the network; it remains queued, and is
+discarded once rejected by ``push_max_rejects`` polls.
+These options are of section ``[msg]``.
+
+A poll finding no new messages records the ``ETag`` of its response, sent
+as ``If-None-Match`` by the next poll, answered ``304 Not Modified`` by a
+hub having no new messages.
+"""
 
 # std imports
+from multiprocessing.pool import ThreadPool
+import threading
 import logging
 import hashlib
 import time
@@ -15,6 +37,24 @@ from . import cmdline
 import requests
 
 
+#: database of polling state, by network name
+POLL_DB = 'msgpoll'
+
+#: table of POLL_DB, ``(url, etag)`` of last empty response by network name
+ETAG_TABLE = 'etag'
+
+#: table of POLL_DB, number of rejections of each queued message, keyed by
+#: network name and message index.
+REJECT_TABLE = 'rejected'
+
+#: result of pushing a message rejected by the hub, rather than undelivered.
+REJECTED = object()
+
+#: http status codes of a message rejected by the hub, others, such as
+#: 401 Unauthorized, are of the network and not of any message.
+REJECT_STATUS = (400, 409, 413, 422)
+
+
 def get_token(network):
     """ get token for authentication """
     tm_value = int(time.time())
@@ -41,14 +81,20 @@ def prepare_message(msg, network, parent):
 
 def pull_rest(net, last_msg_id):
     """ pull messages for a given network newer than the 'last' message idx """
+    from x84.bbs import DBProxy
     url = '%smessages/%s/%s' % (net['url_base'], net['name'], last_msg_id)
 
     log = logging.getLogger(__name__)
 
+    etagdb = DBProxy(POLL_DB, table=ETAG_TABLE, use_session=False)
+    headers = {'Auth-X84net': get_token(net)}
+    etag_url, etag = etagdb.get(net['name'], (None, None))
+    if etag_url == url:
+        headers['If-None-Match'] = etag
+
     try:
-        req = requests.get(url,
-                           headers={'Auth-X84net': get_token(net)},
-                           verify=net['verify'])
+        req = net.get('session', requests).get(
+            url, headers=headers, verify=net['verify'])
     except requests.ConnectionError as err:
         log.warn('[{net[name]}] ConnectionError in pull_rest: {err}'
                  .format(net=net, err=err))
@@ -58,6 +104,9 @@ def pull_rest(net, last_msg_id):
                       .format(net=net, err=err))
         return False
 
+    if req.status_code == 304:
+        return []
+
     if req.status_code != 200:
         log.error('[{net[name]}] HTTP error, code={req.status_code}'
                   .format(net=net, req=req))
@@ -65,15 +114,27 @@ def pull_rest(net, last_msg_id):
 
     try:
         response = json.loads(req.text)
-        return response['messages'] if response['response'] else []
+        msgs = response['messages'] if response['response'] else []
     except Exception as err:
         log.exception('[{net[name]}] JSON error: {err}'
                       .format(net=net, err=err))
         return False
 
+    # a response with messages advances the cursor, and so its url; only
+    # the etag of an empty response is of use to the next poll.
+    if not msgs and req.headers.get('ETag'):
+        with etagdb:
+            etagdb[net['name']] = (url, req.headers['ETag'])
+    return msgs
+
 
 def push_rest(net, msg, parent):
-    """ push message for a given network and append an origin line """
+    """
+    push message for a given network and append an origin line
+
+    :returns: network message id, :data:`REJECTED` when rejected by the
+              hub, or False when not delivered.
+    """
     msg_data = prepare_message(msg, net, parent)
     url = '{net[url_base]}messages/{net[name]}/'.format(net=net)
     data = {'message': json.dumps(msg_data)}
@@ -81,10 +142,9 @@ def push_rest(net, msg, parent):
     log = logging.getLogger(__name__)
 
     try:
-        req = requests.put(url,
-                           headers={'Auth-X84net': get_token(net)},
-                           data=data,
-                           verify=net['verify'])
+        req = net.get('session', requests).put(
+            url, headers={'Auth-X84net': get_token(net)},
+            data=data, verify=net['verify'])
     except Exception as err:
         log.exception('[{net[name]}] exception in push_rest: {err}'
                       .format(net=net, err=err))
@@ -93,17 +153,69 @@ def push_rest(net, msg, parent):
     if req.status_code not in (200, 201):
         log.error('{net[name]} HTTP error, code={req.status_code}'
                   .format(net=net, req=req))
-        return False
+        return REJECTED if req.status_code in REJECT_STATUS else False
 
     try:
         response = json.loads(req.text)
     except Exception as err:
         log.exception('[{net[name]}] JSON error: {err}'
                       .format(net=net, err=err))
-    else:
-        if response['response'] and 'id' in response:
-            return response['id']
-    return False
+        return False
+    if response['response'] and 'id' in response:
+        return response['id']
+    log.error('[{net[name]}] message rejected: {message}'
+              .format(net=net, message=response.get('message')))
+    return REJECTED
+
+
+def push_rest_batch(net, items):
+    """
+    push batch of messages for a given network, each with an origin line.
+
+    :param list items: sequence of ``(msg, parent)``.
+    :returns: network message id of each message, :data:`REJECTED` for each
+              message rejected, or False for each message not delivered;
+              None when the hub does not accept batches of messages.
+    :rtype: list
+    """
+    msgs_data = [prepare_message(msg, net, parent) for msg, parent in items]
+    url = '{net[url_base]}messages/{net[name]}/'.format(net=net)
+    data = {'messages': json.dumps(msgs_data)}
+
+    log = logging.getLogger(__name__)
+
+    try:
+        req = net.get('session', requests).put(
+            url, headers={'Auth-X84net': get_token(net)},
+            data=data, verify=net['verify'])
+    except Exception as err:
+        log.exception('[{net[name]}] exception in push_rest_batch: {err}'
+                      .format(net=net, err=err))
+        return [False] * len(items)
+
+    if req.status_code not in (200, 201):
+        log.warn('[{net[name]}] batch not accepted, code={req.status_code}'
+                 ', publishing messages one at a time.'
+                 .format(net=net, req=req))
+        return None
+
+    try:
+        results = json.loads(req.text)['results']
+        assert len(results) == len(items), ('mismatched results', results)
+    except Exception as err:
+        log.exception('[{net[name]}] JSON error: {err}'
+                      .format(net=net, err=err))
+        return [False] * len(items)
+
+    trans_ids = list()
+    for result in results:
+        if result.get('response') and 'id' in result:
+            trans_ids.append(result['id'])
+        else:
+            log.error('[{net[name]}] message rejected: {message}'
+                      .format(net=net, message=result.get('message')))
+            trans_ids.append(REJECTED)
+    return trans_ids
 
 
 def get_networks():
@@ -156,10 +268,98 @@ def get_networks():
             else:
                 net['verify'] = ca_path
 
+        net['push_concurrency'] = get_ini(
+            section='msg', key='push_concurrency', getter='getint') or 4
+        net['push_batch_size'] = get_ini(
+            section='msg', key='push_batch_size', getter='getint') or 50
+        net['backoff_base'] = get_ini(
+            section='msg', key='backoff_base', getter='getint') or 60
+        net['backoff_max'] = get_ini(
+            section='msg', key='backoff_max', getter='getint') or 3600
+        net['push_max_rejects'] = get_ini(
+            section='msg', key='push_max_rejects', getter='getint') or 3
+
         networks.append(net)
     return networks
 
 
+def get_session(net):
+    """ Return keep-alive :class:`requests.Session` for network ``net``. """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1, pool_maxsize=net['push_concurrency'])
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_retry_after(net):
+    """ Return time before which network ``net`` is not polled. """
+    from x84.bbs import DBProxy
+    polldb = DBProxy(POLL_DB, use_session=False)
+    return polldb.get(net['name'], dict()).get('retry_after', 0)
+
+
+def record_poll(net, success):
+    """
+    Record result of poll of network ``net``.
+
+    A failure delays the next poll by ``backoff_base`` seconds, doubled
+    for each consecutive failure, up to ``backoff_max`` seconds.
+    """
+    from x84.bbs import DBProxy
+    log = logging.getLogger(__name__)
+    polldb = DBProxy(POLL_DB, use_session=False)
+    with polldb:
+        state = polldb.get(net['name'], {'failures': 0, 'retry_after': 0})
+        if success:
+            if not state['failures']:
+                return
+            state = {'failures': 0, 'retry_after': 0}
+        else:
+            state['failures'] += 1
+            delay = min(net['backoff_base'] * 2 ** (state['failures'] - 1),
+                        net['backoff_max'])
+            state['retry_after'] = time.time() + delay
+            log.warn('[{net[name]}] poll failed {num} times, retry in '
+                     '{delay}s.'.format(net=net, num=state['failures'],
+                                        delay=delay))
+        polldb[net['name']] = state
+
+
+def record_rejected(net, rejected, published):
+    """
+    Record messages of network ``net`` rejected by the hub.
+
+    A message rejected by ``push_max_rejects`` polls is removed from the
+    queue of the network.
+
+    :param list rejected: indices of messages rejected by this poll.
+    :param list published: indices of messages published by this poll.
+    """
+    from x84.bbs import DBProxy
+    log = logging.getLogger(__name__)
+    rejectdb = DBProxy(POLL_DB, table=REJECT_TABLE, use_session=False)
+    queuedb = DBProxy('{0}queues'.format(net['name']), use_session=False)
+    with rejectdb:
+        counts = rejectdb.get(net['name'], dict())
+        for msg_id in published:
+            counts.pop(msg_id, None)
+        for msg_id in rejected:
+            counts[msg_id] = counts.get(msg_id, 0) + 1
+            if counts[msg_id] >= net['push_max_rejects']:
+                log.error('[{net[name]}] Message rejected {num} times, '
+                          'removed from queue (msg_id={msg_id})'
+                          .format(net=net, num=counts[msg_id],
+                                  msg_id=msg_id))
+                with queuedb:
+                    if msg_id in queuedb:
+                        del queuedb[msg_id]
+                del counts[msg_id]
+        if counts or net['name'] in rejectdb:
+            rejectdb[net['name']] = counts
+
+
 def get_last_msg_id(last_file):
     """ Get the "last message id" by data file ``last_file``. """
     # TODO(jquast): This should have been done internally (and far
@@ -185,9 +385,14 @@ def get_last_msg_id(last_file):
 
 
 def poll_network_for_messages(net):
-    """ Poll for new messages of network, ``net``. """
-    from x84.bbs import Msg, DBProxy
-    from x84.bbs.msgbase import to_localtime
+    """
+    Poll for new messages of network, ``net``.
+
+    :returns: False when messages could not be retrieved.
+    :rtype: bool
+    """
+    from x84.bbs import Msg
+    from x84.bbs.msgbase import to_localtime, TransIndex
 
     log = logging.getLogger(__name__)
 
@@ -198,19 +403,20 @@ def poll_network_for_messages(net):
     except (OSError, IOError) as err:
         log.error('[{net[name]}] skipping network: {err}'
                   .format(net=net, err=err))
-        return
+        return False
 
     msgs = pull_rest(net=net, last_msg_id=last_msg_id)
 
-    if msgs:
+    if msgs is False:
+        return False
+    elif msgs:
         log.info('[{net[name]}] Retrieved {num} messages.'
                  .format(net=net, num=len(msgs)))
     else:
         log.debug('[{net[name]}] No messages.'.format(net=net))
-        return
+        return True
 
-    transdb = DBProxy('{0}trans'.format(net['name']), use_session=False)
-    transkeys = transdb.keys()
+    transdb = TransIndex(net['name'], use_session=False)
     msgs = sorted(msgs, cmp=lambda x, y: cmp(int(x['id']), int(y['id'])))
 
     # store messages locally, saving their translated IDs to the transdb
@@ -228,15 +434,14 @@ def poll_network_for_messages(net):
                      "adding 'public' tag".format(net=net, msg=msg))
             store_msg.tags.add(u'public')
 
-        if (msg['parent'] is not None and
-                str(msg['parent']) not in transkeys):
-            log.warn('[{net[name]}] No such parent message ({msg[parent]}, '
-                     'msg_id={msg[id]}), removing reference.'
-                     .format(net=net, msg=msg))
-        elif msg['parent'] is not None:
-            store_msg.parent = int(transdb[msg['parent']])
+        if msg['parent'] is not None:
+            store_msg.parent = transdb.get_local(msg['parent'])
+            if store_msg.parent is None:
+                log.warn('[{net[name]}] No such parent message '
+                         '({msg[parent]}, msg_id={msg[id]}), removing '
+                         'reference.'.format(net=net, msg=msg))
 
-        if msg['id'] in transkeys:
+        if msg['id'] in transdb:
             log.warn('[{net[name]}] dupe (msg_id={msg[id]}) discarded.'
                      .format(net=net, msg=msg))
         else:
@@ -244,8 +449,7 @@ def poll_network_for_messages(net):
             # it from the network, set send_net=False
             store_msg.save(send_net=False, ctime=to_localtime(msg['ctime']))
             with transdb:
-                transdb[msg['id']] = store_msg.idx
-            transkeys.append(msg['id'])
+                transdb.add(net_id=msg['id'], idx=store_msg.idx)
             log.info('[{net[name]}] Processed (msg_id={msg[id]}) => {new_id}'
                      .format(net=net, msg=msg, new_id=store_msg.idx))
 
@@ -256,23 +460,33 @@ def poll_network_for_messages(net):
         with open(net['last_file'], 'w') as last_fp:
             last_fp.write(str(net['last']))
 
-    return
+    return True
 
 
 def publish_network_messages(net):
-    """ Push messages to network, ``net``. """
+    """
+    Push messages to network, ``net``.
+
+    Messages are pushed in batches, by up to ``push_concurrency``
+    concurrent requests, in rounds, so that a reply is pushed only after
+    its parent, whose network message id it refers to.
+
+    :returns: False when any message could not be delivered, but not for
+              messages rejected by the hub.
+    :rtype: bool
+    """
     from x84.bbs import DBProxy
-    from x84.bbs.msgbase import format_origin_line, MSGDB
+    from x84.bbs.msgbase import format_origin_line, MSGDB, TransIndex
 
     log = logging.getLogger(__name__)
 
     log.debug(u'[{net[name]}] publishing new messages.'.format(net=net))
 
     queuedb = DBProxy('{0}queues'.format(net['name']), use_session=False)
-    transdb = DBProxy('{0}trans'.format(net['name']), use_session=False)
+    transdb = TransIndex(net['name'], use_session=False)
     msgdb = DBProxy(MSGDB, use_session=False)
 
-    # publish each message
+    pending = list()
     for msg_id in sorted(queuedb.keys(),
                          cmp=lambda x, y: cmp(int(x), int(y))):
         if msg_id not in msgdb:
@@ -280,73 +494,178 @@ def publish_network_messages(net):
                      .format(net=net, msg_id=msg_id))
             del queuedb[msg_id]
             continue
+        pending.append((msg_id, msgdb[msg_id]))
+
+    if not pending:
+        return True
+
+    def push(batch):
+        """ Push batch of ``(msg_id, msg, trans_parent)``. """
+        trans_ids = None
+        if len(batch) > 1 and net.get('batch', True):
+            trans_ids = push_rest_batch(
+                net=net, items=[(msg, parent) for _, msg, parent in batch])
+            if trans_ids is None:
+                net['batch'] = False
+        if trans_ids is None:
+            trans_ids = [push_rest(net=net, msg=msg, parent=parent)
+                         for _, msg, parent in batch]
+        return [(msg_id, msg, trans_id)
+                for (msg_id, msg, _), trans_id in zip(batch, trans_ids)]
+
+    success = True
+    rejected, published_ids = list(), list()
+    pool = ThreadPool(processes=min(net['push_concurrency'], len(pending)))
+    try:
+        while pending:
+            # a reply waits for a later round when its parent is queued.
+            queued = set(int(msg_id) for msg_id, _ in pending)
+            ready = [(msg_id, msg) for msg_id, msg in pending
+                     if msg.parent not in queued]
+            pending = [(msg_id, msg) for msg_id, msg in pending
+                       if msg.parent in queued]
+            if not ready:
+                # not expected, parents are always older than replies.
+                ready, pending = pending, []
+
+            items = list()
+            for msg_id, msg in ready:
+                trans_parent = None
+                if msg.parent is not None:
+                    trans_parent = transdb.get_network(msg.parent)
+                    if trans_parent is None:
+                        log.warn('[{net[name]}] Parent ID {msg.parent} '
+                                 'not in translation-DB (msg_id={msg_id})'
+                                 .format(net=net, msg=msg, msg_id=msg_id))
+                items.append((msg_id, msg, trans_parent))
+
+            size = net['push_batch_size']
+            batches = [items[idx:idx + size]
+                       for idx in range(0, len(items), size)]
+            failed = set()
+            for results in pool.imap(push, batches):
+                published = list()
+                for msg_id, msg, trans_id in results:
+                    if trans_id is REJECTED:
+                        log.error('[{net[name]}] Message rejected '
+                                  '(msg_id={msg_id})'
+                                  .format(net=net, msg_id=msg_id))
+                        failed.add(int(msg_id))
+                        rejected.append(msg_id)
+                        continue
+                    if trans_id is False:
+                        log.error('[{net[name]}] Message not posted '
+                                  '(msg_id={msg_id})'
+                                  .format(net=net, msg_id=msg_id))
+                        failed.add(int(msg_id))
+                        success = False
+                        continue
+
+                    if trans_id in transdb:
+                        log.error('[{net[name]}] trans_id={trans_id} '
+                                  'conflicts with (msg_id={msg_id})'
+                                  .format(net=net, trans_id=trans_id,
+                                          msg_id=msg_id))
+                        with queuedb:
+                            del queuedb[msg_id]
+                        continue
+
+                    # transform, and possibly duplicate(?) message ..
+                    msg.body = u''.join((msg.body, format_origin_line()))
+                    published.append((msg_id, msg, trans_id))
+
+                if not published:
+                    continue
+                with transdb, msgdb, queuedb:
+                    transdb.add_many((trans_id, msg_id)
+                                     for msg_id, _, trans_id in published)
+                    msgdb.update(dict((msg_id, msg)
+                                      for msg_id, msg, _ in published))
+                    for msg_id, _, _ in published:
+                        del queuedb[msg_id]
+                published_ids.extend(msg_id for msg_id, _, _ in published)
+                for msg_id, _, trans_id in published:
+                    log.info('[{net[name]}] Published (msg_id={msg_id}) => '
+                             '{trans_id}'.format(net=net, msg_id=msg_id,
+                                                 trans_id=trans_id))
+
+            # replies of messages not posted, and replies of those, remain
+            # queued for next poll.
+            while True:
+                dropped = set(int(msg_id) for msg_id, msg in pending
+                              if msg.parent in failed)
+                if not dropped:
+                    break
+                failed.update(dropped)
+                pending = [(msg_id, msg) for msg_id, msg in pending
+                           if int(msg_id) not in dropped]
+    finally:
+        pool.close()
+        pool.join()
+    record_rejected(net, rejected, published_ids)
+    return success
+
+
+def poll_network(net):
+    """
+    Poll and publish to network ``net``, unless delayed by failures.
 
-        msg = msgdb[msg_id]
-
-        trans_parent = None
-        if msg.parent is not None:
-            matches = [key for key, data in transdb.items()
-                       if int(data) == msg.parent]
-
-            if len(matches) > 0:
-                trans_parent = matches[0]
-            else:
-                log.warn('[{net[name]}] Parent ID {msg.parent} '
-                         'not in translation-DB (msg_id={msg_id})'
-                         .format(net=net, msg=msg, msg_id=msg_id))
-
-        trans_id = push_rest(net=net, msg=msg, parent=trans_parent)
-        if trans_id is False:
-            log.error('[{net[name]}] Message not posted (msg_id={msg_id})'
-                      .format(net=net, msg_id=msg_id))
-            continue
-
-        if trans_id in transdb.keys():
-            log.error('[{net[name]}] trans_id={trans_id} conflicts with '
-                      '(msg_id={msg_id})'
-                      .format(net=net, trans_id=trans_id, msg_id=msg_id))
-            with queuedb:
-                del queuedb[msg_id]
-            continue
+    Target of each thread of :func:`do_poll`.
+    """
+    log = logging.getLogger(__name__)
+    retry_after = get_retry_after(net)
+    if time.time() < retry_after:
+        log.debug('[{net[name]}] poll delayed for {0:0.0f}s.'
+                  .format(retry_after - time.time(), net=net))
+        return
 
-        # transform, and possibly duplicate(?) message ..
-        with transdb, msgdb, queuedb:
-            transdb[trans_id] = msg_id
-            msg.body = u''.join((msg.body, format_origin_line()))
-            msgdb[msg_id] = msg
-            del queuedb[msg_id]
-        log.info('[{net[name]}] Published (msg_id={msg_id}) => {trans_id}'
-                 .format(net=net, msg_id=msg_id, trans_id=trans_id))
+    net['session'] = get_session(net)
+    try:
+        success = (poll_network_for_messages(net) and
+                   publish_network_messages(net))
+    except Exception as err:  # pylint: disable=W0703
+        log.exception('[{net[name]}] poll failed: {err}'
+                      .format(net=net, err=err))
+        success = False
+    finally:
+        net.pop('session').close()
+    record_poll(net, success)
 
 
-def poller(poll_interval):
-    """ Blocking function periodically polls configured message networks. """
+def poll():
+    """ Poll and publish to configured message networks once. """
     log = logging.getLogger(__name__)
 
     # get all networks
     networks = get_networks()
 
     if networks:
-        while True:
-            do_poll(networks)
-            time.sleep(poll_interval)
+        do_poll(networks)
     else:
         log.error(u'No networks configured for poll/publish.')
 
 
+def poller(poll_interval):
+    """ Blocking function periodically polls configured message networks. """
+    while True:
+        poll()
+        time.sleep(poll_interval)
+
+
 def main(background_daemon=True):
     """
     Entry point to configure and begin network message polling.
 
-    Called by x84/engine.py, function main() as unmanaged thread.
+    Called by x84/engine.py, function main(), to register a job of
+    :mod:`x84.scheduler`.
 
     :param bool background_daemon: When True (default), this function returns
-                and web modules are served in an unmanaged, background (daemon)
-                thread.  Otherwise, function call to ``main()`` is blocking.
+                and networks are polled by job ``msgpoll`` of the scheduler.
+                Otherwise, function call to ``main()`` is blocking.
     :rtype: None
     """
-    from threading import Thread
     from x84.bbs.ini import get_ini
+    from x84 import scheduler
 
     log = logging.getLogger(__name__)
 
@@ -356,10 +675,8 @@ def main(background_daemon=True):
                             ) or 1984
 
     if background_daemon:
-        t = Thread(target=poller, args=(poll_interval,))
-        t.daemon = True
+        scheduler.register('msgpoll', poll, interval=poll_interval)
         log.info('msgpoll at {0}s intervals.'.format(poll_interval))
-        t.start()
     else:
         poller(poll_interval)
 
@@ -368,13 +685,16 @@ def do_poll(networks):
     """
     Message polling process.
 
-    Function is called periodically by :func:`poller`.
+    Function is called periodically by :func:`poll`.  Each network is
+    pulled-from and published-to concurrently, by a thread of each.
     """
-    # pull-from all networks
-    map(poll_network_for_messages, networks)
-
-    # publish-to all networks
-    map(publish_network_messages, networks)
+    threads = [threading.Thread(target=poll_network, args=(net,),
+                                name='msgpoll-{0}'.format(net['name']))
+               for net in networks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
 
 if __name__ == '__main__':
     # load only message polling module when executing this script directly.
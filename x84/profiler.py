@@ -0,0 +1,200 @@
+"""
+Statistical sampling profiler for x/84.
+
+A background thread samples the stack of every thread of the current
+process at a fixed interval, aggregating identical stacks.  The result is
+saved as a "collapsed stack" file, one stack per line, frames separated
+by semicolons and followed by a count of samples::
+
+    MainThread;main (engine.py:39);_loop (engine.py:521) 42
+
+Such files may be given directly to flamegraph tools, such as
+``flamegraph.pl`` or speedscope.
+
+A profile is started or stopped by the ``profile`` IPC event, with data
+of ``(target, action, duration)``:
+
+- ``target`` is one of ``'engine'``, ``'web'``, the name of a job of
+  :mod:`x84.scheduler` such as ``'msgpoll'``, or the session-id of a
+  connected session.
+- ``action`` is ``'start'`` or ``'stop'``.
+- ``duration`` is the number of seconds to sample when started, after
+  which the profile is saved automatically.
+
+A job is profiled by the sub-process of its next run, sampling all of its
+threads until the run completes or ``duration`` elapses.
+
+Profiles are saved to the ``profile`` sub-folder of ``[system]`` option
+``datapath``.
+"""
+# std imports
+import threading
+import logging
+import time
+import sys
+import os
+
+#: seconds between each sample
+SAMPLE_INTERVAL = 0.01
+
+#: default number of seconds to sample, when unspecified.
+DEFAULT_DURATION = 30
+
+#: thread names sampled for each profile target of an engine service; the
+#: ``engine`` target samples all threads not matched by another target.
+#: Target ``web`` is sampled by the web server process.
+TARGET_THREADS = {
+    'web': ('webserve', 'CP Server'),
+}
+
+#: the current profiler of this process, if any.
+_SAMPLER = None
+_LOCK = threading.Lock()
+
+
+def format_frame(frame):
+    """ Return label of stack ``frame`` for collapsed-stack output. """
+    code = frame.f_code
+    return '{0} ({1}:{2})'.format(code.co_name,
+                                  os.path.basename(code.co_filename),
+                                  code.co_firstlineno)
+
+
+def thread_matches(target, thread_name):
+    """ Whether thread by name ``thread_name`` belongs to ``target``. """
+    def matches(prefixes):
+        """ Whether thread name begins with any of ``prefixes``. """
+        return any(thread_name.startswith(prefix) for prefix in prefixes)
+
+    if target in TARGET_THREADS:
+        return matches(TARGET_THREADS[target])
+    if target == 'engine':
+        return not any(matches(prefixes)
+                       for prefixes in TARGET_THREADS.values())
+    # a session target samples every thread of its own process.
+    return True
+
+
+class Sampler(threading.Thread):
+
+    """ Thread samples stacks of all other threads until stopped. """
+
+    def __init__(self, target, duration=DEFAULT_DURATION,
+                 interval=SAMPLE_INTERVAL):
+        """
+        Class initializer.
+
+        :param str target: profile target, see :func:`thread_matches`.
+        :param float duration: seconds to sample before stopping.
+        :param float interval: seconds between each sample.
+        """
+        threading.Thread.__init__(self, name='profiler')
+        self.daemon = True
+        self.log = logging.getLogger(__name__)
+        self.target = target
+        self.duration = duration
+        self.interval = interval
+        self.stacks = dict()
+        self.num_samples = 0
+        self.stopped = threading.Event()
+
+    def sample(self):
+        """ Sample stacks of all matching threads once. """
+        names = dict((thread.ident, thread.name)
+                     for thread in threading.enumerate())
+        # pylint: disable=W0212
+        #         Access to a protected member _current_frames
+        for ident, frame in sys._current_frames().items():
+            name = names.get(ident, 'thread-{0}'.format(ident))
+            if ident == self.ident or not thread_matches(self.target, name):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(format_frame(frame))
+                frame = frame.f_back
+            stack.append(name)
+            key = ';'.join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.num_samples += 1
+
+    def run(self):
+        """ Sample until stopped or duration has elapsed, then save. """
+        stime = time.time()
+        while not self.stopped.is_set():
+            if self.duration and time.time() - stime > self.duration:
+                break
+            self.sample()
+            self.stopped.wait(self.interval)
+        self.save()
+
+    def stop(self):
+        """ Signal sampling to stop; the profile is saved on exit. """
+        self.stopped.set()
+
+    def save(self):
+        """ Save collapsed stacks to ``profile`` folder of datapath. """
+        from x84.bbs.ini import get_ini
+        folder = os.path.join(
+            os.path.expanduser(get_ini('system', 'datapath')), 'profile')
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        filepath = os.path.join(folder, '{0}-{1}-{2}.folded'.format(
+            self.target.replace(os.path.sep, '_'), os.getpid(),
+            time.strftime('%Y%m%d-%H%M%S')))
+        with open(filepath, 'w') as out_fp:
+            for stack, count in sorted(self.stacks.items()):
+                out_fp.write('{0} {1}\n'.format(stack, count))
+        self.log.info('profile of {0}: {1} samples saved to {2}'
+                      .format(self.target, self.num_samples, filepath))
+        return filepath
+
+
+def start(target, duration=DEFAULT_DURATION):
+    """
+    Begin sampling ``target`` threads of this process.
+
+    :returns: False if a profile is already in progress.
+    :rtype: bool
+    """
+    # pylint: disable=W0603
+    #         Using the global statement
+    global _SAMPLER
+    with _LOCK:
+        if _SAMPLER is not None and _SAMPLER.is_alive():
+            return False
+        _SAMPLER = Sampler(target=target, duration=duration)
+        _SAMPLER.start()
+    return True
+
+
+def stop():
+    """
+    Stop sampling, the profile is saved by the sampling thread.
+
+    :returns: False if no profile was in progress.
+    :rtype: bool
+    """
+    with _LOCK:
+        if _SAMPLER is None or not _SAMPLER.is_alive():
+            return False
+        _SAMPLER.stop()
+    return True
+
+
+def handle_profile(target, action, duration=None):
+    """ Start or stop profiling of ``target`` by ``action``. """
+    log = logging.getLogger(__name__)
+    if action == 'start':
+        if not start(target, duration or DEFAULT_DURATION):
+            log.warn('profile of {0} not started: already in progress.'
+                     .format(target))
+        else:
+            log.info('profile of {0} started for {1}s.'
+                     .format(target, duration or DEFAULT_DURATION))
+    elif action == 'stop':
+        if not stop():
+            log.warn('profile of {0} not stopped: not in progress.'
+                     .format(target))
+    else:
+        log.error('profile of {0}: unknown action {1!r}'
+                  .format(target, action))
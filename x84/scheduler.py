@@ -0,0 +1,496 @@
+#!/usr/bin/env python2.7
+"""
+Periodic job scheduler for x/84.
+
+Background tasks, such as polling of message networks, indexing of the file
+area, or database maintenance, are run as jobs of an interval or cron-like
+schedule.  Each run of a job is executed by a sub-process, so that it does
+not compete with the engine's main loop for the interpreter lock, and a job
+is not started again while its previous run is still in progress.
+
+Engine services, and the engine on behalf of the default scripts, register
+their jobs by :func:`register`.  Jobs of userland scripts are configured by
+a section of the .ini file for each job::
+
+    [scheduler:bulletins]
+    target = bulletins.refresh
+    cron = 17 * * * *
+
+Where ``target`` is a function of a script of ``[system]`` option
+``scriptpath``, named as for :func:`x84.bbs.session.gosub`, followed by
+the function name.  A job is scheduled either by ``interval`` seconds or by
+a ``cron`` expression of fields minute, hour, day of month, month and day
+of week.  Optional ``jitter`` delays each run by up to as many seconds, so
+that jobs of the same schedule do not all start at once; a run exceeding
+``timeout`` seconds is terminated.  A job is disabled by ``enabled = no``.
+
+The section of a registered job, such as ``[scheduler:oneliners]``,
+overrides any of its options, or disables it.  A job whose target script
+is not found, such as one of the default scripts when ``scriptpath`` is
+another folder, is not scheduled.
+
+Statistics of each job, such as its number of runs and failures and the
+time and duration of its last run, are stored in database ``scheduler``.
+"""
+# std imports
+import multiprocessing
+import threading
+import datetime
+import logging
+import random
+import time
+import imp
+import os
+import sys
+
+# local
+from x84 import cmdline, metrics, profiler
+
+#: database of job statistics
+SCHEDULER_DB = 'scheduler'
+
+#: prefix of .ini sections configuring jobs
+SECTION_PREFIX = 'scheduler:'
+
+#: range of values of each cron field
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+#: jobs registered by :func:`register`
+JOBS = []
+
+#: jobs scheduled by :func:`main`
+SCHEDULED = []
+
+#: seconds to profile next run of jobs by name, see :func:`handle_profile`
+PROFILES = {}
+
+
+def parse_cron_field(field, minimum, maximum):
+    """
+    Return set of values matched by a single cron ``field``.
+
+    Supported are ``*``, single values, ranges such as ``1-5``, steps
+    such as ``*/15`` or ``0-30/10``, and comma-separated lists of these.
+
+    :raises ValueError: field is invalid.
+    :rtype: frozenset
+    """
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, end = minimum, maximum
+        elif '-' in part:
+            start, end = [int(value) for value in part.split('-', 1)]
+        else:
+            start = end = int(part)
+        if step < 1 or start < minimum or end > maximum or start > end:
+            raise ValueError('cron field out of range: {0!r}'.format(field))
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+def parse_cron(expression):
+    """
+    Return cron ``expression`` as a tuple of sets of values of each field.
+
+    :param str expression: fields minute, hour, day of month, month, and
+                           day of week, where 0 and 7 are Sunday.
+    :raises ValueError: expression is invalid.
+    :rtype: tuple
+    """
+    fields = expression.split()
+    if len(fields) != len(CRON_FIELDS):
+        raise ValueError('cron expression requires 5 fields: {0!r}'
+                         .format(expression))
+    parsed = [parse_cron_field(field, minimum, maximum)
+              for field, (minimum, maximum) in zip(fields, CRON_FIELDS)]
+    parsed[4] = frozenset(value % 7 for value in parsed[4])
+    # as cron(8), when both day fields are restricted, either may match.
+    any_dom, any_dow = fields[2] == '*', fields[4] == '*'
+    return tuple(parsed) + (any_dom, any_dow)
+
+
+def next_cron_time(cron, after):
+    """
+    Return time of the next minute matching ``cron`` following ``after``.
+
+    :param tuple cron: value returned by :func:`parse_cron`.
+    :param float after: unix time.
+    :rtype: float
+    """
+    minutes, hours, days, months, weekdays, any_dom, any_dow = cron
+    when = (datetime.datetime.fromtimestamp(after).replace(
+        second=0, microsecond=0) + datetime.timedelta(minutes=1))
+    # bounded by the longest period of any expression, 4 years for Feb 29.
+    until = when + datetime.timedelta(days=366 * 4)
+    while when < until:
+        dom_match = when.day in days
+        dow_match = (when.isoweekday() % 7) in weekdays
+        if any_dom or any_dow:
+            day_match = dom_match and dow_match
+        else:
+            day_match = dom_match or dow_match
+        if when.month not in months or not day_match:
+            when = (when.replace(hour=0, minute=0) +
+                    datetime.timedelta(days=1))
+        elif when.hour not in hours:
+            when = (when.replace(minute=0) +
+                    datetime.timedelta(hours=1))
+        elif when.minute not in minutes:
+            when += datetime.timedelta(minutes=1)
+        else:
+            return time.mktime(when.timetuple())
+    raise ValueError('cron expression never matches')
+
+
+def load_target(target):
+    """
+    Return function of script ``target``, such as ``'ol.sync_shroo_ms'``.
+
+    The script is found as by :meth:`~x84.bbs.session.Session.runscript`,
+    so that ``'extras.foo.bar'`` is function ``bar`` of script
+    ``extras/foo.py`` of the folder of ``[system]`` option ``scriptpath``.
+    """
+    from x84.bbs.ini import get_ini
+    script_name, func_name = target.rsplit('.', 1)
+    for directory in get_ini('system', 'scriptpath', split=True):
+        # put it in sys.path for relative imports
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+    lookup = find_script(target)
+    module = imp.load_module(script_name.rsplit('.', 1)[-1], *lookup)
+    return getattr(module, func_name)
+
+
+def find_script(target):
+    """
+    Find script of ``target``, as by :func:`load_target`.
+
+    :returns: tuple of :func:`imp.find_module`.
+    :raises ImportError: script not found.
+    """
+    from x84.bbs.ini import get_ini
+    script_name = target.rsplit('.', 1)[0]
+    script_paths = get_ini('system', 'scriptpath', split=True)
+    lookup_paths = script_paths[:]
+    if '.' in script_name:
+        remaining, script_name = script_name.rsplit('.', 1)
+        lookup_paths.extend(os.path.join(directory, *remaining.split('.'))
+                            for directory in script_paths)
+    return imp.find_module(script_name, lookup_paths)
+
+
+def run_job(name, target, args, profile=None):
+    """
+    Run job ``name``, the target of its sub-process.
+
+    :param target: function, or name of script function as by
+                   :func:`load_target`.
+    :param tuple args: arguments of function.
+    :param int profile: seconds to profile the run, if any.
+    """
+    log = logging.getLogger(__name__)
+    sampler = None
+    if profile:
+        sampler = profiler.Sampler(target=name, duration=profile)
+        sampler.start()
+    try:
+        if not callable(target):
+            target = load_target(target)
+        target(*args)
+    except Exception as err:  # pylint: disable=W0703
+        log.exception('job {0} failed: {1}'.format(name, err))
+        sys.exit(1)
+    finally:
+        if sampler is not None:
+            # the profile is saved by the sampling thread as it stops.
+            sampler.stop()
+            sampler.join()
+
+
+class Job(object):
+
+    """ A periodic job, and statistics of its runs. """
+
+    def __init__(self, name, target, args=(), interval=None, cron=None,
+                 jitter=0, timeout=None):
+        """
+        Class initializer.
+
+        :param str name: unique name of job.
+        :param target: function, or name of script function as by
+                       :func:`load_target`.
+        :param tuple args: arguments of function.
+        :param int interval: seconds between each run.
+        :param str cron: cron expression of job schedule, as by
+                         :func:`parse_cron`, when ``interval`` is None.
+        :param int jitter: maximum seconds each run is randomly delayed.
+        :param int timeout: seconds a run may take before it is terminated.
+        :raises ValueError: neither ``interval`` or ``cron`` given, or
+                            ``cron`` is invalid.
+        """
+        if not (interval or cron):
+            raise ValueError('job {0}: interval or cron required'
+                             .format(name))
+        self.name = name
+        self.target = target
+        self.args = args
+        self.interval = interval
+        self.cron_expression = cron if not interval else None
+        self.cron = parse_cron(cron) if not interval else None
+        self.jitter = jitter
+        self.timeout = timeout
+        self.process = None
+        self.started = None
+        self.next_run = None
+        self.stats = {'runs': 0, 'failures': 0, 'skipped': 0,
+                      'last_start': None, 'last_duration': None,
+                      'last_status': None}
+
+    def schedule(self, now, first=False):
+        """
+        Set time of next run following ``now``.
+
+        Interval jobs are first run at once, and then every ``interval``
+        seconds from the start of the previous run.
+        """
+        if self.interval:
+            next_run = now if first else now + self.interval
+        else:
+            next_run = next_cron_time(self.cron, now)
+        self.next_run = next_run + random.uniform(0, self.jitter)
+
+    def start(self):
+        """ Start run of job by a sub-process. """
+        # not a daemon, as jobs such as the file indexer have their own
+        # pool of sub-processes.
+        self.process = multiprocessing.Process(
+            target=run_job, args=(self.name, self.target, self.args,
+                                  PROFILES.pop(self.name, None)),
+            name='job:{0}'.format(self.name))
+        self.started = time.time()
+        self.process.start()
+
+    def poll(self, now):
+        """
+        Check run in progress, recording statistics when it has completed.
+
+        A run exceeding ``timeout`` is terminated.
+
+        :returns: True when a run has completed.
+        :rtype: bool
+        """
+        log = logging.getLogger(__name__)
+        if self.process is None:
+            return False
+        if self.process.is_alive():
+            if not self.timeout or now - self.started < self.timeout:
+                return False
+            log.warn('job {0} exceeded timeout of {1}s, terminated.'
+                     .format(self.name, self.timeout))
+            self.process.terminate()
+        self.process.join()
+        duration = now - self.started
+        status = self.process.exitcode
+        self.process = None
+
+        self.stats['runs'] += 1
+        self.stats['last_start'] = self.started
+        self.stats['last_duration'] = duration
+        self.stats['last_status'] = status
+        metrics.incr('scheduler_runs', self.name)
+        metrics.observe('scheduler_duration', duration, self.name)
+        if status != 0:
+            self.stats['failures'] += 1
+            metrics.incr('scheduler_failures', self.name)
+            log.warn('job {0} failed with exit code {1} after {2:0.2f}s.'
+                     .format(self.name, status, duration))
+        else:
+            log.debug('job {0} completed in {1:0.2f}s.'
+                      .format(self.name, duration))
+        return True
+
+    def skip(self):
+        """ Record run skipped, as previous run is still in progress. """
+        log = logging.getLogger(__name__)
+        self.stats['skipped'] += 1
+        metrics.incr('scheduler_skipped', self.name)
+        log.warn('job {0} still running after {1:0.0f}s, run skipped.'
+                 .format(self.name, time.time() - self.started))
+
+
+def register(name, target, args=(), interval=None, cron=None, jitter=0,
+             timeout=None):
+    """
+    Register job of an engine service.
+
+    Must be called before :func:`main`, arguments are as of :class:`Job`.
+    """
+    JOBS.append(Job(name=name, target=target, args=args, interval=interval,
+                    cron=cron, jitter=jitter, timeout=timeout))
+
+
+def handle_profile(name, action, duration=None):
+    """
+    Start or stop profiling of the next run of job ``name`` by ``action``.
+
+    The run is profiled by its sub-process until it completes or
+    ``duration`` elapses; a profile is stopped only before the run starts.
+
+    :returns: False when no job ``name`` is scheduled.
+    :rtype: bool
+    """
+    log = logging.getLogger(__name__)
+    if name not in [job.name for job in SCHEDULED]:
+        return False
+    if action == 'start':
+        PROFILES[name] = duration or profiler.DEFAULT_DURATION
+        log.info('profile of next run of job {0} requested for {1}s.'
+                 .format(name, PROFILES[name]))
+    elif action == 'stop':
+        if PROFILES.pop(name, None) is None:
+            log.warn('profile of job {0} not stopped: not pending.'
+                     .format(name))
+    else:
+        log.error('profile of job {0}: unknown action {1!r}'
+                  .format(name, action))
+    return True
+
+
+def get_configured_jobs(registered=()):
+    """
+    Return list of jobs, as configured by ``[scheduler:<name>]`` sections.
+
+    Options of a section of a job of ``registered`` override those it was
+    registered with, or disable it.  Sections of any other name are jobs
+    of userland scripts.
+    """
+    from x84.bbs.ini import CFG
+    log = logging.getLogger(__name__)
+    jobs = list(registered)
+    for section in CFG.sections():
+        if not section.startswith(SECTION_PREFIX):
+            continue
+        name = section[len(SECTION_PREFIX):]
+        options = dict(CFG.items(section))
+        job = next((job for job in jobs if job.name == name), None)
+        if job is not None:
+            jobs.remove(job)
+        if (CFG.has_option(section, 'enabled') and
+                not CFG.getboolean(section, 'enabled')):
+            continue
+        if job is not None:
+            # a schedule of the section replaces that registered.
+            defaults = {'target': job.target,
+                        'jitter': job.jitter, 'timeout': job.timeout}
+            if not (options.get('interval') or options.get('cron')):
+                defaults.update({'interval': job.interval,
+                                 'cron': job.cron_expression})
+            defaults.update(options)
+            options = defaults
+        try:
+            jobs.append(Job(
+                name=name, target=options['target'],
+                args=job.args if job is not None else (),
+                interval=int(options.get('interval') or 0),
+                cron=options.get('cron'),
+                jitter=int(options.get('jitter') or 0),
+                timeout=int(options.get('timeout') or 0)))
+        except (KeyError, ValueError) as err:
+            log.error('[{0}] invalid job: {1}'.format(section, err))
+    return jobs
+
+
+def save_stats(jobs):
+    """ Store statistics of ``jobs`` to database. """
+    from x84.bbs import DBProxy
+    statsdb = DBProxy(SCHEDULER_DB, use_session=False)
+    with statsdb:
+        statsdb.update(dict((job.name, job.stats) for job in jobs))
+
+
+def scheduler(jobs):
+    """ Blocking function runs ``jobs`` as scheduled. """
+    log = logging.getLogger(__name__)
+    now = time.time()
+    for job in jobs:
+        job.schedule(now, first=True)
+    while True:
+        now = time.time()
+        completed = False
+        for job in jobs:
+            completed = job.poll(now) or completed
+            if now < job.next_run:
+                continue
+            if job.process is not None:
+                job.skip()
+            else:
+                try:
+                    job.start()
+                except OSError as err:
+                    log.error('job {0} could not start: {1}'
+                              .format(job.name, err))
+            job.schedule(now)
+        if completed:
+            try:
+                save_stats(jobs)
+            except Exception as err:  # pylint: disable=W0703
+                log.exception('job statistics not saved: {0}'.format(err))
+        # wake at least every second, or more often while any job is
+        # running, so that the duration of completed runs is measured.
+        running = any(job.process is not None for job in jobs)
+        time.sleep(max(0.05, min([0.25 if running else 1.0] +
+                                 [job.next_run - time.time()
+                                  for job in jobs])))
+
+
+def main(background_daemon=True):
+    """
+    Entry point to begin running scheduled jobs.
+
+    Called by x84/engine.py, function main() as unmanaged thread, after
+    engine services have registered their jobs.
+
+    :param bool background_daemon: When True (default), this function returns
+                and jobs are scheduled by an unmanaged, background (daemon)
+                thread.  Otherwise, function call to ``main()`` is blocking.
+    :rtype: None
+    """
+    log = logging.getLogger(__name__)
+
+    jobs = []
+    for job in get_configured_jobs(JOBS):
+        if not callable(job.target):
+            try:
+                find_script(job.target)
+            except ImportError as err:
+                log.warn('job {0} not scheduled, target {1} not found: {2}'
+                         .format(job.name, job.target, err))
+                continue
+        jobs.append(job)
+    if not jobs:
+        return
+    SCHEDULED[:] = jobs
+
+    names = ', '.join(job.name for job in jobs)
+    if background_daemon:
+        t = threading.Thread(target=scheduler, args=(jobs,),
+                             name='scheduler')
+        t.daemon = True
+        log.info('scheduler of jobs {0}.'.format(names))
+        t.start()
+    else:
+        scheduler(jobs)
+
+if __name__ == '__main__':
+    # run only the jobs of the .ini file when executing this script directly,
+    # as those of engine services are not registered.
+    import x84.bbs.ini
+    x84.bbs.ini.init(*cmdline.parse_args())
+
+    # do not execute scheduler as a background thread.
+    main(background_daemon=False)
@@ -7,10 +7,17 @@ location of your SFTP server's root directory. Within that directory, ensure
 that there is a directory named `__uploads__`.
 
 This is based on paramiko's `StubSFTPServer` implementation.
+
+Directory listings and file attributes are cached by :class:`AttributeCache`,
+shared by all sftp sessions, so that mirroring clients repeatedly listing
+the same folders are served without a system call for every entry.
 """
 
 # std imports
+import collections
+import threading
 import logging
+import time
 import os
 
 # 3rd-party
@@ -27,16 +34,175 @@ from paramiko import (
 flagged_dirname = '__flagged__'
 uploads_dirname = '__uploads__'
 
+#: attribute cache shared by all sessions, see :func:`get_cache`.
+CACHE = None
+
+
+class AttributeCache(object):
+
+    """
+    Bounded cache of directory listings and file attributes by real path.
+
+    A directory listing is valid while the modification time of its folder
+    is unchanged, which changes as files are added, removed or renamed, and
+    for no longer than ``ttl`` seconds, as a file's size may change without
+    it.  Attributes of a file are valid for ``ttl`` seconds, and are also
+    refreshed by a listing of its folder.  Paths modified through the sftp
+    server are invalidated immediately.  Least recently used entries are
+    discarded once ``maxsize`` listings or attributes are cached.
+    """
+
+    def __init__(self, maxsize=4096, ttl=10.0):
+        """
+        Class initializer.
+
+        :param int maxsize: maximum number of listings, and of attributes.
+        :param float ttl: maximum seconds an entry is valid.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.listings = collections.OrderedDict()
+        self.attributes = collections.OrderedDict()
+
+    def _store(self, cache, key, value):
+        """ Store ``value`` by ``key``, discarding least recently used. """
+        cache.pop(key, None)
+        cache[key] = value
+        while len(cache) > self.maxsize:
+            cache.popitem(last=False)
+
+    def _lookup(self, cache, key):
+        """ Return unexpired value by ``key``, marking it recently used. """
+        value = cache.pop(key, None)
+        if value is not None and value[0] > time.time():
+            cache[key] = value
+            return value
+        return None
+
+    def list_folder(self, path):
+        """
+        Return list of ``SFTPAttributes`` of folder ``path``.
+
+        :raises OSError: folder could not be listed.
+        """
+        path = os.path.normpath(path)
+        mtime = os.stat(path).st_mtime
+        with self.lock:
+            cached = self._lookup(self.listings, path)
+        if cached is not None and cached[1] == mtime:
+            return list(cached[2])
+
+        out = []
+        expires = time.time() + self.ttl
+        for fname in os.listdir(path):
+            filepath = os.path.join(path, fname)
+            try:
+                attr = SFTPAttributes.from_stat(os.stat(filepath))
+            except OSError:
+                # removed while listing, or a broken symlink
+                continue
+            attr.filename = fname
+            out.append(attr)
+        with self.lock:
+            self._store(self.listings, path, (expires, mtime, out))
+            for attr in out:
+                self._store(self.attributes,
+                            (os.path.join(path, attr.filename), os.stat),
+                            (expires, attr))
+        return list(out)
+
+    def stat(self, path, func=os.stat):
+        """
+        Return ``SFTPAttributes`` of ``path`` by ``func``, os.stat or lstat.
+
+        :raises OSError: file could not be stat.
+        """
+        key = (os.path.normpath(path), func)
+        with self.lock:
+            cached = self._lookup(self.attributes, key)
+        if cached is not None:
+            return cached[1]
+        attr = SFTPAttributes.from_stat(func(path))
+        with self.lock:
+            self._store(self.attributes, key, (time.time() + self.ttl, attr))
+        return attr
+
+    def invalidate(self, path):
+        """ Discard cache of ``path``, and the listing of its folder. """
+        path = os.path.normpath(path)
+        with self.lock:
+            for func in (os.stat, os.lstat):
+                self.attributes.pop((path, func), None)
+            self.listings.pop(path, None)
+            self.listings.pop(os.path.dirname(path), None)
+
+
+def get_cache():
+    """ Return attribute cache, created by ``[sftp]`` configuration. """
+    global CACHE  # pylint: disable=W0603
+    if CACHE is None:
+        from x84.bbs import get_ini
+        CACHE = AttributeCache(
+            maxsize=get_ini(section='sftp', key='cache_size',
+                            getter='getint') or 4096,
+            ttl=get_ini(section='sftp', key='cache_ttl',
+                        getter='getfloat') or 10.0)
+    return CACHE
+
 
 class X84SFTPHandle(SFTPHandle):
 
-    """ SFTP File handler for x/84. """
+    """
+    SFTP File handler for x/84.
+
+    Files opened read-only are read ahead: a read request is served from
+    a buffer of up to ``readahead`` bytes read by a single system call, so
+    that the many small, sequential requests of a download do not each
+    require disk i/o.
+    """
+
+    #: default bytes read ahead for read-only files, 0 disables.
+    readahead = 262144
 
     def __init__(self, *args, **kwargs):
         """ Class initializer. """
         self.log = logging.getLogger(__name__)
         self.user = kwargs.pop('user')
+        self.readahead = kwargs.pop('readahead', self.readahead)
+        self._ra_offset = 0
+        self._ra_buffer = ''
         SFTPHandle.__init__(self, *args, **kwargs)
+        self.flags = args[0] if args else kwargs.get('flags', 0)
+
+    @property
+    def writable(self):
+        """ Whether file is opened for writing. """
+        return bool(self.flags & (os.O_WRONLY | os.O_RDWR |
+                                  os.O_APPEND | os.O_CREAT))
+
+    def read(self, offset, length):
+        """ Read ``length`` bytes at ``offset``. """
+        if self.writable or not self.readahead:
+            return SFTPHandle.read(self, offset, length)
+        start = offset - self._ra_offset
+        if 0 <= start and start + length <= len(self._ra_buffer):
+            return self._ra_buffer[start:start + length]
+        try:
+            self.readfile.seek(offset)
+            data = self.readfile.read(max(length, self.readahead))
+        except IOError as err:
+            self._ra_offset, self._ra_buffer = 0, ''
+            return SFTPServer.convert_errno(err.errno)
+        self._ra_offset, self._ra_buffer = offset, data
+        return data[:length]
+
+    def close(self):
+        """ Close the file, invalidating cached attributes when written. """
+        self._ra_buffer = ''
+        SFTPHandle.close(self)
+        if self.writable:
+            get_cache().invalidate(self.filename)
 
     def stat(self):
         """ Stat the file descriptor. """
@@ -58,6 +224,8 @@ class X84SFTPHandle(SFTPHandle):
             return SFTP_OK
         except OSError as err:
             return SFTPServer.convert_errno(err.errno)
+        finally:
+            get_cache().invalidate(self.filename)
 
 
 class X84SFTPServer(SFTPServerInterface):
@@ -84,6 +252,11 @@ class X84SFTPServer(SFTPServerInterface):
         self.user = (User(u'anonymous') if _ssh_session.anonymous
                      else get_user(_ssh_session.username))
         self.flagged = set()
+        self.cache = get_cache()
+        self.readahead = get_ini(section='sftp', key='readahead',
+                                 getter='getint')
+        if self.readahead == u'':
+            self.readahead = X84SFTPHandle.readahead
 
         SFTPServerInterface.__init__(self, *args, **kwargs)
 
@@ -95,6 +268,15 @@ class X84SFTPServer(SFTPServerInterface):
         attr.filename = flagged_dirname
         return attr
 
+    def _find_flagged(self, path):
+        """ Return real path of file ``path`` in flagged folder, or None. """
+        pstripped = path[path.rindex('/') + 1:]
+        for fname in self.flagged:
+            if fname[fname.rindex(os.path.sep) + 1:] == pstripped:
+                self.log.debug('file is actually {0}'.format(fname))
+                return fname
+        return None
+
     def _realpath(self, path):
         """ Get the real path of a given path. """
         self.log.debug('_realpath({0!r})'.format(path))
@@ -103,12 +285,9 @@ class X84SFTPServer(SFTPServerInterface):
             return self.root + path
         elif path.find(flagged_dirname) > -1:
             self.log.debug('fake file path: {0!r}'.format(path))
-            for fname in self.flagged:
-                fstripped = fname[fname.rindex(os.path.sep) + 1:]
-                pstripped = path[path.rindex('/') + 1:]
-                if fstripped == pstripped:
-                    self.log.debug('file is actually {0}'.format(fname))
-                    return fname
+            fname = self._find_flagged(path)
+            if fname is not None:
+                return fname
 
         # pylint: disable=E1101
         #         Instance of 'X84SFTPServer' has no 'canonicalize' member
@@ -136,13 +315,7 @@ class X84SFTPServer(SFTPServerInterface):
                     attr.filename = fname[fname.rindex('/') + 1:]
                     out.append(attr)
                 return out
-            flist = os.listdir(rpath)
-            for fname in flist:
-                attr = SFTPAttributes.from_stat(
-                    os.stat(os.path.join(rpath, fname)))
-                attr.filename = fname
-                out.append(attr)
-            return out
+            return out + self.cache.list_folder(rpath)
         except OSError as err:
             return SFTPServer.convert_errno(err.errno)
 
@@ -151,16 +324,10 @@ class X84SFTPServer(SFTPServerInterface):
         self.log.debug('stat({0!r})'.format(path))
         if path.endswith(flagged_dirname):
             return self._dummy_dir_stat()
-        elif path.find(flagged_dirname) > -1:
-            for fname in self.flagged:
-                fstripped = fname[fname.rindex(os.path.sep) + 1:]
-                pstripped = path[path.rindex('/') + 1:]
-                if fstripped == pstripped:
-                    self.log.debug('file is actually {0}'.format(fname))
-                    return SFTPAttributes.from_stat(fname)
+        # files of flagged folder are resolved by _realpath
         path = self._realpath(path)
         try:
-            return SFTPAttributes.from_stat(os.stat(path))
+            return self.cache.stat(path, os.stat)
         except OSError as err:
             return SFTPServer.convert_errno(err.errno)
 
@@ -169,16 +336,10 @@ class X84SFTPServer(SFTPServerInterface):
         self.log.debug('lstat({0!r})'.format(path))
         if path.endswith(flagged_dirname):
             return self._dummy_dir_stat()
-        elif path.find(flagged_dirname) > -1:
-            for fname in self.flagged:
-                fstripped = fname[fname.rindex(os.path.sep) + 1:]
-                pstripped = path[path.rindex('/') + 1:]
-                if fstripped == pstripped:
-                    self.log.debug('file is actually {0}'.format(fname))
-                    return SFTPAttributes.from_stat(fname)
+        # files of flagged folder are resolved by _realpath
         path = self._realpath(path)
         try:
-            return SFTPAttributes.from_stat(os.lstat(path))
+            return self.cache.stat(path, os.lstat)
         except OSError as err:
             return SFTPServer.convert_errno(err.errno)
 
@@ -214,10 +375,14 @@ class X84SFTPServer(SFTPServerInterface):
             # O_RDONLY (== 0)
             fstr = 'rb'
         try:
-            openfile = os.fdopen(filedesc, fstr)
+            # read-only files are buffered by X84SFTPHandle's read-ahead
+            openfile = os.fdopen(filedesc, fstr,
+                                 0 if fstr == 'rb' and self.readahead else -1)
         except OSError as err:
             return SFTPServer.convert_errno(err.errno)
-        fobj = X84SFTPHandle(flags, user=self.user)
+        fobj = X84SFTPHandle(flags, user=self.user, readahead=self.readahead)
+        if fobj.writable:
+            self.cache.invalidate(path)
         fobj.filename = path
         fobj.readfile = openfile
         fobj.writefile = openfile
@@ -237,6 +402,8 @@ class X84SFTPServer(SFTPServerInterface):
             os.remove(path)
         except OSError as err:
             return SFTPServer.convert_errno(err.errno)
+        finally:
+            self.cache.invalidate(path)
         return SFTP_OK
 
     def rename(self, oldpath, newpath):
@@ -251,6 +418,9 @@ class X84SFTPServer(SFTPServerInterface):
             os.rename(oldpath, newpath)
         except OSError as err:
             return SFTPServer.convert_errno(err.errno)
+        finally:
+            self.cache.invalidate(oldpath)
+            self.cache.invalidate(newpath)
         return SFTP_OK
 
     def mkdir(self, path, attr):
@@ -265,6 +435,8 @@ class X84SFTPServer(SFTPServerInterface):
                 SFTPServer.set_file_attr(path, attr)
         except OSError as err:
             return SFTPServer.convert_errno(err.errno)
+        finally:
+            self.cache.invalidate(path)
         return SFTP_OK
 
     def rmdir(self, path):
@@ -277,6 +449,8 @@ class X84SFTPServer(SFTPServerInterface):
             os.rmdir(path)
         except OSError as err:
             return SFTPServer.convert_errno(err.errno)
+        finally:
+            self.cache.invalidate(path)
         return SFTP_OK
 
     def chattr(self, path, attr):
@@ -293,6 +467,8 @@ class X84SFTPServer(SFTPServerInterface):
             SFTPServer.set_file_attr(path, attr)
         except OSError as err:
             return SFTPServer.convert_errno(err.errno)
+        finally:
+            self.cache.invalidate(path)
         return SFTP_OK
 
     def symlink(self, target_path, path):
@@ -318,6 +494,8 @@ class X84SFTPServer(SFTPServerInterface):
             os.symlink(target_path, path)
         except OSError as err:
             return SFTPServer.convert_errno(err.errno)
+        finally:
+            self.cache.invalidate(path)
         return SFTP_OK
 
     def readlink(self, path):
@@ -308,6 +308,10 @@ class TelnetClient(BaseClient):
         # Must be escaped 255 (IAC + IAC) to avoid IAC interpretation.
         self.send_str(ucs.encode(encoding, 'replace').replace(IAC, 2 * IAC))
 
+    def send_bytes(self, data):
+        """ Buffer raw bytes for client, escaping IAC. """
+        self.send_str(data.replace(IAC, 2 * IAC))
+
     def _recv_byte(self, byte):
         """
         Buffer non-telnet commands bytestrings into recv_buffer.
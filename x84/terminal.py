@@ -1,12 +1,23 @@
 """ Terminal handler for x/84 """
 import contextlib
+import threading
 import logging
+import fnmatch
 import codecs
+import Queue
 import sys
+import os
 from blessed import Terminal as BlessedTerminal
 
 TERMINALS = dict()
 
+#: thread writing log records received from sessions, see :func:`log_records`
+LOG_WRITER = None
+
+#: modification time of notification queue, when last delivered by
+#: :func:`drain_notifications`.
+_NOTIFY_MTIME = None
+
 
 class Terminal(BlessedTerminal):
 
@@ -214,9 +225,75 @@ class TerminalProcess(object):
         self.sid = sid
         (self.master_write, self.master_read) = master_pipes
         self.timeout = get_ini('system', 'timeout') or 0
+        #: name of script currently run by session, as last reported
+        #: by its ``metrics`` event.
+        self.script = None
+        #: ``(handle, tag patterns)`` of notifications received by session,
+        #: as registered by its ``notify-subscribe`` event.
+        self.subscription = None
+
+
+class LogWriter(threading.Thread):
+
+    """
+    Thread writes log records received from sessions.
+
+    Log handlers may block on disk or console i/o, records are therefore
+    written by this thread so that the engine loop is never delayed by
+    logging of sessions.
+    """
+
+    def __init__(self):
+        """ Class initializer. """
+        threading.Thread.__init__(self, name='logwriter')
+        self.daemon = True
+        self.queue = Queue.Queue()
+
+    def put(self, sid, records):
+        """ Queue list of log ``records`` of session ``sid`` for writing. """
+        self.queue.put((sid, records))
+
+    def run(self):
+        """ Write queued log records, forever. """
+        while True:
+            sid, records = self.queue.get()
+            for record in records:
+                self.write(sid, record)
+
+    @staticmethod
+    def write(sid, record):
+        """ Write log ``record``, prefixed by handle and session ``sid``. """
+        log = logging.getLogger(record.name)
+        if not log.isEnabledFor(record.levelno):
+            return
+        record.msg = ('{data.handle}[{sid}] {data.msg}'
+                      .format(data=record, sid=sid))
+        try:
+            log.handle(record)
+        # pylint: disable=W0703
+        #         Catching too general exception
+        except Exception:
+            logging.getLogger(__name__).exception(
+                'failed to write log record of {0}'.format(sid))
 
 
-def flush_queue(queue):
+def log_records(sid, records):
+    """
+    Write log ``records`` of session ``sid`` by the :class:`LogWriter`.
+
+    :param str sid: session id.
+    :param list records: list of :class:`logging.LogRecord`.
+    """
+    # pylint: disable=W0603
+    #         Using the global statement
+    global LOG_WRITER
+    if LOG_WRITER is None:
+        LOG_WRITER = LogWriter()
+        LOG_WRITER.start()
+    LOG_WRITER.put(sid, records)
+
+
+def flush_queue(queue, sid=None):
     """
     Flush all data awaiting on the ipc queue.
 
@@ -228,7 +305,7 @@ def flush_queue(queue):
         while queue.poll():
             event, data = queue.recv()
             if event == 'logger':
-                log.handle(data)
+                log_records(sid, data)
     except (EOFError, IOError) as err:
         log.debug(err)
 
@@ -243,7 +320,7 @@ def register_tty(tty):
 def unregister_tty(tty):
     """ Unregister a :class:`TerminalProcess` instance. """
     try:
-        flush_queue(tty.master_read)
+        flush_queue(tty.master_read, tty.sid)
         tty.master_read.close()
         tty.master_write.close()
     except (EOFError, IOError) as err:
@@ -285,8 +362,65 @@ def kill_session(client, reason='killed'):
         unregister_tty(tty)
 
 
+def route_notifications(notes, origin=None):
+    """
+    Send notifications to sessions of their recipient and subscribers.
+
+    See :func:`x84.bbs.session.publish_notifications`.
+
+    :param list notes: notification dictionaries.
+    :param str origin: session-id of publisher, which is not notified.
+    """
+    for sid, tty in get_terminals():
+        if sid == origin or tty.subscription is None:
+            continue
+        handle, patterns = tty.subscription
+        matched = [note for note in notes if note['author'] != handle and (
+            note['recipient'] == handle or (
+                note['kind'] == 'post' and any(
+                    fnmatch.filter(note['tags'], pattern)
+                    for pattern in patterns)))]
+        if matched:
+            try:
+                tty.master_write.send(('notify', matched))
+            except (EOFError, IOError):
+                pass
+
+
+def drain_notifications():
+    """
+    Deliver notifications queued by processes without a session.
+
+    Such as messages received by a job of the scheduler, or by the web
+    server.  The queue is read only when its database file has been
+    modified since last delivered.
+    """
+    # pylint: disable=W0603
+    #         Using the global statement
+    global _NOTIFY_MTIME
+    from x84.bbs.session import NOTIFY_DB
+    from x84.bbs.dbproxy import DBProxy
+    from x84.db import get_db_filepath
+    try:
+        mtime = os.stat(get_db_filepath(NOTIFY_DB)).st_mtime
+    except OSError:
+        return
+    if mtime == _NOTIFY_MTIME:
+        return
+    _NOTIFY_MTIME = mtime
+
+    notifydb = DBProxy(NOTIFY_DB, use_session=False)
+    queued = sorted(notifydb.items())
+    if not queued:
+        return
+    with notifydb:
+        for key, _ in queued:
+            del notifydb[key]
+    route_notifications([note for _, notes in queued for note in notes])
+
+
 def start_process(sid, env, CFG, child_pipes, kind, addrport,
-                  matrix_args=None, matrix_kwargs=None):
+                  matrix_args=None, matrix_kwargs=None, log_level=None):
     """
     A ``multiprocessing.Process`` target.
 
@@ -302,25 +436,32 @@ def start_process(sid, env, CFG, child_pipes, kind, addrport,
                               script.
     :param dict matrix_kwargs: optional keyward arguments to pass to matrix
                                script.
+    :param int log_level: lowest level of log record written by the engine,
+                          records of lesser level are discarded.
     """
     # pylint: disable=R0913,R0914
     #         Too many arguments (8/5)
     #         Too many local variables (16/15)
     import x84.bbs.ini
-    from x84.bbs.ipc import make_root_logger
+    from x84.bbs.ipc import make_root_logger, flush_log
     from x84.bbs.session import Session
     from x84.bbs.exception import Disconnected
+    from x84 import metrics
 
     # CFG must be pickled and sent to child process; on windows systems,
     # fork() does not duplicate that it has been initialized, and requires
     # sending to child process
     x84.bbs.ini.CFG = CFG
 
+    # discard metrics inherited from the engine by fork(); the session
+    # reports only its own values by the 'metrics' event.
+    metrics.reset()
+
     (writer, _) = child_pipes
 
     # remove any existing log handlers in child process and replace
     # with a new root log handler that sends to x84.bbs.engine over IPC.
-    make_root_logger(writer)
+    make_root_logger(writer, log_level)
 
     # instantiate and create a new terminal instance given the value
     # of env[TERM], negotiated by protocol. May modify the value of
@@ -346,6 +487,7 @@ def start_process(sid, env, CFG, child_pipes, kind, addrport,
     finally:
         # signal exit to engine
         try:
+            flush_log(force=True)
             writer.send(('exit', None))
         except IOError as err:
             # ignore [Errno 232] The pipe is being closed,
@@ -360,6 +502,7 @@ def spawn_client_session(client, matrix_kwargs=None):
     Optional
     """
     from multiprocessing import Process, Pipe
+    from x84.bbs.ipc import get_log_level
     import x84.bbs.ini
 
     child_read, master_write = Pipe(duplex=False)
@@ -376,6 +519,7 @@ def spawn_client_session(client, matrix_kwargs=None):
         'kind': client.kind,
         'addrport': client.addrport,
         'matrix_kwargs': matrix_kwargs,
+        'log_level': get_log_level(),
     }).start()
 
     # and register its tty and master-side pipes for polling by x84.engine
@@ -0,0 +1,61 @@
+"""
+Engine metrics web module for x/84.
+
+Serves the counters, latency histograms and gauges recorded by
+:mod:`x84.metrics` as plain text (default) or json.
+
+Add 'metrics' to your 'modules' in the [web] section of default.ini.  As
+metrics may reveal board activity, access may be restricted to a list of
+client addresses by option ``metrics_allow``:
+
+[web]
+modules = msgserve, metrics
+metrics_allow = 127.0.0.1, 10.0.0.5
+
+Metrics are then available as ``/metrics`` or ``/metrics/json``.  Those
+of the engine are requested from it by the web server process.
+"""
+import logging
+import json
+import web
+
+
+class MetricsApi(object):
+
+    """ Engine metrics web API endpoint. """
+
+    #: client addresses allowed, set by :func:`web_module`.
+    allow = ()
+
+    def GET(self, fmt=None):
+        """ GET method - return current metrics. """
+        from x84 import metrics, webserve
+        log = logging.getLogger(__name__)
+
+        if self.allow and web.ctx.ip not in self.allow:
+            log.info('metrics request refused for {0}'.format(web.ctx.ip))
+            raise web.Forbidden()
+
+        data = webserve.engine_snapshot()
+        if fmt == 'json':
+            web.header('Content-Type', 'application/json', unique=True)
+            return json.dumps(data)
+        web.header('Content-Type', 'text/plain', unique=True)
+        return metrics.format_text(data)
+
+
+def web_module():
+    """
+    Return dictionary of url routes and function mappings for this module.
+
+    Called by x84/webserve.py on server start.
+    """
+    from x84.bbs.ini import get_ini
+    MetricsApi.allow = tuple(get_ini(section='web', key='metrics_allow',
+                                     split=True))
+    return {
+        'urls': ('/metrics/?(json|text)?/?', 'metrics'),
+        'funcs': {
+            'metrics': MetricsApi
+        }
+    }
@@ -19,11 +19,26 @@ Example default.ini settings:
 [msg]
 # The name of the message networks hosted
 server_tags = x84net
+
+Messages are posted one per ``PUT`` request as field ``message``, or as
+a batch of up to :data:`BATCH_PUSH_MSGS` by field ``messages``, answered by
+a result of each message.  Responses are gzip-compressed for clients that
+accept it.
+
+Messages are pulled by ``GET`` of those following the message id of the
+request, the client's cursor.  Each response carries an ``ETag`` of the
+newest message of the network: a client's request with header
+``If-None-Match`` of the same value is answered ``304 Not Modified``
+without reading any messages.  Responses of :data:`STREAM_MSGS` or more
+messages are streamed, each message encoded as it is read.
 """
+import itertools
 import logging
 import hashlib
+import bisect
 import json
 import time
+import zlib
 import web
 
 #: response for general errors
@@ -33,7 +48,16 @@ RESP_FAIL = json.dumps({u'response': False, u'message': u'Error'})
 AUTH_EXPIREY = 15
 
 #: maximum number of messages to reply in batches
-BATCH_MSGS = 20
+BATCH_MSGS = 200
+
+#: minimum number of messages of a streamed reply
+STREAM_MSGS = 20
+
+#: maximum number of messages received in a batch
+BATCH_PUSH_MSGS = 100
+
+#: minimum size of response bodies to compress
+GZIP_MIN_SIZE = 512
 
 #: primary json fields
 VALIDATE_FIELDS = ('network', 'action', 'auth',)
@@ -86,10 +110,21 @@ class MessageApi(object):
             'network': network,
             'action': 'pull',
             'last': max(0, int(last)),
+            'etag': web.ctx.env.get('HTTP_IF_NONE_MATCH'),
         })
 
-        # return response data as json (200 OK)
-        return self._jsonify(response_data, log)
+        # return response data as json (200 OK), streamed when large.
+        messages = iter(response_data['messages'])
+        response_data['messages'] = list(
+            itertools.islice(messages, STREAM_MSGS))
+        if len(response_data['messages']) < STREAM_MSGS:
+            return self._jsonify(response_data, log)
+        chunks = stream_json(response_data, 'messages', messages)
+        web.header('Vary', 'Accept-Encoding')
+        if 'gzip' in web.ctx.env.get('HTTP_ACCEPT_ENCODING', ''):
+            web.header('Content-Encoding', 'gzip')
+            return gzip_stream(chunks)
+        return chunks
 
     def PUT(self, network, *_):
         """ PUT method - post messages. """
@@ -100,14 +135,19 @@ class MessageApi(object):
                 log_msg='request without header Auth-X84net.',
                 status_exc=web.NoMethod)
 
-        # parse incoming message
+        # parse incoming message, or batch of messages
         webdata = web.input()
-        response_data = get_response(request_data={
+        request_data = {
             'auth': web.ctx.env['HTTP_AUTH_X84NET'],
             'network': network,
-            'action': 'push',
-            'message': json.loads(webdata.message)
-        })
+        }
+        if 'messages' in webdata:
+            request_data['action'] = 'push-batch'
+            request_data['messages'] = json.loads(webdata.messages)
+        else:
+            request_data['action'] = 'push'
+            request_data['message'] = json.loads(webdata.message)
+        response_data = get_response(request_data=request_data)
 
         # return response data as json
         return self._jsonify(response_data, log)
@@ -115,16 +155,22 @@ class MessageApi(object):
     @staticmethod
     def _jsonify(response_data, log):
         """
-        Return ``response_data`` as json.
+        Return ``response_data`` as json, gzip-compressed when accepted.
 
         :raises web.HTTPError: response_data failed to encode to json.
         """
         try:
-            return json.dumps(response_data)
+            body = json.dumps(response_data)
         except ValueError as err:
             log.error('{err}: response_data={response_data!r}'.format(
                 err=err, response_data=response_data))
             raise web.HTTPError('500 Server Error', {}, RESP_FAIL)
+        web.header('Vary', 'Accept-Encoding')
+        if (len(body) >= GZIP_MIN_SIZE and
+                'gzip' in web.ctx.env.get('HTTP_ACCEPT_ENCODING', '')):
+            web.header('Content-Encoding', 'gzip')
+            return gzip_compress(body)
+        return body
 
 
 def web_module():
@@ -147,6 +193,38 @@ def web_module():
 # Below is the method for serving requests and some helper funcs.
 
 
+def gzip_compress(data):
+    """ Return ``data`` compressed in gzip format. """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def gzip_stream(chunks):
+    """ Generate iterable ``chunks`` compressed in gzip format. """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_json(response_data, key, items):
+    """
+    Generate ``response_data`` as json, with list ``key`` of ``items``.
+
+    Items of ``response_data[key]`` are followed by those of iterable
+    ``items``, each encoded as it is read.
+    """
+    head = json.dumps(dict((_key, value)
+                           for _key, value in response_data.items()
+                           if _key != key))
+    yield '{0}, {1}: ['.format(head[:-1], json.dumps(key))
+    for num, item in enumerate(itertools.chain(response_data[key], items)):
+        yield '{0}{1}'.format(', ' if num else '', json.dumps(item))
+    yield ']}'
+
+
 def server_error(log_func, log_msg, status_exc):
     """
     Helper function for logging and returning web.HTTPError.
@@ -162,69 +240,117 @@ def server_error(log_func, log_msg, status_exc):
     raise exc
 
 
+#: sorted message ids by network, and the newest of them
+_NETWORK_IDS = dict()
+
+
+def get_network_ids(network, latest):
+    """
+    Return sorted message ids of ``network``, whose newest is ``latest``.
+
+    Message ids are read from the tags database only when a message has
+    been added to the network since last requested.
+    """
+    cached = _NETWORK_IDS.get(network)
+    if cached is None or cached[0] != latest:
+        from x84.bbs import DBProxy, msgbase
+        msg_ids = sorted(DBProxy(msgbase.TAGDB, use_session=False)
+                         .get(network, set()))
+        cached = _NETWORK_IDS[network] = (latest, msg_ids)
+    return cached[1]
+
+
 def serve_messages_for(board_id, request_data, db_source):
-    """ Reply-to api client request to receive new messages. """
-    # pylint: disable=R0914
-    #         Too many local variables (16/15)
+    """
+    Reply-to api client request to receive new messages.
+
+    Messages following message id ``last`` not posted by the client are
+    replied as a generator, so that they may be streamed.
+
+    :raises web.NotModified: client's ``etag`` is current.
+    """
     from x84.bbs import DBProxy, msgbase
     from x84.bbs.msgbase import to_utctime
     log = logging.getLogger(__name__)
-    # log.error(msg)
-    db_tags = DBProxy(msgbase.TAGDB, use_session=False)
+    network = request_data['network']
+    last_seen = request_data.get('last', -1)
+
+    latest = msgbase.get_latest_idx(network, use_session=False)
+    etag = '"{0}"'.format(latest)
+    web.header('ETag', etag)
+    if request_data.get('etag') == etag:
+        raise web.NotModified()
+    if latest <= last_seen:
+        return {u'response': True, u'messages': []}
+
+    msg_ids = get_network_ids(network, latest)
+    pending = msg_ids[bisect.bisect_right(msg_ids, last_seen):]
     db_messages = DBProxy(msgbase.MSGDB, use_session=False)
 
-    def message_owned_by(msg_id, board_id):
-        """ Whether given message is owned by specified board. """
-        return (msg_id in db_source and
-                db_source[msg_id] == board_id)
+    def pending_messages():
+        """ Generator of network messages not owned by client. """
+        num_sent = 0
+        for msg_id in pending:
+            if db_source.get(str(msg_id)) == board_id:
+                continue
+            msg = db_messages.get(str(msg_id))
+            if msg is None or network not in msg.tags:
+                # since deleted, or removed from network
+                continue
+            yield {
+                u'id': msg.idx,
+                u'author': msg.author,
+                u'recipient': msg.recipient,
+                u'parent': msg.parent,
+                u'subject': msg.subject,
+                u'tags': list(msg.tags ^ set([network])),
+                u'ctime': to_utctime(msg.ctime),
+                u'body': msg.body
+            }
+            num_sent += 1
+            if num_sent >= BATCH_MSGS:
+                log.warn('[{network}] Batch limit reached for board '
+                         '{board_id}; halting'
+                         .format(network=network, board_id=board_id))
+                break
+
+        if num_sent > 0:
+            log.info('[{network}] {num_sent} messages served to {board_id}'
+                     .format(network=network, num_sent=num_sent,
+                             board_id=board_id))
+
+    return {u'response': True, u'messages': pending_messages()}
+
+
+def parse_message(pullmsg, network):
+    """
+    Return ``(msg, ctime)`` of message ``pullmsg`` posted to ``network``.
 
-    def msgs_after(idx=None):
-        """
-        Generator of network messages following index ``idx```.
+    :raises ValueError: message is missing a field.
+    """
+    from x84.bbs.msgbase import to_localtime, Msg
 
-        If ``idx`` is None, all messages are returned.
-        """
-        for msg_id in db_tags.get(request_data['network'], []):
-            if idx is None:
-                yield db_messages[idx]
-            elif (int(msg_id) > int(idx) and
-                  not message_owned_by(msg_id, board_id)):
-                yield db_messages[msg_id]
-
-    last_seen = request_data.get('last', None)
-    pending_messages = msgs_after(last_seen)
-    return_messages = list()
-    num_sent = 0
-    for num_sent, msg in enumerate(pending_messages, start=1):
-        return_messages.append({
-            u'id': msg.idx,
-            u'author': msg.author,
-            u'recipient': msg.recipient,
-            u'parent': msg.parent,
-            u'subject': msg.subject,
-            u'tags': list(msg.tags ^ set([request_data['network']])),
-            u'ctime': to_utctime(msg.ctime),
-            u'body': msg.body
-        })
-        if num_sent >= BATCH_MSGS:
-            log.warn('[{request_data[network]}] Batch limit reached for '
-                     'board {board_id}; halting'
-                     .format(request_data=request_data, board_id=board_id))
-            break
+    # validate
+    for key in (_key for _key in VALIDATE_MSG_KEYS if _key not in pullmsg):
+        raise ValueError("request data 'message' missing sub-field {key!r}"
+                         .format(key=key))
 
-    if num_sent > 0:
-        log.info('[{request_data[network]}] {num_sent} messages '
-                 'served to {board_id}'.format(request_data=request_data,
-                                               num_sent=num_sent,
-                                               board_id=board_id))
+    msg = Msg()
+    msg.author = pullmsg['author']
+    msg.recipient = pullmsg['recipient']
+    msg.subject = pullmsg['subject']
+    msg.parent = pullmsg['parent']
+    msg.tags = set(pullmsg['tags'] + [network])
+    msg.body = pullmsg['body']
 
-    return {u'response': True, u'messages': return_messages}
+    # ?? is this removing millesconds, or ?
+    _ctime = to_localtime(pullmsg['ctime'].split('.', 1)[0])
+    return msg, _ctime
 
 
 def receive_message_from(board_id, request_data,
                          db_source, db_transactions):
     """ Reply-to api client request to post a new message. """
-    from x84.bbs.msgbase import to_localtime, Msg
     log = logging.getLogger(__name__)
 
     if 'message' not in request_data:
@@ -233,41 +359,77 @@ def receive_message_from(board_id, request_data,
             log_msg="request data missing 'message' content",
             status_exc=web.BadRequest)
 
-    pullmsg = request_data['message']
-
-    # validate
-    for key in (_key for _key in VALIDATE_MSG_KEYS if _key not in pullmsg):
+    try:
+        msg, _ctime = parse_message(request_data['message'],
+                                    request_data['network'])
+    except ValueError as err:
         raise server_error(
             log_func=log.info,
-            log_msg=("request data 'message' missing sub-field {key!r}"
-                     .format(key=key)),
+            log_msg=str(err),
             status_exc=web.BadRequest)
 
-    msg = Msg()
-    msg.author = pullmsg['author']
-    msg.recipient = pullmsg['recipient']
-    msg.subject = pullmsg['subject']
-    msg.parent = pullmsg['parent']
-    msg.tags = set(pullmsg['tags'] + [request_data['network']])
-    msg.body = pullmsg['body']
-
-    # ?? is this removing millesconds, or ?
-    _ctime = to_localtime(pullmsg['ctime'].split('.', 1)[0])
-
     msg.save(send_net=False, ctime=_ctime)
     with db_source, db_transactions:
         db_source[msg.idx] = board_id
-        db_transactions[msg.idx] = msg.idx
+        db_transactions.add(net_id=msg.idx, idx=msg.idx)
 
     web.ctx.status = '201 Created'
     return {u'response': True, u'id': msg.idx}
 
 
+def receive_messages_from(board_id, request_data,
+                          db_source, db_transactions):
+    """
+    Reply-to api client request to post a batch of new messages.
+
+    Valid messages are stored in bulk, the response contains a result
+    of each message, in order of request: either its new message id, or
+    the reason it was rejected.
+    """
+    from x84.bbs.msgbase import save_msgs
+    log = logging.getLogger(__name__)
+
+    pullmsgs = request_data.get('messages')
+    if not isinstance(pullmsgs, list) or len(pullmsgs) > BATCH_PUSH_MSGS:
+        raise server_error(
+            log_func=log.info,
+            log_msg=("request data 'messages' must be a list of at most "
+                     "{0} messages".format(BATCH_PUSH_MSGS)),
+            status_exc=web.BadRequest)
+
+    results = [None] * len(pullmsgs)
+    msgs, ctimes, positions = list(), list(), list()
+    for num, pullmsg in enumerate(pullmsgs):
+        try:
+            msg, _ctime = parse_message(pullmsg, request_data['network'])
+        except (ValueError, TypeError, AttributeError) as err:
+            log.info('[{data[network]}] message {num} rejected: {err}'
+                     .format(data=request_data, num=num, err=err))
+            results[num] = {u'response': False, u'message': unicode(err)}
+            continue
+        msgs.append(msg)
+        ctimes.append(_ctime)
+        positions.append(num)
+
+    save_msgs(msgs, ctimes)
+    with db_source, db_transactions:
+        db_source.update(dict((str(msg.idx), board_id) for msg in msgs))
+        db_transactions.add_many((msg.idx, msg.idx) for msg in msgs)
+    for num, msg in zip(positions, msgs):
+        results[num] = {u'response': True, u'id': msg.idx}
+
+    log.info('[{data[network]}] {num} messages received from {board_id}'
+             .format(data=request_data, num=len(msgs), board_id=board_id))
+    web.ctx.status = '201 Created'
+    return {u'response': True, u'results': results}
+
+
 def get_response(request_data):
     """ Serve one API server request and return. """
     # pylint: disable=R0914
     #         Too many local variables (16/15)
     from x84.bbs import DBProxy, get_ini
+    from x84.bbs.msgbase import TransIndex
     log = logging.getLogger(__name__)
 
     # validate primary json request keys
@@ -333,7 +495,7 @@ def get_response(request_data):
     # these need to be better named for their transmission direction,
     # its very clear how they are consumed as they are currently named.
     db_source = DBProxy('{0}source'.format(tag), use_session=False)
-    db_transactions = DBProxy('{0}trans'.format(tag), use_session=False)
+    db_transactions = TransIndex(tag, use_session=False)
 
     if request_data.get('action', None) == 'pull':
         # client is requesting to pull messages
@@ -348,6 +510,13 @@ def get_response(request_data):
                                     db_source=db_source,
                                     db_transactions=db_transactions)
 
+    elif request_data.get('action', None) == 'push-batch':
+        # client is sending a batch of messages to the network
+        return receive_messages_from(board_id=board_id,
+                                     request_data=request_data,
+                                     db_source=db_source,
+                                     db_transactions=db_transactions)
+
     raise server_error(
         log_func=log.info,
         log_msg=('[{data[network]}] Unknown action, {data[action]!r}'
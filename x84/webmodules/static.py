@@ -1,8 +1,139 @@
-""" Static file server web module for x/84 bbs. """
+"""
+Static file server web module for x/84 bbs.
 
+Files are served with headers ``ETag`` and ``Last-Modified``, so that a
+client holding a current copy is answered ``304 Not Modified``.  Files of
+up to ``static_cache_file_size`` bytes are kept in memory, up to a total of
+``static_cache_size`` bytes, and are read again only once modified.  Larger
+files are streamed from disk.
+
+A pre-compressed variant of a file, such as ``style.css.gz`` of
+``style.css``, is served to clients accepting gzip encoding when it is at
+least as new as the file.  A single byte range of a file may be requested
+by header ``Range``, such as to resume a large download.
+
+[web]
+modules = static
+static_cache_size = 16777216
+static_cache_file_size = 262144
+"""
+
+import collections
+import mimetypes
+import threading
+import datetime
 import web
 import os
-import mimetypes
+import re
+
+#: bytes read from disk at once for files not cached
+CHUNK_SIZE = 65536
+
+#: a single byte range of header ``Range``
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FileCache(object):
+
+    """ Least-recently-used cache of contents of small files. """
+
+    def __init__(self, maxsize, max_file_size):
+        """
+        Class initializer.
+
+        :param int maxsize: maximum total size of cached files.
+        :param int max_file_size: maximum size of a cached file.
+        """
+        self.maxsize = maxsize
+        self.max_file_size = max_file_size
+        self.files = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def _pop(self, filepath):
+        """ Remove and return entry of ``filepath``, if any. """
+        entry = self.files.pop(filepath, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+        return entry
+
+    def _put(self, filepath, entry):
+        """ Store ``entry`` of ``filepath``, evicting the least recent. """
+        self.files[filepath] = entry
+        self.size += len(entry[1])
+        while self.size > self.maxsize:
+            _, (_, content) = self.files.popitem(last=False)
+            self.size -= len(content)
+
+    def get(self, filepath, stat):
+        """
+        Return contents of ``filepath`` of os.stat result ``stat``.
+
+        :returns: None when file is too large to cache.
+        """
+        from x84 import metrics
+        if stat.st_size > self.max_file_size:
+            return None
+        key = (stat.st_mtime, stat.st_size)
+        with self.lock:
+            entry = self._pop(filepath)
+            if entry is not None and entry[0] == key:
+                self._put(filepath, entry)
+                metrics.incr('web_static_cache', 'hit')
+                return entry[1]
+
+        metrics.incr('web_static_cache', 'miss')
+        with open(filepath, 'rb') as fin:
+            content = fin.read()
+        if len(content) == stat.st_size:
+            # otherwise, modified as it was read; cache it by next request.
+            with self.lock:
+                self._pop(filepath)
+                self._put(filepath, (key, content))
+        return content
+
+
+def parse_range(value, size):
+    """
+    Return byte range of header ``Range`` for file of ``size`` bytes.
+
+    :returns: inclusive ``(start, end)``, or None when ``value`` is not
+              a single byte range.
+    :raises ValueError: range is not satisfiable.
+    """
+    match = RANGE_PATTERN.match(value or '')
+    if match is None or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # suffix range, the final bytes of file
+        if not int(last):
+            raise ValueError('empty suffix range')
+        return max(0, size - int(last)), size - 1
+    start, end = int(first), (int(last) if last else size - 1)
+    if last and end < start:
+        return None
+    if start >= size:
+        raise ValueError('range begins after end of file')
+    return start, min(end, size - 1)
+
+
+def read_chunks(filepath, start, length):
+    """ Generate ``length`` bytes of ``filepath`` from offset ``start``. """
+    with open(filepath, 'rb') as fin:
+        fin.seek(start)
+        while length > 0:
+            chunk = fin.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def get_etag(stat):
+    """ Return entity tag of file by os.stat result ``stat``. """
+    return '{0:x}-{1:x}'.format(int(stat.st_mtime), stat.st_size)
+
 
 class StaticApp(object):
 
@@ -15,6 +146,9 @@ class StaticApp(object):
         '.js': 'text/javascript',
     }
 
+    #: cache of small files, set by :func:`web_module`.
+    cache = None
+
     def GET(self, filename):
         """ Respond to GET method request. """
         if not filename:
@@ -23,12 +157,7 @@ class StaticApp(object):
                                         filename.split('/')))
         myfile = os.path.join(StaticApp.static_root, file_url)
         if os.path.isfile(myfile):
-            # we're serving a file; use the proper mime type
-            mime = mimetypes.guess_type(myfile)
-            _, ext = os.path.splitext(myfile.lower())
-            mime = StaticApp.mime_types.get(ext, mime)
-            web.header('Content-Type', mime, unique=True)
-            return open(myfile, 'rb').read()
+            return self.serve_file(myfile)
         elif os.path.isdir(myfile):
             # we're serving a directory; try directory/index.html instead
             if not filename.endswith('/'):
@@ -37,6 +166,60 @@ class StaticApp(object):
         # path does not exist; return 404
         return web.notfound()
 
+    def serve_file(self, filepath):
+        """ Respond with contents of file ``filepath``. """
+        env = web.ctx.env
+        stat = os.stat(filepath)
+
+        # we're serving a file; use the proper mime type
+        _, ext = os.path.splitext(filepath.lower())
+        mime = (StaticApp.mime_types.get(ext) or
+                mimetypes.guess_type(filepath)[0] or
+                'application/octet-stream')
+        web.header('Content-Type', mime, unique=True)
+        web.header('Accept-Ranges', 'bytes')
+        web.header('Vary', 'Accept-Encoding')
+
+        etag = get_etag(stat)
+        byte_range = None
+        if env.get('HTTP_RANGE') and env.get('HTTP_IF_RANGE', '"{0}"'.format(
+                etag)).strip('" ') == etag:
+            try:
+                byte_range = parse_range(env['HTTP_RANGE'], stat.st_size)
+            except ValueError:
+                raise web.HTTPError(
+                    '416 Requested Range Not Satisfiable',
+                    {'Content-Range': 'bytes */{0}'.format(stat.st_size)})
+
+        if byte_range is None and 'gzip' in env.get('HTTP_ACCEPT_ENCODING',
+                                                     ''):
+            # serve pre-compressed variant, when current.
+            try:
+                gz_stat = os.stat(filepath + '.gz')
+            except OSError:
+                pass
+            else:
+                if gz_stat.st_mtime >= stat.st_mtime:
+                    filepath, stat = filepath + '.gz', gz_stat
+                    etag = '{0}-gz'.format(get_etag(stat))
+                    web.header('Content-Encoding', 'gzip')
+
+        # raises 304 Not Modified for a client holding a current copy.
+        web.modified(date=datetime.datetime.utcfromtimestamp(stat.st_mtime),
+                     etag=etag)
+
+        start, end = byte_range or (0, stat.st_size - 1)
+        if byte_range is not None:
+            web.ctx.status = '206 Partial Content'
+            web.header('Content-Range', 'bytes {0}-{1}/{2}'.format(
+                start, end, stat.st_size))
+        web.header('Content-Length', str(end - start + 1))
+
+        content = StaticApp.cache.get(filepath, stat)
+        if content is not None:
+            return content[start:end + 1]
+        return read_chunks(filepath, start, end - start + 1)
+
 
 def web_module():
     """ Expose our REST API. Run only once on server startup. """
@@ -47,6 +230,11 @@ def web_module():
                    or os.path.join(get_ini('system', 'scriptpath',
                    split=True)[0], 'www-static'))
     StaticApp.static_root = static_root
+    StaticApp.cache = FileCache(
+        maxsize=get_ini('web', 'static_cache_size', getter='getint'
+                        ) or 16777216,
+        max_file_size=get_ini('web', 'static_cache_file_size',
+                              getter='getint') or 262144)
 
     return {
         'urls': ('/www-static(/.*)?', 'static'),
@@ -1,12 +1,46 @@
 #!/usr/bin/env python2.7
-""" web server for x/84. """
+"""
+web server for x/84.
+
+The web server is run by a sub-process of the engine, so that TLS
+handshakes and the encoding of responses do not compete with the engine's
+main loop for the interpreter lock.  Requests are served by a pool of
+``threads`` worker threads, an option of section ``[web]``.
+
+The sub-process is supervised by thread ``webserve`` of the engine, which
+restarts it when it exits.  By pipe, the web server reports its status and
+metrics to the engine, which in turn answers requests for engine metrics
+and forwards ``profile`` events of target ``web``.  Databases are accessed
+directly, as of any other engine service, by :mod:`x84.db`.
+"""
+import multiprocessing
 import threading
 import traceback
 import logging
+import Queue
+import time
 import web
 import sys
 import os
 
+# local
+from x84 import metrics, profiler
+
+#: seconds to wait for a reply of the engine, by the web server process.
+ENGINE_TIMEOUT = 10
+
+#: maximum seconds to wait before restarting a failed web server process.
+RESTART_MAX = 60
+
+#: supervisor of web server process, in the engine process.
+SUPERVISOR = None
+
+#: pipe to engine, in the web server process.
+_ENGINE = None
+
+#: wsgi server, in the web server process.
+_SERVER = None
+
 
 class Favicon(object):
 
@@ -85,8 +119,30 @@ def get_urls_funcs(web_modules):
     return urls, funcs
 
 
+def metrics_middleware(app):
+    """ Return wsgi ``app`` recording the number and latency of requests. """
+    def wrapped(environ, start_response):
+        """ Serve request by ``app``, recording its status and latency. """
+        stime = time.time()
+        status = []
+
+        def _start_response(status_line, headers, exc_info=None):
+            status.append(status_line.split(' ', 1)[0])
+            return start_response(status_line, headers, exc_info)
+        try:
+            return app(environ, _start_response)
+        finally:
+            metrics.incr('web_requests', status[0] if status else 'error')
+            metrics.observe('web_latency', time.time() - stime)
+    return wrapped
+
+
 def server(urls, funcs):
     """ Main server thread for running the web server """
+    # pylint: disable=W0603,R0914
+    #         Using the global statement
+    #         Too many local variables
+    global _SERVER
     from x84.bbs import get_ini
     from web.wsgiserver import CherryPyWSGIServer
     from web.wsgiserver.ssl_pyopenssl import pyOpenSSLAdapter
@@ -107,6 +163,11 @@ def server(urls, funcs):
                    getter='getint'
                    ) or 8443
 
+    threads = get_ini(section='web',
+                      key='threads',
+                      getter='getint'
+                      ) or 10
+
     # List of ciphers made available, composed by haliphax without reference,
     # but apparently to prevent POODLE? This stuff is hard -- the best source
     # would probably be to compare by cloudflare's latest sslconfig file:
@@ -169,24 +230,224 @@ def server(urls, funcs):
 
     web.config.debug = False
 
-    log.info('https listening on {addr}:{port}/tcp'
-             .format(addr=addr, port=port))
+    # as web.httpserver.runsimple, with a pool of worker threads.
+    wsgi_app = web.httpserver.LogMiddleware(web.httpserver.StaticMiddleware(
+        metrics_middleware(app.wsgifunc())))
+    _SERVER = CherryPyWSGIServer((addr, port), wsgi_app,
+                                 numthreads=threads, server_name='localhost')
+
+    log.info('https listening on {addr}:{port}/tcp, {threads} threads'
+             .format(addr=addr, port=port, threads=threads))
+    if _ENGINE is not None:
+        _ENGINE.send('status', {'pid': os.getpid(), 'threads': threads})
 
     # Runs CherryPy WSGI server hosting WSGI app.wsgifunc().
-    web.httpserver.runsimple(app.wsgifunc(), (addr, port))  # blocking
+    _SERVER.start()  # blocking
+
+
+class EnginePipe(object):
+
+    """ Pipe of the web server process to its supervisor in the engine. """
+
+    def __init__(self, pipe):
+        """
+        Class initializer.
+
+        :param multiprocessing.Connection pipe: child end of pipe.
+        """
+        self.pipe = pipe
+        self.send_lock = threading.Lock()
+        self.request_lock = threading.Lock()
+        self.replies = Queue.Queue()
+
+    def send(self, event, data=None):
+        """ Send ``event`` and ``data`` to engine. """
+        with self.send_lock:
+            self.pipe.send((event, data))
+
+    def request(self, event, data=None):
+        """
+        Send ``event`` to engine, returning its reply.
+
+        :raises Queue.Empty: no reply within :data:`ENGINE_TIMEOUT`.
+        """
+        with self.request_lock:
+            # discard any late reply of a previous request
+            while not self.replies.empty():
+                self.replies.get_nowait()
+            self.send(event, data)
+            return self.replies.get(timeout=ENGINE_TIMEOUT)
+
+    def receive(self):
+        """ Receive events of engine until disconnected, then exit. """
+        log = logging.getLogger(__name__)
+        while True:
+            try:
+                event, data = self.pipe.recv()
+            except (EOFError, IOError):
+                break
+            if event == 'profile':
+                action, duration = data
+                profiler.handle_profile('web', action, duration)
+            else:
+                self.replies.put(data)
+        # the engine has exited; so must we, rather than hold our port.
+        log.info('engine disconnected, web server exiting.')
+        os._exit(0)  # pylint: disable=W0212
+
+    def report(self):
+        """ Send metrics and status of thread pool to engine, forever. """
+        while True:
+            time.sleep(metrics.REPORT_INTERVAL)
+            status = dict()
+            if _SERVER is not None and _SERVER.requests is not None:
+                # pylint: disable=W0212
+                #         Access to a protected member _threads
+                status['idle'] = _SERVER.requests.idle
+                status['threads'] = len(_SERVER.requests._threads)
+            self.send('metrics', metrics.collect(clear=True))
+            self.send('status', status)
+
+
+def serve_process(web_modules, pipe):
+    """ Target of web server sub-process, serving ``web_modules``. """
+    # pylint: disable=W0603
+    #         Using the global statement
+    global _ENGINE
+    _ENGINE = EnginePipe(pipe)
+    for target in (_ENGINE.receive, _ENGINE.report):
+        thread = threading.Thread(target=target, name='webserve-ipc')
+        thread.daemon = True
+        thread.start()
+    urls, funcs = get_urls_funcs(web_modules)
+    server(urls=urls, funcs=funcs)
+
+
+def engine_snapshot():
+    """ Return :func:`x84.metrics.snapshot` of the engine process. """
+    if _ENGINE is None:
+        return metrics.snapshot()
+    return _ENGINE.request('metrics-snapshot')
+
+
+class Supervisor(threading.Thread):
+
+    """
+    This thread runs the web server by a sub-process, restarting it on exit.
+
+    Restarts are delayed by one second, doubled for each consecutive failure
+    up to :data:`RESTART_MAX`; a web server running longer than that is not
+    considered to have failed consecutively.
+    """
+
+    def __init__(self, web_modules):
+        """
+        Class initializer.
+
+        :param list web_modules: names of web modules to serve.
+        """
+        threading.Thread.__init__(self, name='webserve')
+        self.daemon = True
+        self.web_modules = web_modules
+        self.process = None
+        self.pipe = None
+        self.lock = threading.Lock()
+        self.status = {'restarts': 0, 'threads': 0, 'idle': 0}
+        metrics.register_gauge('web_server', self.gauge)
+
+    def gauge(self):
+        """ Status of web server process. """
+        return dict(self.status, up=int(bool(
+            self.process is not None and self.process.is_alive())))
+
+    def send(self, event, data=None):
+        """ Send ``event`` and ``data`` to web server process. """
+        with self.lock:
+            if self.pipe is not None:
+                self.pipe.send((event, data))
+
+    def run(self):
+        """ Start web server process, restarting it when it exits. """
+        log = logging.getLogger(__name__)
+        failures = 0
+        while True:
+            pipe, child_pipe = multiprocessing.Pipe()
+            self.process = multiprocessing.Process(
+                target=serve_process, args=(self.web_modules, child_pipe),
+                name='webserve')
+            self.process.daemon = True
+            started = time.time()
+            self.process.start()
+            child_pipe.close()
+            with self.lock:
+                self.pipe = pipe
+            self.receive()
+            self.process.join()
+            with self.lock:
+                self.pipe = None
+            pipe.close()
+
+            if time.time() - started > RESTART_MAX:
+                failures = 0
+            delay = min(RESTART_MAX, 2 ** failures)
+            failures += 1
+            self.status['restarts'] += 1
+            log.error('web server exited with code {0}, restarting in '
+                      '{1}s.'.format(self.process.exitcode, delay))
+            time.sleep(delay)
+
+    def receive(self):
+        """ Receive events of web server process until it exits. """
+        log = logging.getLogger(__name__)
+        while True:
+            try:
+                if not self.pipe.poll(1):
+                    if self.process.is_alive():
+                        continue
+                    return
+                event, data = self.pipe.recv()
+            except (EOFError, IOError):
+                return
+            if event == 'status':
+                self.status.update(data)
+            elif event == 'metrics':
+                metrics.merge(data)
+            elif event == 'metrics-snapshot':
+                self.send(event, metrics.snapshot())
+            else:
+                log.error('unhandled event of web server: ({0}, {1!r})'
+                          .format(event, data))
+
+
+def handle_profile(action, duration):
+    """
+    Forward profile ``action`` to web server process.
+
+    :returns: False when the web server is not run by a sub-process.
+    :rtype: bool
+    """
+    if SUPERVISOR is None:
+        return False
+    SUPERVISOR.send('profile', (action, duration))
+    return True
 
 
 def main(background_daemon=True):
     """
     Entry point to configure and begin web server.
 
-    Called by x84/engine.py, function main() as unmanaged thread.
+    Called by x84/engine.py, function main() to start the web server
+    sub-process and its supervisor thread.
 
     :param bool background_daemon: When True (default), this function returns
-       and web modules are served in an unmanaged, background (daemon) thread.
-       Otherwise, function call to ``main()`` is blocking.
+       and web modules are served by a sub-process, supervised by a
+       background (daemon) thread.  Otherwise, function call to ``main()``
+       is blocking, and web modules are served by this process.
     :rtype: None
     """
+    # pylint: disable=W0603
+    #         Using the global statement
+    global SUPERVISOR
     from x84.bbs import get_ini
 
     log = logging.getLogger(__name__)
@@ -205,13 +466,12 @@ def main(background_daemon=True):
         return
 
     log.debug(u'Ready web modules: {0}'.format(web_modules))
-    urls, funcs = get_urls_funcs(web_modules)
 
     if background_daemon:
-        t = threading.Thread(target=server, args=(urls, funcs,))
-        t.daemon = True
-        t.start()
+        SUPERVISOR = Supervisor(web_modules)
+        SUPERVISOR.start()
     else:
+        urls, funcs = get_urls_funcs(web_modules)
         server(urls=urls, funcs=funcs)
 
 